@@ -1,64 +1,217 @@
 import os
 import json
-import openpyxl
+import contextvars
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.utils import make_msgid
+
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from clarification import ClarificationEngine
+from excel_export import write_workbook
+from llm_backends import LLMUnavailableError
+from llm_dispatcher import LLMDispatcher
+from price_list import catalog_match, is_new_product, merge_product_records
+from product_store import ProductTable
+from provenance import record_products
+from rule_extractor import RuleExtractor
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def parse_json_response(content: str) -> dict:
+    """
+    Разбирает JSON из ответа модели, даже если он обёрнут в ```json ... ``` или окружён текстом.
+    """
+    content = (content or "").strip()
+    if content.startswith("```"):
+        content = content.strip("`")
+        if content[:4].lower() == "json":
+            content = content[4:]
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        data = json.loads(content[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError(f"ожидался JSON-объект, получено {type(data).__name__}")
+    return data
+
+
+class ExtractedFields(dict):
+    """
+    Извлечённые поля; methods – каким способом найдено каждое непустое поле
+    ("rules" – RuleExtractor, "llm" – модель), для журнала provenance.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.methods = {}
+
 
 class SupplierLLMAgent:
     """
     LLM-агент для извлечения данных о товаре и генерации уточняющих вопросов.
-    Теперь работает с моделью "gpt-4o-mini".
+    Модель задаётся в LLM_MODEL (по умолчанию "gpt-4o-mini"), бэкенд – в LLM_BACKEND.
+    Запросы идут через LLMDispatcher, поэтому агента можно звать из нескольких потоков сразу.
+    Результаты извлечения кэшируются в LLMCache (если он передан): повторно присланный
+    текст не стоит ни вызова API, ни задержки. Уточняющие вопросы берутся из ClarificationEngine.
     """
-    def __init__(self, required_fields=None):
+    # Меняется при любой правке промпта извлечения, чтобы старые ответы из кэша не выдавались
+    PROMPT_VERSION = "3"
+
+    def __init__(self, required_fields=None, dispatcher=None, cache=None, clarification_cache=None, model=None):
         if required_fields is None:
             self.required_fields = ["product_name", "price", "dimensions", "weight", "material"]
         else:
             self.required_fields = required_fields
+        self.dispatcher = dispatcher or LLMDispatcher()
+        self.cache = cache
+        # Модель задаётся в LLM_MODEL; сам бэкенд (OpenAI, заглушка, запись) – в LLM_BACKEND
+        self.model = model or os.getenv("LLM_MODEL", "gpt-4o-mini")
+        # Извлечение и уточняющий вопрос одним вызовом (LLM_SINGLE_CALL=0 – двумя, как раньше)
+        self.single_call = os.getenv("LLM_SINGLE_CALL", "1").lower() in ("1", "true", "yes")
+        # Инкрементальное извлечение: у LLM спрашиваются только поля, которых ещё нет у поставщика
+        self.delta = os.getenv("LLM_DELTA_EXTRACTION", "1").lower() in ("1", "true", "yes")
+        # Уточняющие вопросы из кэша по набору недостающих полей (CLARIFICATION_CACHE=0 – всегда через LLM)
+        if clarification_cache is None:
+            clarification_cache = os.getenv("CLARIFICATION_CACHE", "1").lower() in ("1", "true", "yes")
+        self.clarifications = None
+        if clarification_cache:
+            # Вопрос из кэша – тоже вызов этапа clarification, только бесплатный: учитывается как попадание
+            self.clarifications = ClarificationEngine(
+                self.ask_clarification_llm,
+                on_hit=lambda: self.dispatcher.metrics.record_cache_hit("clarification", self.model),
+            )
+        # Детерминированные правила для цены, размеров, веса и материала (RULE_EXTRACTOR=0 – только LLM)
+        use_rules = os.getenv("RULE_EXTRACTOR", "1").lower() in ("1", "true", "yes")
+        self.rules = RuleExtractor(self.required_fields) if use_rules else None
 
-    def parse_supplier_answer(self, supplier_text: str) -> dict:
+    def parse_supplier_answer(self, supplier_text: str, known_data=None) -> dict:
         """
-        Отправляет текст поставщика в OpenAI и возвращает JSON-структуру с нужными полями.
+        Отправляет текст поставщика в LLM и возвращает JSON-структуру с нужными полями.
         Если поля отсутствуют, оставляет пустые строки.
+        Сначала работают правила (RuleExtractor): LLM спрашивается только о том,
+        что они не нашли, а если нашли всё – не вызывается вовсе.
+        В инкрементальном режиме (known_data – текущая запись поставщика) поля,
+        которые уже известны, у LLM не запрашиваются и возвращаются пустыми.
+        """
+        known_data = {k: v for k, v in (known_data or {}).items() if v} if self.delta else {}
+        found = self.rules.extract(supplier_text) if self.rules is not None else {}
+        fields = self._delta_fields(known_data, found)
+        if not fields:
+            return self._clean(found, found)
+        data = self._llm_extract(supplier_text, fields, known_data)
+        data.update(found)
+        return self._clean(data, found)
+
+    def _delta_fields(self, known_data: dict, found: dict) -> list:
         """
+        Поля, которые надо спросить у LLM: не найденные правилами и ещё не известные.
+        Название товара при известной записи спрашивается всегда, когда LLM всё равно вызывается,
+        а также когда правила нашли значения, расходящиеся с известными, или правил нет:
+        иначе письмо о другом товаре («А ещё предлагаем стул: 500 руб.») без названия
+        перезаписало бы текущий товар.
+        """
+        fields = [f for f in self.required_fields if not found.get(f) and not known_data.get(f)]
+        name = "product_name"
+        if not known_data or name not in self.required_fields or found.get(name) or name in fields:
+            return fields
+        conflict = any(
+            found.get(f) and known_data.get(f) and str(found[f]).strip().lower() != str(known_data[f]).strip().lower()
+            for f in self.required_fields
+        )
+        if fields or conflict or self.rules is None:
+            fields.insert(0, name)
+        return fields
+
+    def _llm_extract(self, supplier_text: str, fields, known_data=None) -> dict:
         system_prompt = (
             "Ты — помощник, который анализирует ответ поставщика. "
             "Нужно извлечь ключевые поля товара и вернуть JSON-структуру. "
             "Если данные отсутствуют, оставь пустую строку."
         )
+        known = ""
+        if known_data:
+            # Короткая справка о том, что уже известно, – чтобы не путать товар, но без повторного извлечения
+            known = (
+                f"Уже известно: {json.dumps(known_data, ensure_ascii=False)}\n"
+                "product_name – название товара, о котором это письмо: если поставщик пишет "
+                "о другом товаре, укажи его название, а не известное.\n"
+            )
         user_prompt = (
-            f"Поля, которые нужны: {', '.join(self.required_fields)}.\n"
+            f"Поля, которые нужны: {', '.join(fields)}.\n"
+            f"{known}"
             f"Вот ответ поставщика:\n---\n{supplier_text}\n---\n"
             "Верни результат ТОЛЬКО в формате JSON. "
-            "Пример: {{\"product_name\": \"...\", \"price\": \"...\", ...}}"
+            f"Пример: {json.dumps({f: '...' for f in fields})}"
         )
 
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                f"{json.dumps(known_data or {}, ensure_ascii=False, sort_keys=True)}\n{supplier_text}",
+                fields, self.PROMPT_VERSION, self.model
+            )
+            data = self.cache.get(cache_key)
+            if data is not None:
+                self.dispatcher.metrics.record_cache_hit("extract", self.model)
+                return {f: data.get(f, "") for f in fields}
+
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  #
+            response = self.dispatcher.chat(
+                model=self.model,  #
+                stage="extract",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
                 ],
-                temperature=0.0
+                temperature=0.0,
+                # Схема ответа только из запрошенных полей: модель не оборачивает ответ в markdown,
+                # не добавляет пояснений и не повторяет то, что уже известно
+                response_format=self._fields_schema(fields)
             )
 
-            content = response.choices[0].message.content
-            data = json.loads(content)
+            content = response.content
+            data = parse_json_response(content)
+            if cache_key is not None:
+                # Кэшируем только удачный разбор – ошибку стоит повторить
+                self.cache.set(cache_key, data)
+        except LLMUnavailableError:
+            # Недоступность LLM – не повод отвечать поставщику пустыми данными: письмо подождёт
+            raise
         except Exception as e:
             print(f"Ошибка при парсинге ответа LLM: {e}")
             data = {}
 
-        clean_data = {}
+        return {f: data.get(f, "") for f in fields}
+
+    @staticmethod
+    def _fields_schema(fields) -> dict:
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "supplier_fields",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {f: {"type": "string"} for f in fields},
+                    "required": list(fields),
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    def _clean(self, data: dict, found=None) -> ExtractedFields:
+        clean_data = ExtractedFields()
         for field in self.required_fields:
             clean_data[field] = data.get(field, "")
+            if clean_data[field]:
+                clean_data.methods[field] = "rules" if (found or {}).get(field) else "llm"
         return clean_data
 
 
@@ -68,28 +221,197 @@ class SupplierLLMAgent:
         """
         return all(data.get(field) for field in self.required_fields)
 
-    def generate_clarification_question(self, data: dict) -> str:
+    def extract_and_clarify(self, supplier_text: str, known_data=None):
         """
-        Если каких-то данных не хватает, генерирует уточняющий вопрос.
+        Один вызов LLM вместо двух: в режиме JSON модель возвращает и извлечённые поля,
+        и (если после них чего-то ещё не хватает) текст уточняющего вопроса.
+        Возвращает (поля, вопрос); вопрос пустой, если все данные собраны.
+        Известные поля не запрашиваются повторно только в инкрементальном режиме,
+        но для вопроса они учитываются всегда.
         """
-        missing_fields = [f for f in self.required_fields if not data.get(f)]
-        if not missing_fields:
-            return ""
+        known_data = {k: v for k, v in (known_data or {}).items() if v}
+        found = self.rules.extract(supplier_text) if self.rules is not None else {}
+        missing = self._delta_fields(known_data if self.delta else {}, found)
+        if not missing:
+            # Правила нашли всё недостающее – ни извлечения, ни вопроса не нужно
+            return self._clean(found, found), ""
+        system_prompt = (
+            "Ты — помощник, который ведёт переписку с поставщиком. "
+            "Извлеки из ответа поставщика ключевые поля товара. Если данные отсутствуют, оставь пустую строку. "
+            "Если с учётом уже известных данных каких-то полей всё ещё не хватает, напиши короткий "
+            "вежливый, но конкретный вопрос поставщику о недостающих деталях; иначе оставь вопрос пустым. "
+            "Отвечай только JSON-объектом вида "
+            "{\"fields\": {\"<поле>\": \"<значение>\", ...}, \"clarification\": \"<вопрос или пустая строка>\"}."
+        )
+        user_prompt = (
+            f"Поля, которые нужны: {', '.join(missing)}.\n"
+            f"Уже известно: {json.dumps(known_data, ensure_ascii=False)}\n"
+            "product_name – название товара, о котором это письмо: если поставщик пишет "
+            "о другом товаре, укажи его название, а не известное.\n"
+            f"Найдено правилами: {json.dumps(found, ensure_ascii=False)}\n"
+            f"Вот ответ поставщика:\n---\n{supplier_text}\n---"
+        )
+
+        cache_key = None
+        if self.cache is not None:
+            # Вопрос зависит и от уже известных данных, поэтому они входят в ключ
+            cache_key = self.cache.make_key(
+                f"{json.dumps(known_data, ensure_ascii=False, sort_keys=True)}\n{supplier_text}",
+                missing, f"combined-{self.PROMPT_VERSION}", self.model
+            )
+            result = self.cache.get(cache_key)
+            if result is not None:
+                self.dispatcher.metrics.record_cache_hit("extract_clarify", self.model)
+                fields = dict(result.get("fields") or {})
+                fields.update(found)
+                return self._clean(fields, found), result.get("clarification") or ""
+
+        try:
+            response = self.dispatcher.chat(
+                model=self.model,
+                stage="extract_clarify",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.0,
+                response_format={"type": "json_object"}
+            )
+            result = parse_json_response(response.content)
+            if not isinstance(result.get("fields"), dict):
+                raise ValueError("в ответе нет объекта fields")
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            print(f"Ошибка при извлечении данных и вопроса: {e}")
+            return self._clean(found, found), ""
+
+        fields = dict(result["fields"])
+        fields.update(found)
+        fields = self._clean(fields, found)
+        # Письмо о другом товаре: вопрос строится по его полям, а не поверх прежнего
+        merged = {} if is_new_product(known_data, fields) else dict(known_data)
+        merged.update({k: v for k, v in fields.items() if v})
+        question = str(result.get("clarification") or "").strip()
+        if self.is_data_complete(merged):
+            question = ""
+        return fields, question
+
+    def extract_products(self, blocks) -> list:
+        """
+        Map-reduce по большому прайсу: каждый блок строк – отдельный вызов LLM (параллельно,
+        в пределах квот диспетчера), результаты склеиваются в список товаров без дублей.
+        Стоимость растёт линейно с числом строк, и ни один промпт не упирается в контекст.
+        """
+        if not blocks:
+            return []
+        workers = min(len(blocks), self.dispatcher.max_concurrency)
+        # Потоки пула не наследуют контекст, а в нём – поставщик для учёта стоимости
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="price-list") as pool:
+            chunks = list(pool.map(lambda block: context.copy().run(self._extract_block, block), blocks))
+        records = [record for chunk in chunks for record in chunk]
+        return merge_product_records(records, self.required_fields)
 
+    def _extract_block(self, block: str) -> list:
         system_prompt = (
-            "Ты — человек, который общается с поставщиком. "
-            "Тебе не хватает части данных. Напиши вежливый, но конкретный вопрос, "
-            "чтобы попросить недостающие детали."
+            "Ты — помощник, который разбирает прайс-лист поставщика. "
+            "Для каждой строки с товаром верни его поля; если данных нет, оставь пустую строку. "
+            "Строки, которые не описывают товар (итоги, примечания), пропусти."
         )
         user_prompt = (
-            "Мне не хватает данных о следующих полях: "
-            f"{', '.join(missing_fields)}. "
-            "Сформулируй короткий вежливый запрос, чтобы получить эти детали."
+            f"Поля товара: {', '.join(self.required_fields)}.\n"
+            f"Фрагмент прайса (первая строка – шапка таблицы):\n---\n{block}\n---\n"
+            "Верни JSON вида {\"products\": [{...}, ...]}."
         )
 
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(block, self.required_fields, f"products-{self.PROMPT_VERSION}", self.model)
+            products = self.cache.get(cache_key)
+            if products is not None:
+                self.dispatcher.metrics.record_cache_hit("price_list", self.model)
+                return products
+
+        item_schema = self._fields_schema(self.required_fields)["json_schema"]["schema"]
+        try:
+            response = self.dispatcher.chat(
+                model=self.model,
+                stage="price_list",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.0,
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "price_list_products",
+                        "strict": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {"products": {"type": "array", "items": item_schema}},
+                            "required": ["products"],
+                            "additionalProperties": False,
+                        },
+                    },
+                }
+            )
+            products = parse_json_response(response.content).get("products") or []
+            products = [p for p in products if isinstance(p, dict)]
+            if cache_key is not None:
+                self.cache.set(cache_key, products)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            print(f"Ошибка при разборе блока прайса: {e}")
+            products = []
+        return products
+
+    def generate_clarification_question(self, data: dict, language: str = "ru") -> str:
+        """
+        Если каких-то данных не хватает, возвращает уточняющий вопрос.
+        С кэшем вопросов (ClarificationEngine) LLM зовётся только для нового набора полей.
+        """
+        missing_fields = [f for f in self.required_fields if not data.get(f)]
+        if not missing_fields:
+            return ""
+        if self.clarifications is not None:
+            return self.clarifications.question(missing_fields, language)
+        question = self.ask_clarification_llm(missing_fields, language)
+        return question or "Пожалуйста, уточните недостающие данные."
+
+    def ask_clarification_llm(self, missing_fields, language: str = "ru"):
+        """
+        Просит LLM сформулировать вопрос о недостающих полях. При ошибке возвращает None.
+        """
+        if language == "ru":
+            system_prompt = (
+                "Ты — человек, который общается с поставщиком. "
+                "Тебе не хватает части данных. Напиши вежливый, но конкретный вопрос, "
+                "чтобы попросить недостающие детали."
+            )
+            user_prompt = (
+                "Мне не хватает данных о следующих полях: "
+                f"{', '.join(missing_fields)}. "
+                "Сформулируй короткий вежливый запрос, чтобы получить эти детали."
+            )
+        else:
+            system_prompt = (
+                "You are a buyer writing to a supplier. Some product details are missing. "
+                "Write a polite but specific question asking for them."
+            )
+            user_prompt = (
+                f"Missing fields: {', '.join(missing_fields)}. "
+                f"Write a short polite request for these details in language '{language}'."
+            )
+
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Используем ту же модель для генерации вопроса
+            response = self.dispatcher.chat(
+                model=self.model,  # Используем ту же модель для генерации вопроса
+                stage="clarification",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
@@ -97,26 +419,52 @@ class SupplierLLMAgent:
                 temperature=0.7
             )
             # Доступ к содержимому через атрибуты
-            question = response.choices[0].message.content
+            return response.content
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             print(f"Ошибка при генерации уточняющего вопроса: {e}")
-            question = "Пожалуйста, уточните недостающие данные."
-        return question
+            return None
 
 
 class SupplierDataManager:
     """
     Хранит данные по каждому поставщику (ключ — email поставщика).
+    data – товар, о котором идёт переписка сейчас; все товары поставщика (из писем
+    и прайсов) – в колоночной таблице catalog (ProductTable).
+    Только в памяти; долговременное хранилище с тем же интерфейсом – SQLiteSupplierDataManager.
     """
-    def __init__(self):
+    def __init__(self, provenance=None):
         self.data = {}
+        self.catalog = ProductTable()
+        # Журнал изменений полей (ProvenanceLog), если нужен
+        self.provenance = provenance
+
+    @property
+    def products(self) -> dict:
+        """
+        Товары по поставщикам: {email: [запись, ...]}.
+        """
+        return {supplier: self.catalog.products(supplier) for supplier in self.catalog.suppliers()}
 
-    def update_data(self, sender_email: str, new_fields: dict):
-        if sender_email not in self.data:
+    def update_data(self, sender_email: str, new_fields: dict, source=None) -> bool:
+        """
+        Дописывает непустые поля поставщика. Возвращает, поменялось ли что-нибудь.
+        """
+        current = self.data.get(sender_email, {})
+        if not any(v and str(v) != str(current.get(k) or "") for k, v in new_fields.items()):
+            return False
+        if self.provenance is not None:
+            self.provenance.record(sender_email, new_fields, current, source)
+        match = catalog_match(current, new_fields)
+        if sender_email not in self.data or is_new_product(self.data[sender_email], new_fields):
+            # Поставщик перешёл к другому товару: прежний остаётся в каталоге, переписка – о новом
             self.data[sender_email] = {}
         for k, v in new_fields.items():
             if v:
                 self.data[sender_email][k] = v
+        self.catalog.upsert(sender_email, self.data[sender_email], overwrite=True, match=match)
+        return True
 
     def is_complete(self, sender_email: str, required_fields: list) -> bool:
         stored = self.data.get(sender_email, {})
@@ -125,6 +473,24 @@ class SupplierDataManager:
     def get_data(self, sender_email: str) -> dict:
         return self.data.get(sender_email, {})
 
+    def get_products(self, sender_email: str) -> list:
+        return self.catalog.products(sender_email)
+
+    def update_products(self, sender_email: str, records: list, fields: list, source=None):
+        """
+        Добавляет товары из прайса, склеивая дубли с уже известными.
+        Изменённые поля товаров пишутся в журнал provenance.
+        """
+        self.catalog.add_fields(fields)
+        record_products(self.provenance, self.catalog, sender_email, merge_product_records(records, fields),
+                        lambda record: self.catalog.upsert(sender_email, record), source)
+
+    def products_missing(self, field: str, supplier=None) -> list:
+        """
+        [(поставщик, товар), ...] без значения field – по битовой карте каталога.
+        """
+        return self.catalog.missing(field, supplier)
+
 
 class YandexEmailSender:
     """
@@ -136,11 +502,19 @@ class YandexEmailSender:
         self.sender_email = os.getenv("YANDEX_EMAIL")
         self.sender_password = os.getenv("YANDEX_PASSWORD")
 
-    def reply_to_sender(self, recipient_email: str, subject: str, body: str):
+    def reply_to_sender(self, recipient_email: str, subject: str, body: str, in_reply_to=None, references=()):
+        """
+        Отправляет письмо; с in_reply_to – ответом в ту же переписку (In-Reply-To / References).
+        Возвращает Message-ID отправленного письма или None при ошибке.
+        """
         msg = MIMEMultipart()
         msg['From'] = self.sender_email
         msg['To'] = recipient_email
         msg['Subject'] = subject
+        msg['Message-ID'] = make_msgid(domain=(self.sender_email or "localhost").rpartition("@")[2])
+        if in_reply_to:
+            msg['In-Reply-To'] = in_reply_to
+            msg['References'] = " ".join(list(references) + [in_reply_to])
         msg.attach(MIMEText(body, 'plain'))
 
         server = None
@@ -150,43 +524,39 @@ class YandexEmailSender:
             server.login(self.sender_email, self.sender_password)
             server.send_message(msg)
             print(f"Отправлено письмо на {recipient_email} с темой '{subject}'")
+            return msg['Message-ID']
         except Exception as e:
             print(f"Ошибка при отправке письма: {e}")
+            return None
         finally:
             if server:
                 server.quit()
 
 
-def save_supplier_data_to_excel(data: dict, filename="suppliers_data.xlsx"):
+def save_supplier_data_to_excel(data: dict, filename="suppliers_data.xlsx", products=None, names=None):
     """
     Сохраняет данные вида:
       { "supplier_email_1": {"product_name": "...", ...}, ... }
     в Excel, где каждая строка — один поставщик.
+    Товары из прайсов ({email: [запись, ...]}) пишутся на отдельный лист Products.
+    names – {ключ: адрес}, если данные хранятся под ID поставщиков (SupplierDirectory).
     """
-    # Собираем все поля, присутствующие в данных
-    all_fields = set()
-    for d in data.values():
-        all_fields.update(d.keys())
-
-    all_fields = list(all_fields)
-    if not all_fields:
+    names = names or {}
+    # Собираем все поля, присутствующие в данных (в порядке появления)
+    all_fields = list(dict.fromkeys(field for d in data.values() for field in d))
+    if not all_fields and not products:
         print("Нет данных для сохранения.")
         return
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Suppliers"
-
-    headers = ["supplier_email"] + all_fields
-    for col_index, field in enumerate(headers, start=1):
-        ws.cell(row=1, column=col_index, value=field)
-
-    row_index = 2
-    for supplier_email, fields_dict in data.items():
-        ws.cell(row=row_index, column=1, value=supplier_email)
-        for col_index, field in enumerate(all_fields, start=2):
-            ws.cell(row=row_index, column=col_index, value=fields_dict.get(field, ""))
-        row_index += 1
-
-    wb.save(filename)
+    sheets = [("Suppliers", ["supplier_email"] + all_fields, (
+        [names.get(supplier_email, supplier_email)] + [fields_dict.get(field, "") for field in all_fields]
+        for supplier_email, fields_dict in data.items()
+    ))]
+    if products:
+        product_fields = list(dict.fromkeys(k for records in products.values() for record in records for k in record))
+        sheets.append(("Products", ["supplier_email"] + product_fields, (
+            [names.get(supplier_email, supplier_email)] + [record.get(field, "") for field in product_fields]
+            for supplier_email, records in products.items() for record in records
+        )))
+    write_workbook(filename, sheets)
     print(f"Данные сохранены в {filename}")
@@ -0,0 +1,143 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class AttachmentStore:
+    """
+    Контентно-адресуемое хранилище вложений.
+    Каждое вложение лежит на диске один раз под SHA-256 своего содержимого
+    (root/ab/abcd....bin), рядом кэшируется извлечённый из него текст (....<вид>.txt).
+    Повторно присланный прайс стоит одного хэша и одной проверки вместо записи файла
+    и полного разбора. Когда суммарный размер превышает ATTACHMENT_STORE_MAX_BYTES,
+    удаляются давно не использованные вложения (LRU по времени последнего обращения).
+    """
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.getenv("ATTACHMENT_STORE_DIR", "attachments_store")
+        self.max_bytes = int(
+            max_bytes if max_bytes is not None else os.getenv("ATTACHMENT_STORE_MAX_BYTES", str(1024 ** 3))
+        )
+        self._lock = threading.Lock()
+        # digest -> размер на диске (вложение плюс кэш текста), от самого старого к свежему
+        self._entries = OrderedDict()
+        self._total = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}{suffix}")
+
+    def _scan(self):
+        """
+        Восстанавливает LRU-порядок после перезапуска по времени изменения файлов:
+        при каждом обращении к вложению оно обновляется.
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    found.append((os.path.getmtime(path), name[:-4]))
+                except OSError:
+                    continue
+        for _, digest in sorted(found):
+            size = self._disk_size(digest)
+            self._entries[digest] = size
+            self._total += size
+
+    def _disk_size(self, digest: str) -> int:
+        folder = os.path.join(self.root, digest[:2])
+        size = 0
+        try:
+            for name in os.listdir(folder):
+                if name.startswith(digest):
+                    size += os.path.getsize(os.path.join(folder, name))
+        except OSError:
+            pass
+        return size
+
+    def put(self, payload: bytes):
+        """
+        Сохраняет вложение (если такого ещё нет) и возвращает (digest, путь к файлу).
+        """
+        digest = hashlib.sha256(payload).hexdigest()
+        path = self._path(digest, ".bin")
+        with self._lock:
+            if digest in self._entries and os.path.exists(path):
+                self._touch(digest, path)
+                return digest, path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+            self._total -= self._entries.pop(digest, 0)
+            self._entries[digest] = len(payload)
+            self._total += len(payload)
+            self._evict(keep=digest)
+        return digest, path
+
+    def get_text(self, digest: str, kind: str):
+        """
+        Возвращает закэшированный текст вложения или None, если его ещё не разбирали.
+        """
+        path = self._path(digest, f".{kind}.txt")
+        with self._lock:
+            if digest not in self._entries:
+                return None
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                return None
+            self._touch(digest, self._path(digest, ".bin"))
+        return text
+
+    def set_text(self, digest: str, kind: str, text: str):
+        path = self._path(digest, f".{kind}.txt")
+        with self._lock:
+            if digest not in self._entries:
+                # Вложение успели вытеснить, пока его разбирали – кэшировать не к чему
+                return
+            # Перезаписываемый текст уже учтён в размере – считаем только разницу
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path) - old_size
+            self._entries[digest] += size
+            self._total += size
+            self._evict(keep=digest)
+
+    def _touch(self, digest: str, path: str):
+        self._entries.move_to_end(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self, keep: str):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            digest, size = next(iter(self._entries.items()))
+            if digest == keep:
+                break
+            del self._entries[digest]
+            self._total -= size
+            folder = os.path.join(self.root, digest[:2])
+            for name in os.listdir(folder):
+                if name.startswith(digest):
+                    try:
+                        os.remove(os.path.join(folder, name))
+                    except OSError as e:
+                        print(f"Не удалось удалить вложение {name} из хранилища: {e}")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,395 @@
+import os
+import time
+import signal
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+# Библиотека для чтения Excel
+import openpyxl
+
+from text_processing import estimate_tokens
+
+
+def read_text_file(file_path: str) -> str:
+    """
+    Считывает содержимое текстового файла (txt, csv и т.п.) в виде строки.
+    При необходимости можно усложнить, определяя кодировку через chardet.
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except Exception as e:
+        print(f"Ошибка чтения текстового файла {file_path}: {e}")
+        return ""
+
+def read_excel_file(file_path: str, max_rows=None, max_chars=None, max_tokens=None) -> str:
+    """
+    Потоково читает Excel-файл (XLSX) в режиме read_only и возвращает строки в виде текста.
+    Скрытые и пустые листы пропускаются. Чтение останавливается, как только исчерпан любой
+    из бюджетов – строк (EXCEL_MAX_ROWS), символов (EXCEL_MAX_CHARS) или токенов
+    (EXCEL_MAX_TOKENS); о том, что отброшено, в конце текста пишется пометка.
+    """
+    max_rows = int(max_rows if max_rows is not None else os.getenv("EXCEL_MAX_ROWS", "500"))
+    max_chars = int(max_chars if max_chars is not None else os.getenv("EXCEL_MAX_CHARS", "20000"))
+    max_tokens = int(max_tokens if max_tokens is not None else os.getenv("EXCEL_MAX_TOKENS", "6000"))
+
+    f = None
+    try:
+        # Файл передаём объектом: в хранилище вложений он лежит без расширения .xlsx,
+        # а по имени openpyxl отказывается открывать такие файлы
+        f = open(file_path, "rb")
+        wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"Ошибка чтения Excel-файла {file_path}: {e}")
+        if f is not None:
+            f.close()
+        return ""
+
+    all_text = []
+    used_chars = 0
+    used_tokens = 0
+    used_rows = 0
+    hidden = []
+    truncated = None
+    try:
+        sheets = [sheet for sheet in wb.worksheets if sheet.sheet_state == "visible"]
+        hidden = [sheet.title for sheet in wb.worksheets if sheet.sheet_state != "visible"]
+        for index, sheet in enumerate(sheets):
+            sheet_title_added = len(sheets) == 1
+            sheet_rows = 0
+            for row in sheet.iter_rows(values_only=True):
+                # Преобразуем каждую ячейку в строку, если не None
+                row_values = [str(v) for v in row if v is not None and str(v).strip()]
+                if not row_values:
+                    continue
+                line = ", ".join(row_values)
+                tokens = estimate_tokens(line)
+                if (used_rows >= max_rows or used_chars + len(line) > max_chars
+                        or used_tokens + tokens > max_tokens):
+                    total = sheet.max_row or 0
+                    truncated = (sheet.title, sheet_rows, total,
+                                 [s.title for s in sheets[index + 1:]])
+                    break
+                if not sheet_title_added:
+                    # Имя листа нужно только когда листов несколько
+                    all_text.append(f"[Лист {sheet.title}]")
+                    sheet_title_added = True
+                all_text.append(line)
+                used_chars += len(line) + 1
+                used_tokens += tokens
+                used_rows += 1
+                sheet_rows += 1
+            if truncated:
+                break
+    except Exception as e:
+        print(f"Ошибка чтения Excel-файла {file_path}: {e}")
+    finally:
+        wb.close()
+        f.close()
+
+    if truncated:
+        title, shown, total, rest = truncated
+        note = f"[Таблица обрезана: с листа {title} взято {shown} строк"
+        if total > shown:
+            note += f" из ~{total}"
+        if rest:
+            note += f", не прочитаны листы: {', '.join(rest)}"
+        all_text.append(note + "]")
+        print(f"Excel-файл {file_path} обрезан по бюджету ({max_rows} строк / {max_chars} символов / {max_tokens} токенов).")
+    if hidden:
+        all_text.append(f"[Скрытые листы пропущены: {', '.join(hidden)}]")
+    return "\n".join(all_text)
+
+
+def read_excel_row_blocks(file_path: str, rows_per_block=None, max_rows=None) -> list:
+    """
+    Потоково режет большой прайс (XLSX) на блоки по rows_per_block строк
+    (PRICE_LIST_ROWS_PER_CHUNK) для поблочного извлечения товаров. Первая непустая строка
+    листа считается шапкой и повторяется в каждом блоке, чтобы LLM знал, где какая колонка.
+    Читается не больше PRICE_LIST_MAX_ROWS строк; скрытые листы пропускаются.
+    """
+    rows_per_block = int(
+        rows_per_block if rows_per_block is not None else os.getenv("PRICE_LIST_ROWS_PER_CHUNK", "200")
+    )
+    max_rows = int(max_rows if max_rows is not None else os.getenv("PRICE_LIST_MAX_ROWS", "20000"))
+    blocks = []
+    used_rows = 0
+    try:
+        with open(file_path, "rb") as f:
+            wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+            try:
+                for sheet in wb.worksheets:
+                    if sheet.sheet_state != "visible":
+                        continue
+                    header = None
+                    rows = []
+                    for row in sheet.iter_rows(values_only=True):
+                        # Переводы строк внутри ячеек склеиваются: в блоке одна строка таблицы – одна строка текста
+                        values = ["" if v is None else " ".join(str(v).split()) for v in row]
+                        while values and not values[-1]:
+                            values.pop()
+                        if not any(values):
+                            continue
+                        line = " | ".join(values)
+                        if header is None:
+                            header = line
+                            continue
+                        rows.append(line)
+                        used_rows += 1
+                        if len(rows) == rows_per_block:
+                            blocks.append(_row_block(sheet.title, header, rows))
+                            rows = []
+                        if used_rows >= max_rows:
+                            break
+                    if rows:
+                        blocks.append(_row_block(sheet.title, header, rows))
+                    if used_rows >= max_rows:
+                        print(f"Прайс {file_path}: прочитано {max_rows} строк, остальное пропущено.")
+                        break
+            finally:
+                wb.close()
+    except Exception as e:
+        print(f"Ошибка чтения Excel-файла {file_path}: {e}")
+        return []
+    return blocks
+
+
+def _row_block(title: str, header: str, rows: list) -> str:
+    return f"[Лист {title}]\n{header}\n" + "\n".join(rows)
+
+
+def is_excel_attachment(content_type: str, filename: str) -> bool:
+    content_type = content_type.lower()
+    return "excel" in content_type or "spreadsheetml" in content_type or filename.lower().endswith(".xlsx")
+
+
+def is_text_attachment(content_type: str, filename: str) -> bool:
+    return content_type.lower() in ["text/plain", "text/csv"]
+
+
+def extract_attachment_text(file_path: str, content_type: str, filename: str) -> str:
+    """
+    Извлекает текст из сохранённого вложения. Выполняется в процессе-воркере,
+    поэтому модуль не тянет за собой ничего тяжелее openpyxl.
+    """
+    if is_text_attachment(content_type, filename):
+        return read_text_file(file_path)
+    if is_excel_attachment(content_type, filename):
+        return read_excel_file(file_path)
+    return ""
+
+
+def block_rows(blocks) -> int:
+    """
+    Сколько строк данных (без шапок) в блоках read_excel_row_blocks.
+    """
+    return sum(block.count("\n") - 1 for block in blocks)
+
+
+def parse_excel_attachment(file_path: str, content_type: str, filename: str) -> dict:
+    """
+    Разбор Excel-вложения, когда большие прайсы режутся на блоки; выполняется в процессе-воркере.
+    Прайс – таблица, где строк данных больше PRICE_LIST_ROWS_PER_CHUNK: {"blocks": [...]}
+    (см. read_excel_row_blocks). Обычная таблица – {"text": ...} из read_excel_file, с его бюджетами
+    и пометкой об обрезке; перечитывается она целиком, но это не больше PRICE_LIST_ROWS_PER_CHUNK строк.
+    """
+    if not is_excel_attachment(content_type, filename):
+        return {}
+    rows_per_block = int(os.getenv("PRICE_LIST_ROWS_PER_CHUNK", "200"))
+    blocks = read_excel_row_blocks(file_path, rows_per_block)
+    if block_rows(blocks) > rows_per_block:
+        return {"blocks": blocks}
+    return {"text": read_excel_file(file_path)}
+
+
+# Очередь, через которую воркер сообщает, что взялся за задачу (задаётся при старте воркера)
+_started_queue = None
+
+
+def _init_worker(queue):
+    global _started_queue
+    _started_queue = queue
+
+
+def _run_job(token, func, *args):
+    """
+    Обёртка задачи в воркере: сначала сообщает (token, pid) – с этого момента идёт таймаут файла.
+    """
+    _started_queue.put((token, os.getpid()))
+    return func(*args)
+
+
+@dataclass
+class AttachmentJob:
+    """
+    Вложение, сохранённое на диск и ожидающее разбора.
+    error – почему разобрать не удалось (таймаут, ошибка), пусто, если всё хорошо.
+    """
+    file_path: str
+    content_type: str
+    filename: str
+    digest: str = None
+    error: str = ""
+
+    @property
+    def kind(self) -> str:
+        """
+        Вид разбора – под ним извлечённый текст кэшируется в AttachmentStore.
+        """
+        return "excel" if is_excel_attachment(self.content_type, self.filename) else "text"
+
+    @property
+    def label(self) -> str:
+        if is_excel_attachment(self.content_type, self.filename):
+            return f"Содержимое Excel {self.filename}"
+        return f"Содержимое файла {self.filename}"
+
+
+class AttachmentExtractor:
+    """
+    Разбирает вложения в пуле процессов, чтобы тяжёлый XLSX не держал ни цикл приёма почты,
+    ни письма других поставщиков, а CPU-работа масштабировалась на все ядра.
+    Число воркеров – ATTACHMENT_WORKERS (по умолчанию по числу ядер),
+    ATTACHMENT_TIMEOUT – сколько секунд даётся на разбор одного файла; отсчёт идёт с момента,
+    когда воркер взялся за файл, а не с постановки в очередь.
+
+    Зависший воркер завершается, и пул пересоздаётся (под блокировкой: пул общий для всех
+    потоков подготовки писем). Задачи других писем, попавшие под пересоздание, отправляются
+    в новый пул заново, а не возвращаются пустыми.
+    """
+    # Сколько раз задача отправляется заново, если пул пересоздан из-за чужого файла
+    RESUBMITS = 2
+
+    def __init__(self, workers=None, timeout=None):
+        self.workers = int(workers or os.getenv("ATTACHMENT_WORKERS") or os.cpu_count() or 1)
+        self.timeout = float(timeout if timeout is not None else os.getenv("ATTACHMENT_TIMEOUT", "60"))
+        self._lock = threading.Lock()
+        self._tokens = itertools.count()
+        # token -> (pid, время старта) для задач, за которые воркер уже взялся
+        self._started = {}
+        self._generation = 0
+        self._pool, self._queue = self._new_pool()
+
+    def _new_pool(self):
+        queue = multiprocessing.Queue()
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(queue,))
+        threading.Thread(target=self._watch_started, args=(queue,), name="attachment-started", daemon=True).start()
+        return pool, queue
+
+    def _watch_started(self, queue):
+        while True:
+            try:
+                item = queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            token, pid = item
+            with self._lock:
+                self._started[token] = (pid, time.monotonic())
+
+    def _submit(self, func, job):
+        token = next(self._tokens)
+        with self._lock:
+            future = self._pool.submit(_run_job, token, func, job.file_path, job.content_type, job.filename)
+            return future, token, self._generation
+
+    def extract(self, jobs, func=None):
+        """
+        Генератор (job, text) в порядке готовности. Файл, не уложившийся в таймаут
+        или упавший, отдаётся с пустым текстом и причиной в job.error.
+        func(file_path, content_type, filename) – что делать с файлом в воркере
+        (по умолчанию extract_attachment_text).
+        """
+        func = func or extract_attachment_text
+        futures = {}
+        for job in jobs:
+            job.error = ""
+            future, token, generation = self._submit(func, job)
+            futures[future] = (job, token, generation, 0)
+        pending = set(futures)
+        try:
+            while pending:
+                with self._lock:
+                    starts = [self._started.get(futures[f][1]) for f in pending]
+                deadlines = [start[1] + self.timeout for start in starts if start is not None]
+                # Пока не все задачи начались, время их старта узнаём опросом
+                wait_for = min(deadlines) - time.monotonic() if deadlines else self.timeout
+                if len(deadlines) < len(pending):
+                    wait_for = min(wait_for, 0.2)
+                done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, token, generation, resubmits = futures.pop(future)
+                    with self._lock:
+                        self._started.pop(token, None)
+                    try:
+                        yield job, future.result()
+                    except BrokenProcessPool as e:
+                        if resubmits >= self.RESUBMITS:
+                            job.error = f"пул воркеров пересоздавался {resubmits} раз"
+                            print(f"Разбор вложения {job.filename} не удался: {job.error}")
+                            yield job, ""
+                            continue
+                        # Пул пересоздан из-за зависшего файла (своего письма или чужого) – заново
+                        self._restart_pool(generation)
+                        retry, retry_token, retry_generation = self._submit(func, job)
+                        futures[retry] = (job, retry_token, retry_generation, resubmits + 1)
+                        pending.add(retry)
+                    except Exception as e:
+                        job.error = str(e)
+                        print(f"Ошибка разбора вложения {job.filename}: {e}")
+                        yield job, ""
+                now = time.monotonic()
+                for future in list(pending):
+                    job, token, generation, _ = futures[future]
+                    with self._lock:
+                        start = self._started.get(token)
+                    if start is None or now - start[1] < self.timeout:
+                        continue
+                    pending.discard(future)
+                    futures.pop(future)
+                    job.error = f"разбор не уложился в {self.timeout:g} с"
+                    print(f"Разбор вложения {job.filename} не уложился в {self.timeout:g} с, воркер остановлен.")
+                    self._kill(token, start[0], generation)
+                    yield job, ""
+        finally:
+            with self._lock:
+                for job, token, _, _ in futures.values():
+                    self._started.pop(token, None)
+
+    def _kill(self, token, pid, generation):
+        """
+        Завершает воркер, зависший на задаче token, и пересоздаёт пул.
+        """
+        with self._lock:
+            self._started.pop(token, None)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self._restart_pool(generation)
+
+    def _restart_pool(self, generation):
+        """
+        ProcessPoolExecutor не умеет отменять уже запущенную задачу, а после гибели воркера
+        ломается целиком – поэтому пул создаётся заново. generation – поколение пула, которое
+        видел вызывающий: если пул уже пересоздан другим потоком, второй раз этого не делаем.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            old_pool, old_queue = self._pool, self._queue
+            self._pool, self._queue = self._new_pool()
+            self._generation += 1
+        for process in list((getattr(old_pool, "_processes", None) or {}).values()):
+            process.terminate()
+        old_pool.shutdown(wait=False, cancel_futures=True)
+        old_queue.put(None)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._queue.put(None)
@@ -0,0 +1,144 @@
+"""
+Сравнение быстрого пути (RuleExtractor) с извлечением только через LLM.
+
+    python benchmark_extraction.py                 # только правила
+    python benchmark_extraction.py --llm           # правила, LLM и гибрид (правила + LLM)
+    python benchmark_extraction.py --llm --file samples.jsonl
+
+Для --llm нужен OPENAI_API_KEY, локальная заглушка (OPENAI_BASE_URL, см. mock_llm_server.py)
+или другой бэкенд: LLM_BACKEND=mock или LLM_BACKEND=replay с записанными ответами (см. llm_backends.py).
+Формат --file: по строке JSON {"text": "...", "expected": {"price": "...", ...}}.
+"""
+import os
+import re
+import json
+import time
+import argparse
+
+from rule_extractor import RuleExtractor
+
+FIELDS = ["product_name", "price", "dimensions", "weight", "material"]
+
+SAMPLES = [
+    {"text": "Добрый день! Стол обеденный, цена 1 250 руб., размеры 120x60x75 см, вес 12,5 кг, массив дуба.",
+     "expected": {"product_name": "Стол обеденный", "price": "1250 руб.", "dimensions": "120x60x75 см",
+                  "weight": "12.5 кг", "material": "дуб"}},
+    {"text": "Наименование: Стул офисный\nЦена: 3500\nГабариты: 50 х 50 х 90 см\nВес: 7 кг\nМатериал: сталь",
+     "expected": {"product_name": "Стул офисный", "price": "3500", "dimensions": "50x50x90 см",
+                  "weight": "7 кг", "material": "сталь"}},
+    {"text": "Hello, the shelf costs $45.90 per unit, size 30*20*10 cm, weight 2.5 kg, stainless steel.",
+     "expected": {"product_name": "shelf", "price": "45.90 USD", "dimensions": "30x20x10 cm",
+                  "weight": "2.5 kg", "material": "нержавеющая сталь"}},
+    {"text": "Здравствуйте. Полка настенная из сосны, 80х25х2 см, 1,8 кг. Стоимость 990 ₽.",
+     "expected": {"product_name": "Полка настенная", "price": "990 руб.", "dimensions": "80x25x2 см",
+                  "weight": "1.8 кг", "material": "сосна"}},
+    {"text": "Ящик пластиковый, полипропилен. Цена за штуку 320 руб. Вес 600 г. Размер 40x30x20 см.",
+     "expected": {"product_name": "Ящик пластиковый", "price": "320 руб.", "dimensions": "40x30x20 см",
+                  "weight": "600 г", "material": "полипропилен"}},
+    {"text": "По вашему запросу: кресло, каркас металлический, обивка — кожа. Цена договорная.",
+     "expected": {"product_name": "кресло", "material": "кожа"}},
+    {"text": "Цена 100 руб за штуку или 90 руб от 100 штук. Размеры уточним завтра.",
+     "expected": {}},
+    {"text": "Лампа настольная. Алюминий. 1 200 руб. Высота 45 см.",
+     "expected": {"product_name": "Лампа настольная", "price": "1200 руб.", "material": "алюминий"}},
+    {"text": "Коробка картонная 600x400x400 мм, 0,7 кг, 45 руб.",
+     "expected": {"product_name": "Коробка картонная", "price": "45 руб.", "dimensions": "600x400x400 мм",
+                  "weight": "0.7 кг", "material": "картон"}},
+    {"text": "Вес: 35 кг\nРазмеры: 200 x 90 x 45 см\nМатериал: ЛДСП\nЦена: 15 400 руб.",
+     "expected": {"price": "15400 руб.", "dimensions": "200x90x45 см", "weight": "35 кг", "material": "ДСП"}},
+]
+
+
+def _norm(value) -> str:
+    return re.sub(r"[\s.,]", "", str(value or "")).lower().replace("х", "x").replace("×", "x")
+
+
+def _matches(got, expected) -> bool:
+    got, expected = _norm(got), _norm(expected)
+    return bool(got) and (got == expected or expected in got or got in expected)
+
+
+def score(results, samples):
+    """
+    Доля ожидаемых полей, которые заполнены (hit rate), и доля верных среди заполненных (precision).
+    """
+    filled = hits = correct = total = 0
+    for data, sample in zip(results, samples):
+        for field in FIELDS:
+            expected = sample["expected"].get(field)
+            total += 1 if expected else 0
+            if data.get(field):
+                filled += 1
+                hits += 1 if expected else 0
+                correct += 1 if expected and _matches(data[field], expected) else 0
+    return {
+        "hit_rate": hits / max(total, 1),
+        "precision": correct / max(filled, 1),
+    }
+
+
+def run_rules(samples, repeat=200):
+    rules = RuleExtractor(FIELDS)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = [rules.extract(s["text"]) for s in samples]
+    elapsed = (time.perf_counter() - started) / (repeat * len(samples))
+    return results, elapsed
+
+
+def run_agent(samples, use_rules):
+    os.environ["RULE_EXTRACTOR"] = "1" if use_rules else "0"
+    os.environ["CLARIFICATION_CACHE"] = "0"
+    from agent_logic import SupplierLLMAgent
+    from llm_dispatcher import LLMDispatcher
+
+    dispatcher = LLMDispatcher()
+    calls = []
+    original_chat = dispatcher.chat
+
+    def counting_chat(messages, model, **kwargs):
+        calls.append(sum(len(str(m.get("content") or "")) for m in messages))
+        return original_chat(messages, model, **kwargs)
+
+    dispatcher.chat = counting_chat
+    agent = SupplierLLMAgent(FIELDS, dispatcher=dispatcher, clarification_cache=False)
+    latencies, results = [], []
+    for sample in samples:
+        started = time.perf_counter()
+        results.append(agent.parse_supplier_answer(sample["text"]))
+        latencies.append(time.perf_counter() - started)
+    dispatcher.close()
+    return results, latencies, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения полей: правила против LLM")
+    parser.add_argument("--llm", action="store_true", help="запускать также LLM и гибрид")
+    parser.add_argument("--file", help="JSONL с примерами вместо встроенных")
+    args = parser.parse_args()
+
+    samples = SAMPLES
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+
+    results, per_message = run_rules(samples)
+    rule_score = score(results, samples)
+    complete = sum(1 for r in results if all(r.get(f) for f in FIELDS))
+    print(f"Правила:   hit rate {rule_score['hit_rate']:.0%}, точность {rule_score['precision']:.0%}, "
+          f"{per_message * 1e6:.0f} мкс на письмо, без LLM обошлись бы {complete}/{len(samples)} писем")
+
+    if not args.llm:
+        return
+    for title, use_rules in (("Только LLM", False), ("Гибрид", True)):
+        results, latencies, calls = run_agent(samples, use_rules)
+        llm_score = score(results, samples)
+        latencies.sort()
+        print(f"{title}: hit rate {llm_score['hit_rate']:.0%}, точность {llm_score['precision']:.0%}, "
+              f"вызовов LLM {len(calls)}, символов промпта {sum(calls)}, "
+              f"задержка p50 {latencies[len(latencies) // 2] * 1000:.0f} мс, "
+              f"всего {sum(latencies):.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import json
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ClarificationEngine:
+    """
+    Уточняющие вопросы поставщику по набору недостающих полей.
+    Вопрос зависит только от набора полей и языка, а при 5 обязательных полях наборов всего 31,
+    поэтому вопросы генерируются один раз (по нескольку вариантов, чтобы не повторяться
+    слово в слово), хранятся в CLARIFICATION_CACHE_FILE и выдаются по кругу.
+    LLM вызывается только для ещё не встречавшегося набора; warmup() заранее заполняет кэш.
+
+    generate(missing_fields, language) -> str или None – функция, спрашивающая LLM;
+    on_hit() вызывается, когда вопрос выдан из кэша без LLM (для учёта в LLMMetrics).
+    """
+    def __init__(self, generate, path=None, variants=None,
+                 fallback="Пожалуйста, уточните недостающие данные.", on_hit=None):
+        self.generate = generate
+        self.on_hit = on_hit
+        self.path = path or os.getenv("CLARIFICATION_CACHE_FILE", "clarification_questions.json")
+        self.variants = int(variants if variants is not None else os.getenv("CLARIFICATION_VARIANTS", "3"))
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._questions = self._load()
+        self._counters = {}
+
+    @staticmethod
+    def make_key(missing_fields, language: str) -> str:
+        return f"{language}|{','.join(sorted(set(missing_fields)))}"
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения кэша уточняющих вопросов {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._questions, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _add(self, key: str, questions):
+        questions = [q.strip() for q in questions if q and q.strip()]
+        if not questions:
+            return
+        with self._lock:
+            self._questions.setdefault(key, []).extend(questions)
+            self._save()
+
+    def covers(self, missing_fields, language: str = "ru") -> bool:
+        """
+        Есть ли в кэше вопросы для каждого непустого поднабора missing_fields – то есть
+        для любого набора, который может остаться незаполненным после разбора письма.
+        """
+        fields = sorted(set(missing_fields))
+        with self._lock:
+            return all(
+                self._questions.get(self.make_key(subset, language))
+                for size in range(1, len(fields) + 1)
+                for subset in itertools.combinations(fields, size)
+            )
+
+    def question(self, missing_fields, language: str = "ru") -> str:
+        """
+        Вопрос про недостающие поля: из кэша по кругу, а для нового набора – у LLM.
+        """
+        if not missing_fields:
+            return ""
+        key = self.make_key(missing_fields, language)
+        with self._lock:
+            variants = self._questions.get(key)
+            if variants:
+                counter = self._counters.setdefault(key, itertools.count())
+                question = variants[next(counter) % len(variants)]
+        if variants:
+            if self.on_hit is not None:
+                self.on_hit()
+            return question
+
+        question = self.generate(sorted(set(missing_fields)), language)
+        if not question or not question.strip():
+            return self.fallback
+        self._add(key, [question])
+        return question.strip()
+
+    def warmup(self, required_fields, languages=("ru",), workers=4):
+        """
+        Догенерирует недостающие варианты для всех непустых наборов полей.
+        Уже сохранённые в файле наборы не трогает, так что после первого запуска почти бесплатно.
+        """
+        tasks = []
+        for language in languages:
+            for size in range(1, len(required_fields) + 1):
+                for fields in itertools.combinations(sorted(required_fields), size):
+                    key = self.make_key(fields, language)
+                    with self._lock:
+                        have = len(self._questions.get(key, []))
+                    tasks += [(key, list(fields), language)] * max(0, self.variants - have)
+        if not tasks:
+            return 0
+
+        def run(task):
+            key, fields, language = task
+            try:
+                question = self.generate(fields, language)
+            except Exception as e:
+                # LLM недоступна – догенерируем при следующем запуске или по запросу
+                print(f"Не удалось прогреть вопрос для {key}: {e}")
+                return False
+            self._add(key, [question])
+            return bool(question)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clarify-warmup") as pool:
+            generated = sum(pool.map(run, tasks))
+        print(f"Кэш уточняющих вопросов прогрет: {generated} из {len(tasks)} вариантов.")
+        return generated
+
+    def warmup_in_background(self, required_fields, languages=("ru",), workers=4):
+        thread = threading.Thread(
+            target=self.warmup, args=(required_fields, languages, workers),
+            name="clarify-warmup", daemon=True
+        )
+        thread.start()
+        return thread
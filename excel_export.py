@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from contextlib import nullcontext
+
+import openpyxl
+
+
+def write_workbook(filename: str, sheets: list):
+    """
+    Пишет книгу потоково (openpyxl write_only: строки не держатся в памяти ячейками)
+    во временный файл и подменяет им filename атомарно – читатель никогда не видит
+    недописанный файл. sheets – [(название листа, заголовки, строки), ...].
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for title, headers, rows in sheets:
+        ws = wb.create_sheet(title)
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
+    tmp_path = f"{filename}.tmp"
+    try:
+        wb.save(tmp_path)
+        os.replace(tmp_path, filename)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _fields(records, first=()) -> list:
+    """
+    Поля всех записей в порядке первого появления (поля first – в начале).
+    """
+    fields = dict.fromkeys(first)
+    for record in records:
+        fields.update(dict.fromkeys(record))
+    return list(fields)
+
+
+class ExcelExporter:
+    """
+    Выгрузка данных поставщиков в Excel (EXCEL_EXPORT_FILE) в фоновом потоке.
+    Вместо пересборки книги на каждого закончившего поставщика изменения копятся:
+    mark_dirty(поставщик) только помечает его, а поток выгружает книгу раз в
+    EXCEL_EXPORT_INTERVAL секунд или сразу, как помечено EXCEL_EXPORT_BATCH поставщиков.
+
+    Строки всех поставщиков держатся готовыми в памяти; при выгрузке из data_manager
+    перечитываются только помеченные, остальные берутся как есть. Нет изменений – нет и выгрузки.
+    names(ключ) -> адрес для первого столбца, если данные хранятся под ID поставщиков;
+    fields – порядок столбцов (остальные поля идут за ними).
+    """
+    def __init__(self, data_manager, filename=None, interval=None, batch=None, names=None, lock=None,
+                 fields=()):
+        self.data_manager = data_manager
+        self.filename = filename or os.getenv("EXCEL_EXPORT_FILE", "suppliers_data.xlsx")
+        self.interval = float(interval if interval is not None else os.getenv("EXCEL_EXPORT_INTERVAL", "30"))
+        self.batch = int(batch if batch is not None else os.getenv("EXCEL_EXPORT_BATCH", "50"))
+        self.names = names
+        self.fields = list(fields)
+        # Блокировка, под которой пишется data_manager (data_lock в mail_reciver)
+        self.lock = lock
+        self._rows = {}
+        self._products = {}
+        self._labels = {}
+        self._primed = False
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.exports = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="excel-export", daemon=True)
+            self._thread.start()
+        return self
+
+    def mark_dirty(self, supplier: str):
+        with self._dirty_lock:
+            self._dirty.add(supplier)
+            full = len(self._dirty) >= self.batch
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка выгрузки в {self.filename}: {e}")
+
+    def _refresh(self, supplier: str):
+        with self.lock or nullcontext():
+            data = dict(self.data_manager.get_data(supplier))
+            products = list(self.data_manager.get_products(supplier))
+        for cache, value in ((self._rows, data), (self._products, products)):
+            if value:
+                cache[supplier] = value
+            else:
+                cache.pop(supplier, None)
+        if supplier not in self._labels:
+            self._labels[supplier] = self.names(supplier) if self.names is not None else supplier
+
+    def flush(self) -> bool:
+        """
+        Выгружает книгу, если с прошлой выгрузки что-то поменялось. Возвращает, была ли выгрузка.
+        """
+        with self._export_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return False
+            if not self._primed:
+                # Первая выгрузка: нужны строки всех поставщиков, а не только помеченных
+                with self.lock or nullcontext():
+                    known = list(self.data_manager.data.keys()) + list(self.data_manager.products.keys())
+                # Порядок строк – порядок поставщиков в data_manager, новые добавляются в конец
+                dirty = list(dict.fromkeys(known + list(dirty)))
+                self._primed = True
+            started = time.monotonic()
+            for supplier in dirty:
+                self._refresh(supplier)
+
+            fields = _fields(self._rows.values(), self.fields)
+            sheets = [("Suppliers", ["supplier_email"] + fields, (
+                [self._labels[s]] + [data.get(f, "") for f in fields] for s, data in self._rows.items()
+            ))]
+            if self._products:
+                product_fields = _fields((r for records in self._products.values() for r in records), self.fields)
+                sheets.append(("Products", ["supplier_email"] + product_fields, (
+                    [self._labels[s]] + [r.get(f, "") for f in product_fields]
+                    for s, records in self._products.items() for r in records
+                )))
+            try:
+                write_workbook(self.filename, sheets)
+            except Exception:
+                # Не записалось – поставщики остаются помеченными до следующей попытки
+                with self._dirty_lock:
+                    self._dirty.update(dirty)
+                raise
+            self.exports += 1
+            print(f"Данные сохранены в {self.filename}: {len(self._rows)} поставщиков, "
+                  f"обновлено {len(dirty)}, {time.monotonic() - started:.2f} с")
+            return True
+
+    def close(self):
+        """
+        Останавливает поток и выгружает то, что ещё не выгружено.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Ошибка выгрузки в {self.filename}: {e}")
@@ -0,0 +1,363 @@
+"""
+Помощники для «ленивой» загрузки писем по IMAP:
+  - разбор ответов FETCH (включая литералы) и BODYSTRUCTURE;
+  - выбор MIME-частей, которые реально нужны пайплайну (текст, CSV, Excel);
+  - сборка облегчённого письма только из скачанных частей.
+"""
+import re
+import uuid
+import base64
+from dataclasses import dataclass, field
+from email.header import decode_header, make_header
+from email.utils import encode_rfc2231
+from urllib.parse import unquote
+
+# Вложения, которые пайплайн умеет читать (см. read_text_file / read_excel_file)
+WANTED_EXTENSIONS = (".txt", ".csv", ".xls", ".xlsx")
+WANTED_SUBTYPES = ("plain", "html", "csv")
+
+
+@dataclass
+class BodyPart:
+    """
+    Листовая MIME-часть из BODYSTRUCTURE.
+    """
+    section: str
+    maintype: str
+    subtype: str
+    params: dict = field(default_factory=dict)
+    encoding: str = "7BIT"
+    size: int = 0
+    disposition: str = ""
+    filename: str = ""
+
+    @property
+    def content_type(self) -> str:
+        return f"{self.maintype}/{self.subtype}"
+
+    @property
+    def is_attachment(self) -> bool:
+        return self.disposition == "attachment"
+
+
+class _Literal(bytes):
+    """
+    Маркер для литерала {N}: его содержимое никогда не разбирается как атом.
+    """
+
+
+def _tokenize(chunks):
+    """
+    Превращает ответ imaplib (bytes и кортежи (префикс, литерал)) в плоский список токенов:
+    "(" / ")" / str для атомов и строк / _Literal для литералов / None для NIL.
+    """
+    tokens = []
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            text, literal = chunk
+        else:
+            text, literal = chunk, None
+        if text is None:
+            continue
+        _tokenize_text(text, tokens)
+        if literal is not None:
+            # Префикс заканчивается на {N} – этот токен заменяем самим литералом
+            if tokens and isinstance(tokens[-1], str) and re.fullmatch(r"\{\d+\}", tokens[-1]):
+                tokens.pop()
+            tokens.append(_Literal(literal))
+    return tokens
+
+
+def _tokenize_text(text, tokens):
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i:i + 1]
+        if c in (b" ", b"\r", b"\n"):
+            i += 1
+        elif c in (b"(", b")"):
+            tokens.append(c.decode())
+            i += 1
+        elif c == b'"':
+            i += 1
+            buf = bytearray()
+            while i < n and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b"\\":
+                    i += 1
+                buf += text[i:i + 1]
+                i += 1
+            i += 1
+            tokens.append(bytes(buf).decode("utf-8", errors="replace"))
+        else:
+            # Атом; секции вида BODY[HEADER.FIELDS (FROM)]<0> содержат пробелы внутри скобок
+            start, depth = i, 0
+            while i < n:
+                c = text[i:i + 1]
+                if c == b"[":
+                    depth += 1
+                elif c == b"]":
+                    depth -= 1
+                elif depth == 0 and c in (b" ", b"(", b")", b"\r", b"\n"):
+                    break
+                i += 1
+            atom = text[start:i].decode("utf-8", errors="replace")
+            tokens.append(None if atom.upper() == "NIL" else atom)
+
+
+def _build(tokens):
+    """
+    Собирает вложенные списки из токенов.
+    """
+    stack = [[]]
+    for tok in tokens:
+        if tok == "(":
+            stack.append([])
+        elif tok == ")":
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(tok)
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_response(data) -> list:
+    """
+    Разбирает результат IMAP4.fetch / IMAP4.uid('FETCH', ...) в список словарей
+    {"UID": 12, "RFC822.SIZE": 3456, "BODYSTRUCTURE": [...], "BODY[1]": b"..."} – по одному на письмо.
+    Имена элементов приводятся к верхнему регистру, PEEK убирается сервером.
+    """
+    items = _build(_tokenize([d for d in data if d is not None]))
+    results = []
+    i = 0
+    while i < len(items):
+        # Формат: <seq> (<имя> <значение> ...)
+        if i + 1 < len(items) and isinstance(items[i + 1], list):
+            attrs = items[i + 1]
+            msg = {}
+            for j in range(0, len(attrs) - 1, 2):
+                name = attrs[j].upper() if isinstance(attrs[j], str) else str(attrs[j])
+                value = attrs[j + 1]
+                if name in ("UID", "RFC822.SIZE") and isinstance(value, str):
+                    value = int(value)
+                if isinstance(value, _Literal):
+                    value = bytes(value)
+                msg[name] = value
+            results.append(msg)
+            i += 2
+        else:
+            i += 1
+    return results
+
+
+def _decode_word(value) -> str:
+    if not value:
+        return ""
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def _params(raw) -> dict:
+    if not isinstance(raw, list):
+        return {}
+    params = {}
+    for k, v in zip(raw[0::2], raw[1::2]):
+        if not isinstance(k, str):
+            continue
+        k = k.lower()
+        if k.endswith("*"):
+            # RFC 2231: filename*=utf-8''%D0%9F%D1%80...
+            charset, _, encoded = _as_str(v).partition("''")
+            try:
+                params[k[:-1]] = unquote(encoded, encoding=charset or "utf-8", errors="replace")
+            except LookupError:
+                params[k[:-1]] = unquote(encoded)
+        else:
+            params.setdefault(k, _decode_word(v))
+    return params
+
+
+def _as_str(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value or ""
+
+
+def parse_bodystructure(structure, prefix="") -> list:
+    """
+    Возвращает список листовых частей (BodyPart) с номерами секций для BODY[section].
+    Вложенные message/rfc822 считаются одной частью – пайплайн их не разбирает.
+    """
+    if structure and isinstance(structure[0], list):
+        parts = []
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            section = f"{prefix}.{index}" if prefix else str(index)
+            parts.extend(parse_bodystructure(child, section))
+        return parts
+
+    section = prefix or "1"
+    maintype = _as_str(structure[0]).lower()
+    subtype = _as_str(structure[1]).lower()
+    params = _params(structure[2])
+    encoding = _as_str(structure[5]).upper() or "7BIT"
+    try:
+        size = int(structure[6])
+    except (TypeError, ValueError, IndexError):
+        size = 0
+
+    # Расширенные поля начинаются после lines (text) или envelope/body/lines (message/rfc822)
+    ext = 7
+    if maintype == "text":
+        ext = 8
+    elif maintype == "message" and subtype == "rfc822":
+        ext = 10
+    disposition, disp_params = "", {}
+    if len(structure) > ext + 1 and isinstance(structure[ext + 1], list) and structure[ext + 1]:
+        disposition = _as_str(structure[ext + 1][0]).lower()
+        if len(structure[ext + 1]) > 1:
+            disp_params = _params(structure[ext + 1][1])
+    filename = disp_params.get("filename") or params.get("name", "")
+
+    return [BodyPart(section, maintype, subtype, params, encoding, size, disposition, filename)]
+
+
+def is_wanted_part(part: BodyPart) -> bool:
+    """
+    Нужна ли часть пайплайну: тексты писем, CSV/TXT и Excel-вложения.
+    Картинки, PDF и прочее не скачиваются вовсе.
+    """
+    ctype = part.content_type
+    filename = part.filename.lower()
+    if part.maintype == "text" and part.subtype in WANTED_SUBTYPES:
+        return True
+    if "excel" in ctype or "spreadsheetml" in ctype:
+        return True
+    return bool(filename) and filename.endswith(WANTED_EXTENSIONS)
+
+
+def encode_mailbox_name(name: str) -> str:
+    """
+    Кодирует имя папки в IMAP modified UTF-7 (RFC 3501, 5.1.3): "Поставщики" -> "&BB8EPgRBBEIEMAQyBEkEOAQ6BDg-".
+    Чисто ASCII-имена возвращаются как есть, поэтому уже закодированное имя тоже можно передать.
+    """
+    if name.isascii():
+        return name
+    out, buf = [], []
+
+    def flush():
+        if buf:
+            encoded = base64.b64encode("".join(buf).encode("utf-16-be")).decode("ascii")
+            out.append("&" + encoded.rstrip("=").replace("/", ",") + "-")
+            buf.clear()
+
+    for ch in name:
+        if 0x20 <= ord(ch) <= 0x7e:
+            flush()
+            out.append("&-" if ch == "&" else ch)
+        else:
+            buf.append(ch)
+    flush()
+    return "".join(out)
+
+
+def compress_uid_set(uids) -> str:
+    """
+    [1, 2, 3, 7, 9, 10] -> "1:3,7,9:10"
+    """
+    ranges = []
+    uids = sorted(set(uids))
+    start = prev = None
+    for uid in uids:
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def _strip_content_headers(header_bytes: bytes) -> bytes:
+    """
+    Убирает из заголовка письма Content-Type / Content-Transfer-Encoding (с продолжениями строк),
+    чтобы подставить структуру собранного облегчённого письма.
+    """
+    out = []
+    skip = False
+    for line in header_bytes.splitlines(keepends=True):
+        if line in (b"\r\n", b"\n"):
+            break
+        if line[:1] in (b" ", b"\t"):
+            if not skip:
+                out.append(line)
+            continue
+        name = line.split(b":", 1)[0].strip().lower()
+        skip = name in (b"content-type", b"content-transfer-encoding", b"mime-version")
+        if not skip:
+            out.append(line)
+    return b"".join(out)
+
+
+def _part_headers(part: BodyPart) -> bytes:
+    params = "".join(
+        f'; {k}="{v}"' for k, v in part.params.items() if k == "charset" and v
+    )
+    lines = [
+        f"Content-Type: {part.content_type}{params}",
+        f"Content-Transfer-Encoding: {part.encoding}",
+    ]
+    if part.is_attachment or (part.filename and part.maintype != "text"):
+        if part.filename.isascii():
+            lines.append(f'Content-Disposition: attachment; filename="{part.filename}"')
+        else:
+            lines.append(f"Content-Disposition: attachment; filename*={encode_rfc2231(part.filename, 'utf-8')}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+def _write_body(out, body):
+    if isinstance(body, (bytes, bytearray)):
+        out.write(body)
+    else:
+        for chunk in body:
+            out.write(chunk)
+
+
+def write_partial_message(out, header_bytes: bytes, parts: list, bodies: dict, multipart: bool):
+    """
+    Пишет в файловый объект out облегчённое письмо: исходные заголовки (полностью или только
+    нужные поля) + только скачанные части; Content-Type собирается заново из BODYSTRUCTURE.
+    bodies: {section: raw_bytes} в исходной кодировке передачи (base64, quoted-printable...);
+    вместо bytes можно передать итератор кусков – тогда большая часть не держится в памяти целиком.
+    """
+    if not multipart:
+        out.write(_strip_content_headers(header_bytes))
+        if parts:
+            out.write(b"MIME-Version: 1.0\r\n")
+            out.write(_part_headers(parts[0]))
+            _write_body(out, bodies.get(parts[0].section, b""))
+        else:
+            out.write(b"\r\n")
+        return
+
+    boundary = f"=_partial_{uuid.uuid4().hex}"
+    out.write(_strip_content_headers(header_bytes))
+    out.write(b"MIME-Version: 1.0\r\n")
+    out.write(f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode())
+    for part in parts:
+        out.write(f"--{boundary}\r\n".encode())
+        out.write(_part_headers(part))
+        _write_body(out, bodies.get(part.section, b""))
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
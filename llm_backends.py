@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from dataclasses import dataclass, field, asdict
+from email.utils import parsedate_to_datetime
+
+
+class TransientLLMError(Exception):
+    """
+    Временный сбой бэкенда (сеть, таймаут, 5xx): запрос стоит повторить.
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedLLMError(TransientLLMError):
+    """
+    Бэкенд ответил 429: квота общая, поэтому ждать должны все запросы.
+    """
+
+
+class LLMUnavailableError(Exception):
+    """
+    LLM сейчас недоступна: повторы исчерпаны или разомкнут автомат (CircuitBreaker).
+    Письмо в таком случае не обрабатывается «как есть», а ждёт восстановления.
+    """
+
+
+class ReplayMissError(Exception):
+    """
+    В записи нет ответа на такой запрос (режим replay).
+    """
+
+
+@dataclass
+class LLMUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+@dataclass
+class LLMResponse:
+    """
+    Ответ любого бэкенда: текст первого варианта и расход токенов.
+    """
+    content: str
+    model: str = ""
+    usage: LLMUsage = field(default_factory=LLMUsage)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            content=data.get("content") or "",
+            model=data.get("model") or "",
+            usage=LLMUsage(**(data.get("usage") or {})),
+        )
+
+
+class LLMBackend:
+    """
+    Интерфейс бэкенда chat completions для SupplierLLMAgent (через LLMDispatcher).
+    complete() – корутина; временные сбои сообщаются через TransientLLMError.
+    """
+    name = "base"
+
+    async def complete(self, messages, model, **kwargs) -> LLMResponse:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def _retry_after(error) -> float:
+    """
+    Сколько секунд просит подождать сервер (retry-after-ms / Retry-After), или None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI API (или совместимый сервер: OPENAI_BASE_URL, например mock_llm_server.py).
+    Один клиент на процесс с пулом keep-alive соединений (LLM_POOL_SIZE) и явными
+    таймаутами: LLM_TIMEOUT на весь ответ, LLM_CONNECT_TIMEOUT на установку соединения.
+    """
+    name = "openai"
+
+    def __init__(self, api_key=None, base_url=None, timeout=None, connect_timeout=None, pool_size=None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.timeout = float(timeout if timeout is not None else os.getenv("LLM_TIMEOUT", "30"))
+        self.connect_timeout = float(
+            connect_timeout if connect_timeout is not None else os.getenv("LLM_CONNECT_TIMEOUT", "5")
+        )
+        self.pool_size = int(pool_size if pool_size is not None else os.getenv("LLM_POOL_SIZE", "20"))
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60.0,
+                ),
+            )
+            # Повторы делает диспетчер, с учётом общей паузы по 429 и автомата
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                http_client=http_client,
+            )
+        return self._client
+
+    async def complete(self, messages, model, **kwargs) -> LLMResponse:
+        from openai import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+        try:
+            response = await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except RateLimitError as e:
+            raise RateLimitedLLMError(str(e), _retry_after(e)) from e
+        except (APIConnectionError, InternalServerError) as e:
+            # APIConnectionError включает и таймауты (APITimeoutError)
+            raise TransientLLMError(f"{type(e).__name__}: {e}", _retry_after(e)) from e
+        except APIStatusError as e:
+            # 408 и 409 – временные; остальные 4xx (ключ, модель, запрос) повтором не лечатся
+            if e.status_code in (408, 409):
+                raise TransientLLMError(f"{type(e).__name__}: {e}", _retry_after(e)) from e
+            raise
+        usage = getattr(response, "usage", None)
+        return LLMResponse(
+            content=response.choices[0].message.content or "",
+            model=getattr(response, "model", model) or model,
+            usage=LLMUsage(
+                prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+                total_tokens=getattr(usage, "total_tokens", 0) or 0,
+            ),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+
+def mock_content(messages, response_format=None, default_json=None, default_text=None) -> str:
+    """
+    Детерминированный ответ заглушки: для JSON-схемы – объект ровно с её полями
+    (значения из MOCK_LLM_JSON, если там есть), для режима JSON – MOCK_LLM_JSON,
+    иначе – MOCK_LLM_TEXT. Общая для MockBackend и mock_llm_server.py.
+    """
+    default_json = default_json if default_json is not None else os.getenv("MOCK_LLM_JSON", "{}")
+    default_text = default_text if default_text is not None else os.getenv(
+        "MOCK_LLM_TEXT", "Пожалуйста, уточните недостающие данные."
+    )
+    response_format = response_format or {}
+    schema = (response_format.get("json_schema") or {}).get("schema")
+    if schema:
+        try:
+            values = json.loads(default_json)
+        except ValueError:
+            values = {}
+        return json.dumps(_fill_schema(schema, values if isinstance(values, dict) else {}), ensure_ascii=False)
+    prompt = " ".join(str(m.get("content") or "") for m in messages)
+    if response_format or "JSON" in prompt:
+        return default_json
+    return default_text
+
+
+def _fill_schema(schema: dict, values: dict):
+    if schema.get("type") == "object":
+        return {
+            key: values[key] if key in values and not isinstance(values[key], dict)
+            else _fill_schema(sub, values.get(key) if isinstance(values.get(key), dict) else {})
+            for key, sub in (schema.get("properties") or {}).items()
+        }
+    if schema.get("type") == "array":
+        return []
+    return ""
+
+
+class MockBackend(LLMBackend):
+    """
+    Детерминированная заглушка прямо в процессе, без сети: задержка latency секунд,
+    доля ошибок error_rate (поровну 429 и 5xx), фиксированное зерно генератора.
+    Для нагрузочных прогонов пайплайна без ключа и без сервера.
+    """
+    name = "mock"
+
+    def __init__(self, latency=None, error_rate=None, seed=None):
+        self.latency = float(latency if latency is not None else os.getenv("MOCK_LLM_LATENCY", "0.5"))
+        self.error_rate = float(error_rate if error_rate is not None else os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self._random = random.Random(int(seed if seed is not None else os.getenv("MOCK_LLM_SEED", "0")))
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    async def complete(self, messages, model, **kwargs) -> LLMResponse:
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+        await asyncio.sleep(self.latency)
+        if roll < self.error_rate / 2:
+            raise RateLimitedLLMError("mock: rate limit", retry_after=1.0)
+        if roll < self.error_rate:
+            raise TransientLLMError("mock: server error")
+        content = mock_content(messages, kwargs.get("response_format"))
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 3 + 1
+        completion_tokens = len(content) // 3 + 1
+        return LLMResponse(content, model, LLMUsage(prompt_tokens, completion_tokens, prompt_tokens + completion_tokens))
+
+
+class RecordReplayBackend(LLMBackend):
+    """
+    Запись и воспроизведение ответов (LLM_REPLAY_FILE, JSONL).
+    В режиме record запросы идут во внутренний бэкенд, а ответы дописываются в файл;
+    в режиме replay ответы берутся только из файла – прогоны пайплайна воспроизводимы
+    и не требуют сети. Ключ – хэш модели, сообщений и параметров запроса.
+    """
+    name = "replay"
+
+    def __init__(self, path=None, mode="replay", inner=None, latency=0.0):
+        self.path = path or os.getenv("LLM_REPLAY_FILE", "llm_replay.jsonl")
+        self.mode = mode
+        self.inner = inner
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._responses = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses[entry["key"]] = entry["response"]
+        if mode == "record" and inner is None:
+            raise ValueError("Для записи нужен внутренний бэкенд (inner)")
+
+    @staticmethod
+    def make_key(messages, model, kwargs) -> str:
+        payload = json.dumps([model, messages, kwargs], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def complete(self, messages, model, **kwargs) -> LLMResponse:
+        key = self.make_key(messages, model, kwargs)
+        with self._lock:
+            stored = self._responses.get(key)
+        if stored is not None:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return LLMResponse.from_dict(stored)
+        if self.mode != "record":
+            raise ReplayMissError(f"В {self.path} нет записанного ответа на запрос {key[:12]}")
+
+        response = await self.inner.complete(messages, model, **kwargs)
+        with self._lock:
+            self._responses[key] = response.to_dict()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": response.to_dict()}, ensure_ascii=False) + "\n")
+        return response
+
+    async def close(self):
+        if self.inner is not None:
+            await self.inner.close()
+
+
+def make_backend(name=None) -> LLMBackend:
+    """
+    Бэкенд по LLM_BACKEND: openai (по умолчанию), mock, record (openai с записью
+    в LLM_REPLAY_FILE) или replay (только из записи).
+    """
+    name = (name or os.getenv("LLM_BACKEND", "openai")).lower()
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "mock":
+        return MockBackend()
+    if name == "record":
+        return RecordReplayBackend(mode="record", inner=OpenAIBackend())
+    if name == "replay":
+        return RecordReplayBackend(mode="replay")
+    raise ValueError(f"Неизвестный LLM_BACKEND: {name}")
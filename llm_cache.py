@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализует текст для ключа кэша: NFKC, без лишних пробелов и пустых строк.
+    Письма, отличающиеся только переносами и пробелами, дают один и тот же ключ.
+    """
+    text = unicodedata.normalize("NFKC", text or "").replace("\xa0", " ")
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class LLMCache:
+    """
+    Дисковый кэш ответов LLM в SQLite (LLM_CACHE_FILE).
+    Ключ – хэш нормализованного текста, списка полей, версии промпта и модели, значение – JSON.
+    Записи старше LLM_CACHE_TTL секунд не выдаются и удаляются, а при превышении
+    LLM_CACHE_MAX_ENTRIES вытесняются давно не читавшиеся. Счётчики попаданий и промахов
+    доступны в stats().
+    """
+    _EVICT_EVERY = 100
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or os.getenv("LLM_CACHE_FILE", "llm_cache.sqlite3")
+        self.ttl = float(ttl if ttl is not None else os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self._conn.commit()
+        self._evict()
+
+    @staticmethod
+    def make_key(text: str, fields, prompt_version: str, model: str) -> str:
+        payload = json.dumps(
+            [normalize_text(text), list(fields), str(prompt_version), model], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Возвращает сохранённое значение или None (нет записи или истёк TTL).
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY:
+                return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
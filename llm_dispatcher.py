@@ -0,0 +1,306 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+from llm_backends import LLMUnavailableError, RateLimitedLLMError, TransientLLMError, make_backend
+from llm_metrics import LLMCallRecord, LLMMetrics, current_supplier
+from text_processing import estimate_tokens
+
+
+class TokenBucket:
+    """
+    Ведро токенов с пополнением per_minute единиц в минуту и ёмкостью в минутную квоту.
+    Одно ведро считает запросы (RPM), другое – токены (TPM).
+    Ожидающие обслуживаются по очереди, так что крупный запрос не голодает.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float):
+        """
+        Поправка после ответа: оценку заменяем фактическим расходом (amount может быть < 0).
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CircuitBreaker:
+    """
+    Автомат: после failure_threshold временных сбоев подряд размыкается на reset_timeout секунд,
+    и все вызовы сразу получают LLMUnavailableError, не нагружая лежащий API и не держа письма
+    в ожидании таймаутов. Затем пропускает один пробный вызов: успех замыкает автомат,
+    сбой размыкает снова. 429 сбоем не считается – это квота, а не отказ.
+    """
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = int(
+            failure_threshold if failure_threshold is not None else os.getenv("LLM_BREAKER_FAILURES", "5")
+        )
+        self.reset_timeout = float(reset_timeout if reset_timeout is not None else os.getenv("LLM_BREAKER_RESET", "30"))
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def retry_in(self) -> float:
+        """
+        Через сколько секунд автомат пропустит пробный вызов (0 – если замкнут).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() < self._opened_at + self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print("LLM снова отвечает, автомат замкнут.")
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self):
+        """
+        Пробный вызов закончился без исхода (отменён): следующий вызов снова может стать пробным.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self._opened_at is None and self.failures >= self.failure_threshold):
+                print(f"LLM: {self.failures} сбоев подряд, автомат разомкнут на {self.reset_timeout:.0f} с")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LLMDispatcher:
+    """
+    Асинхронный диспетчер запросов к chat completions.
+    Держит до LLM_MAX_CONCURRENCY запросов в полёте, не превышает квоты LLM_RPM (запросов
+    в минуту) и LLM_TPM (токенов в минуту, по оценке до ответа и по usage после),
+    а на 429 ставит на паузу все запросы на Retry-After и повторяет с джиттером.
+    Пропускная способность упирается в квоту API, а не в задержку одного вызова.
+
+    Собственный цикл событий живёт в фоновом потоке, поэтому синхронный код (chat)
+    может звать диспетчер из любого числа потоков, а асинхронный – через achat.
+    Запросы выполняет бэкенд (llm_backends.py, по умолчанию – по LLM_BACKEND):
+    OpenAI, заглушка в процессе или запись/воспроизведение ответов.
+
+    Каждая попытка ограничена LLM_TIMEOUT, вызов целиком вместе с повторами – LLM_DEADLINE.
+    Если ответа так и нет или автомат разомкнут, вызов завершается LLMUnavailableError,
+    а не пустым результатом: письмо остаётся необработанным и ждёт восстановления.
+
+    Каждый вызов учитывается в LLMMetrics: токены, задержка, попытки и исход,
+    с поставщиком (llm_supplier) и этапом (аргумент stage) – для сводок по стоимости.
+    """
+    def __init__(self, backend=None, max_concurrency=None, rpm=None, tpm=None,
+                 max_retries=None, max_backoff=60.0, completion_tokens=500,
+                 timeout=None, deadline=None, breaker=None, metrics=None):
+        self._backend = backend
+        self.max_concurrency = int(
+            max_concurrency if max_concurrency is not None else os.getenv("LLM_MAX_CONCURRENCY", "8")
+        )
+        self.requests_bucket = TokenBucket(rpm or float(os.getenv("LLM_RPM", "500")))
+        self.tokens_bucket = TokenBucket(tpm or float(os.getenv("LLM_TPM", "200000")))
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("LLM_MAX_RETRIES", "5"))
+        self.max_backoff = max_backoff
+        self.timeout = float(timeout if timeout is not None else os.getenv("LLM_TIMEOUT", "30"))
+        self.deadline = float(deadline if deadline is not None else os.getenv("LLM_DEADLINE", "120"))
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or LLMMetrics()
+        # Сколько токенов ответа закладывать, если max_tokens не задан
+        self.completion_tokens = completion_tokens
+        self._semaphore = None
+        self._paused_until = 0.0
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = make_backend()
+        return self._backend
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="llm-dispatcher", daemon=True
+                )
+                self._thread.start()
+        return self._loop
+
+    def chat(self, messages, model, stage="", **kwargs):
+        """
+        Синхронная обёртка над achat для обычных потоков. Возвращает LLMResponse.
+        stage – этап пайплайна для метрик, в запрос к API не уходит.
+        """
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("LLMDispatcher.chat нельзя вызывать из его собственного цикла, используйте achat")
+        # Поставщик берётся из контекста вызывающего потока: в цикл диспетчера контекст не переходит
+        coroutine = self._measured(messages, model, stage, current_supplier(), kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def achat(self, messages, model, stage="", **kwargs):
+        """
+        Асинхронный вызов из любого цикла событий: запрос уходит в цикл диспетчера,
+        чтобы квоты и пауза по 429 были общими для всех вызывающих.
+        """
+        loop = self._ensure_loop()
+        coroutine = self._measured(messages, model, stage, current_supplier(), kwargs)
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        return await asyncio.wrap_future(future)
+
+    async def _measured(self, messages, model, stage, supplier, kwargs):
+        record = LLMCallRecord(time.time(), supplier, stage, model)
+        started = time.monotonic()
+        try:
+            response = await self._dispatch(messages, model, record=record, **kwargs)
+            record.prompt_tokens = response.usage.prompt_tokens
+            record.completion_tokens = response.usage.completion_tokens
+            return response
+        except LLMUnavailableError:
+            record.outcome = "unavailable"
+            raise
+        except Exception:
+            record.outcome = "error"
+            raise
+        finally:
+            record.latency = time.monotonic() - started
+            self.metrics.record(record)
+
+    def _estimate(self, messages, kwargs) -> int:
+        prompt = sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages)
+        return prompt + int(kwargs.get("max_tokens") or self.completion_tokens)
+
+    async def _dispatch(self, messages, model, record=None, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        estimated = self._estimate(messages, kwargs)
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            # Вызовы идут в одном цикле событий: разомкнутый сейчас автомат пропустит этот вызов только пробным
+            probe = self.breaker.is_open
+            if not self.breaker.allow():
+                raise LLMUnavailableError(f"автомат LLM разомкнут ещё на {self.breaker.retry_in():.0f} с")
+            try:
+                await self._wait_pause()
+                await self.requests_bucket.acquire(1)
+                await self.tokens_bucket.acquire(estimated)
+                try:
+                    async with self._semaphore:
+                        if record is not None:
+                            record.attempts += 1
+                            attempt_started = time.monotonic()
+                        response = await asyncio.wait_for(
+                            self.backend.complete(messages, model, **kwargs), self.timeout
+                        )
+                        if record is not None:
+                            record.api_latency = time.monotonic() - attempt_started
+                except (TransientLLMError, asyncio.TimeoutError) as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        e = TransientLLMError(f"нет ответа за {self.timeout:g} с")
+                    self.tokens_bucket.refund(estimated)
+                    if not isinstance(e, RateLimitedLLMError):
+                        self.breaker.record_failure()
+                        probe = False
+                    attempt += 1
+                    delay = self._backoff(e, attempt)
+                    if attempt > self.max_retries or time.monotonic() + delay > deadline:
+                        raise LLMUnavailableError(f"LLM не ответила за {attempt} попыток: {e}") from e
+                    print(f"LLM: {type(e).__name__}, повтор {attempt}/{self.max_retries} через {delay:.1f} с")
+                    if isinstance(e, RateLimitedLLMError):
+                        # Квота общая – ждут все, а не только этот запрос
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                        continue
+                    await asyncio.sleep(delay)
+                    continue
+                except Exception:
+                    # Ошибка запроса (4xx и т.п.) – API отвечает, значит автомат размыкать не за что
+                    self.breaker.record_success()
+                    probe = False
+                    raise
+
+                self.breaker.record_success()
+                probe = False
+                if response.usage.total_tokens:
+                    self.tokens_bucket.refund(estimated - response.usage.total_tokens)
+                return response
+            finally:
+                if probe:
+                    # Пробный вызов закончился без исхода (CancelledError или 429) –
+                    # иначе автомат так и ждал бы его и не пропускал ни одного вызова
+                    self.breaker.release()
+
+    async def _wait_pause(self):
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _backoff(self, error, attempt) -> float:
+        """
+        Retry-After сервера плюс небольшой джиттер, иначе экспоненциальная задержка
+        с полным джиттером – чтобы одновременно отказанные запросы не вернулись разом.
+        """
+        retry_after = error.retry_after
+        if retry_after is not None:
+            return retry_after + random.uniform(0, min(1.0, retry_after / 2 + 0.1))
+        return random.uniform(0, min(self.max_backoff, 2 ** attempt))
+
+    def close(self):
+        loop = self._loop
+        if loop is None:
+            self.metrics.close()
+            return
+        if self._backend is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._backend.close(), loop).result(timeout=5)
+            except Exception:
+                pass
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+        self.metrics.close()
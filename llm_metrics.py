@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Поставщик, чьё письмо сейчас обрабатывается: выставляется один раз в answer_supplier
+# и доезжает до каждого вызова LLM, не протаскиваясь через все сигнатуры
+_supplier = contextvars.ContextVar("llm_supplier", default="")
+
+
+@contextmanager
+def llm_supplier(supplier: str):
+    """
+    Все вызовы LLM внутри блока учитываются на этого поставщика.
+    """
+    token = _supplier.set(supplier or "")
+    try:
+        yield
+    finally:
+        _supplier.reset(token)
+
+
+def current_supplier() -> str:
+    return _supplier.get()
+
+
+@dataclass
+class LLMCallRecord:
+    """
+    Один вызов LLM (или ответ из кэша вместо него).
+    latency – полное время вызова вместе с ожиданием квот и повторами, api_latency – последней попытки.
+    outcome: ok, cache_hit, error (ошибка запроса), unavailable (повторы исчерпаны, автомат).
+    """
+    ts: float
+    supplier: str
+    stage: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    api_latency: float = 0.0
+    attempts: int = 0
+    outcome: str = "ok"
+
+    def compact(self) -> dict:
+        return {
+            "t": round(self.ts, 3), "s": self.supplier, "st": self.stage, "m": self.model,
+            "pt": self.prompt_tokens, "ct": self.completion_tokens,
+            "l": round(self.latency, 3), "al": round(self.api_latency, 3),
+            "a": self.attempts, "o": self.outcome,
+        }
+
+
+@dataclass
+class LLMRollup:
+    calls: int = 0
+    cache_hits: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    max_latency: float = 0.0
+    max_prompt_tokens: int = 0
+    cost: float = 0.0
+
+    def add(self, record: LLMCallRecord, cost: float):
+        if record.outcome == "cache_hit":
+            self.cache_hits += 1
+            return
+        self.calls += 1
+        self.errors += 1 if record.outcome != "ok" else 0
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.latency += record.latency
+        self.max_latency = max(self.max_latency, record.latency)
+        self.max_prompt_tokens = max(self.max_prompt_tokens, record.prompt_tokens)
+        self.cost += cost
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_latency": round(self.latency / self.calls, 3) if self.calls else 0.0,
+            "max_latency": round(self.max_latency, 3),
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class LLMMetrics:
+    """
+    Учёт токенов, задержек и исходов каждого вызова LLM (пишет LLMDispatcher, кэш-попадания – агент).
+    Сводки по поставщику, по этапу (extract, extract_clarify, price_list, clarification)
+    и по часу – в памяти; каждая запись дописывается короткой строкой JSON в LLM_METRICS_LOG,
+    а сводки раз в LLM_METRICS_EXPORT_INTERVAL секунд выгружаются в LLM_METRICS_FILE
+    в текстовом формате Prometheus (для node_exporter textfile collector).
+    Стоимость считается по LLM_PRICE_INPUT / LLM_PRICE_OUTPUT – долларов за миллион токенов.
+    """
+    def __init__(self, log_path=None, export_path=None, export_interval=None,
+                 price_input=None, price_output=None):
+        self.log_path = log_path if log_path is not None else os.getenv("LLM_METRICS_LOG", "llm_metrics.jsonl")
+        self.export_path = export_path if export_path is not None else os.getenv("LLM_METRICS_FILE", "")
+        self.export_interval = float(
+            export_interval if export_interval is not None else os.getenv("LLM_METRICS_EXPORT_INTERVAL", "60")
+        )
+        self.price_input = float(price_input if price_input is not None else os.getenv("LLM_PRICE_INPUT", "0.15"))
+        self.price_output = float(price_output if price_output is not None else os.getenv("LLM_PRICE_OUTPUT", "0.60"))
+        self.total = LLMRollup()
+        self.by_supplier = {}
+        self.by_stage = {}
+        self.by_hour = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._exported = time.monotonic()
+
+    def cost(self, record: LLMCallRecord) -> float:
+        return (record.prompt_tokens * self.price_input + record.completion_tokens * self.price_output) / 1e6
+
+    def record(self, record: LLMCallRecord):
+        cost = self.cost(record)
+        hour = time.strftime("%Y-%m-%dT%H", time.localtime(record.ts))
+        with self._lock:
+            self.total.add(record, cost)
+            self.by_supplier.setdefault(record.supplier or "-", LLMRollup()).add(record, cost)
+            self.by_stage.setdefault(record.stage or "-", LLMRollup()).add(record, cost)
+            self.by_hour.setdefault(hour, LLMRollup()).add(record, cost)
+            if self.log_path:
+                try:
+                    if self._log is None:
+                        self._log = open(self.log_path, "a", encoding="utf-8")
+                    self._log.write(json.dumps(record.compact(), ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"Ошибка записи журнала метрик LLM {self.log_path}: {e}")
+            export = self.export_path and time.monotonic() - self._exported >= self.export_interval
+        if export:
+            self.export()
+
+    def record_cache_hit(self, stage: str, model: str = ""):
+        self.record(LLMCallRecord(time.time(), current_supplier(), stage, model, outcome="cache_hit"))
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "total": self.total.as_dict(),
+                "by_stage": {k: v.as_dict() for k, v in self.by_stage.items()},
+                "by_supplier": {k: v.as_dict() for k, v in self.by_supplier.items()},
+                "by_hour": {k: v.as_dict() for k, v in self.by_hour.items()},
+            }
+
+    def top_suppliers(self, n=10) -> list:
+        """
+        Самые дорогие поставщики: [(адрес, сводка), ...].
+        """
+        with self._lock:
+            ranked = sorted(self.by_supplier.items(), key=lambda item: item[1].cost, reverse=True)
+            return [(supplier, rollup.as_dict()) for supplier, rollup in ranked[:n]]
+
+    def prometheus(self) -> str:
+        lines = []
+        summary = self.summary()
+        names = [
+            ("calls", "counter"), ("cache_hits", "counter"), ("errors", "counter"),
+            ("prompt_tokens", "counter"), ("completion_tokens", "counter"),
+            ("avg_latency", "gauge"), ("max_latency", "gauge"), ("max_prompt_tokens", "gauge"),
+            ("cost", "counter"),
+        ]
+        for name, kind in names:
+            metric = f"llm_{name}_seconds" if "latency" in name else f"llm_{name}"
+            if name == "cost":
+                metric = "llm_cost_usd"
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {summary['total'][name]}")
+            for label, group in (("stage", "by_stage"), ("supplier", "by_supplier")):
+                for key, values in summary[group].items():
+                    value = json.dumps(key, ensure_ascii=False)
+                    lines.append(f"{metric}{{{label}={value}}} {values[name]}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """
+        Выгружает сводки в LLM_METRICS_FILE (атомарно, через временный файл) и сбрасывает журнал на диск.
+        """
+        with self._lock:
+            self._exported = time.monotonic()
+            if self._log is not None:
+                self._log.flush()
+        if not self.export_path:
+            return
+        tmp_path = f"{self.export_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, self.export_path)
+        except OSError as e:
+            print(f"Ошибка выгрузки метрик LLM в {self.export_path}: {e}")
+
+    def close(self):
+        self.export()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def load_records(path) -> list:
+    """
+    Читает журнал LLM_METRICS_LOG обратно в LLMCallRecord – для разбора после прогона.
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            c = json.loads(line)
+            records.append(LLMCallRecord(
+                ts=c["t"], supplier=c["s"], stage=c["st"], model=c["m"],
+                prompt_tokens=c["pt"], completion_tokens=c["ct"], latency=c["l"],
+                api_latency=c["al"], attempts=c["a"], outcome=c["o"],
+            ))
+    return records
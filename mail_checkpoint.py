@@ -0,0 +1,48 @@
+import os
+import json
+import threading
+
+
+class MailboxCheckpoint:
+    """
+    Персистентная отметка прогресса по IMAP-папкам.
+    Для каждой папки хранится UIDVALIDITY и последний UID, до которого (включительно)
+    все письма уже обработаны. Файл перезаписывается атомарно, так что падение процесса
+    посреди записи не портит отметку.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.getenv("IMAP_CHECKPOINT_FILE", "imap_checkpoint.json")
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    @staticmethod
+    def make_key(server: str, username: str, mailbox: str) -> str:
+        return f"{username}@{server}/{mailbox}"
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения файла отметок {self.path}: {e}")
+            return {}
+
+    def get(self, key: str):
+        """
+        Возвращает (uidvalidity, last_uid) или None, если по папке ещё ничего не сохранено.
+        """
+        with self._lock:
+            entry = self._state.get(key)
+        if not entry:
+            return None
+        return entry["uidvalidity"], entry["last_uid"]
+
+    def set(self, key: str, uidvalidity: int, last_uid: int):
+        with self._lock:
+            self._state[key] = {"uidvalidity": uidvalidity, "last_uid": last_uid}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
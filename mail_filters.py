@@ -0,0 +1,143 @@
+import os
+import re
+import json
+from dataclasses import dataclass
+from email.utils import parseaddr
+
+from supplier_identity import canonical_address
+
+# Поля заголовка, которых достаточно для решения «качать письмо или нет»
+PREFILTER_HEADER_FIELDS = (
+    "FROM", "SUBJECT", "DATE", "MESSAGE-ID", "IN-REPLY-TO", "REFERENCES",
+    "AUTO-SUBMITTED", "LIST-ID", "PRECEDENCE", "X-AUTOREPLY", "REPLY-TO",
+)
+
+ACCEPT = "accept"
+SKIP = "skip"
+
+_BOUNCE_SENDERS = re.compile(r"^(mailer-daemon|postmaster|no-?reply|do-?not-?reply)@", re.I)
+_BULK_PRECEDENCE = ("bulk", "list", "junk", "auto_reply")
+
+
+def normalize_address(value: str) -> str:
+    """
+    '"ООО Ромашка" <Sales@X.ru>' -> 'sales@x.ru'
+    """
+    return parseaddr(value or "")[1].strip().lower()
+
+
+def _address_key(value: str) -> str:
+    """
+    Ключ адреса в индексе – тот же канонический вид, что в SupplierDirectory
+    ('Ivan.Petrov@ya.ru' -> 'ivan-petrov@yandex.ru'), иначе просто нижний регистр.
+    """
+    return canonical_address(value) or normalize_address(value) or str(value or "").strip().lower()
+
+
+@dataclass
+class FilterRule:
+    """
+    Правило предфильтра: если заголовок header совпал с регулярным выражением pattern,
+    письмо принимается (accept), пропускается (skip) или перекладывается в папку (move:<папка>).
+    """
+    action: str
+    header: str
+    pattern: str
+
+    def __post_init__(self):
+        self._regex = re.compile(self.pattern, re.I)
+
+    def matches(self, headers) -> bool:
+        value = headers.get(self.header, "")
+        return bool(value) and bool(self._regex.search(str(value)))
+
+
+class SupplierAddressIndex:
+    """
+    Множество адресов известных поставщиков (в каноническом виде canonical_address –
+    и при заполнении, и при проверке): их письма всегда принимаются.
+    Заполняется из файла (SUPPLIER_ADDRESSES_FILE, по адресу в строке) и по ходу работы.
+    """
+    def __init__(self, addresses=(), path=None):
+        self._addresses = {_address_key(a) for a in addresses}
+        path = path or os.getenv("SUPPLIER_ADDRESSES_FILE")
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._addresses.update(_address_key(line) for line in f if line.strip())
+        self._addresses.discard("")
+
+    def add(self, address: str):
+        address = _address_key(address)
+        if address:
+            self._addresses.add(address)
+
+    def __contains__(self, address: str) -> bool:
+        return _address_key(address) in self._addresses
+
+    def __len__(self):
+        return len(self._addresses)
+
+
+class HeaderPrefilter:
+    """
+    Решает по одним заголовкам, стоит ли качать тело письма и звать LLM.
+    Порядок проверок:
+      1. явные правила (первое совпавшее побеждает);
+      2. известный поставщик – принять;
+      3. свои же письма, рассылки (List-ID, Precedence), автоответы (Auto-Submitted),
+         отбойники (MAILER-DAEMON и т.п.) – пропустить;
+      4. остальное принимается, а в режиме known_only – только ответы на наши письма (In-Reply-To).
+    """
+    def __init__(self, rules=(), supplier_index=None, own_addresses=(), known_only=None):
+        self.rules = list(rules)
+        self.supplier_index = supplier_index if supplier_index is not None else SupplierAddressIndex()
+        self.own_addresses = {_address_key(a) for a in own_addresses if a}
+        if known_only is None:
+            known_only = os.getenv("MAIL_PREFILTER_KNOWN_ONLY", "0").lower() in ("1", "true", "yes")
+        self.known_only = known_only
+
+    @classmethod
+    def from_env(cls, supplier_index=None, own_addresses=()):
+        """
+        Правила читаются из JSON-файла MAIL_FILTER_RULES_FILE:
+          [{"action": "skip", "header": "Subject", "pattern": "рассылка|unsubscribe"}, ...]
+        """
+        rules = []
+        path = os.getenv("MAIL_FILTER_RULES_FILE")
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                rules = [FilterRule(**entry) for entry in json.load(f)]
+        own = list(own_addresses) + [os.getenv("YANDEX_EMAIL", "")]
+        return cls(rules=rules, supplier_index=supplier_index, own_addresses=own)
+
+    def check(self, headers):
+        """
+        Возвращает (действие, причина): действие – ACCEPT, SKIP или "move:<папка>".
+        """
+        for rule in self.rules:
+            if rule.matches(headers):
+                return rule.action, f"правило {rule.header}~{rule.pattern}"
+
+        # Автоответы и рассылки отсеиваются даже от известных поставщиков:
+        # отвечать на них нельзя (RFC 3834), иначе два автоответчика зациклятся
+        auto_submitted = str(headers.get("Auto-Submitted", "no")).strip().lower()
+        if auto_submitted != "no" or headers.get("X-Autoreply"):
+            return SKIP, "автоответ"
+        if headers.get("List-Id"):
+            return SKIP, "рассылка"
+        if str(headers.get("Precedence", "")).strip().lower() in _BULK_PRECEDENCE:
+            return SKIP, "массовая рассылка"
+
+        sender = normalize_address(headers.get("From", ""))
+        if sender and sender in self.supplier_index:
+            return ACCEPT, "известный поставщик"
+        if not sender:
+            return SKIP, "нет отправителя"
+        if _address_key(sender) in self.own_addresses:
+            return SKIP, "наше собственное письмо"
+        if _BOUNCE_SENDERS.match(sender):
+            return SKIP, "служебный отправитель"
+
+        if self.known_only and not headers.get("In-Reply-To"):
+            return SKIP, "неизвестный отправитель"
+        return ACCEPT, "по умолчанию"
@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+
+from mail_checkpoint import MailboxCheckpoint
+
+
+@dataclass
+class MailboxConfig:
+    """
+    Один ящик и список папок, за которыми нужно следить.
+    """
+    username: str
+    password: str
+    imap_server: str = "imap.yandex.ru"
+    mailboxes: list = field(default_factory=lambda: ["INBOX"])
+    port: int = None
+    use_ssl: bool = None
+
+
+def load_mailbox_configs(path=None) -> list:
+    """
+    Читает список ящиков из JSON-файла MAIL_ACCOUNTS_FILE:
+      [{"username": "...", "password": "...", "imap_server": "imap.yandex.ru",
+        "mailboxes": ["INBOX", "Suppliers"]}, ...]
+    Имена папок можно писать как есть ("Поставщики") – в IMAP modified UTF-7 они кодируются сами.
+    Если файла нет – один ящик из .env (YANDEX_EMAIL / YANDEX_PASSWORD / IMAP_SERVER),
+    папки через запятую в IMAP_MAILBOXES (по умолчанию INBOX).
+    """
+    path = path or os.getenv("MAIL_ACCOUNTS_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [MailboxConfig(**entry) for entry in json.load(f)]
+
+    mailboxes = [m.strip() for m in os.getenv("IMAP_MAILBOXES", "INBOX").split(",") if m.strip()]
+    return [MailboxConfig(
+        username=os.getenv("YANDEX_EMAIL"),
+        password=os.getenv("YANDEX_PASSWORD"),
+        imap_server=os.getenv("IMAP_SERVER", "imap.yandex.ru"),
+        mailboxes=mailboxes,
+    )]
+
+
+@dataclass
+class IncomingEmail:
+    """
+    Письмо из очереди вместе с приёмником, которому нужно подтвердить его обработку.
+    """
+    receiver: object
+    uid: int
+    msg: object
+    from_addr: str
+    attempts: int = 0
+
+    @property
+    def source(self) -> str:
+        return f"{self.receiver.username}/{self.receiver.mailbox}"
+
+
+_UNSAFE_NAME = re.compile(r"[^\w.@-]+")
+
+
+class DeadLetterLog:
+    """
+    Письма, которые так и не удалось обработать (MAIL_DEAD_LETTER_DIR): исходное письмо
+    сохраняется в .eml, а в index.jsonl дописывается строка с папкой, UID, отправителем,
+    темой и последней ошибкой – чтобы разобрать вручную или прогнать заново.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.getenv("MAIL_DEAD_LETTER_DIR", "dead_letters")
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.path, "index.jsonl")
+
+    def add(self, item, error):
+        name = f"{_UNSAFE_NAME.sub('_', item.source)}-{item.uid}.eml"
+        entry = {
+            "ts": time.time(),
+            "source": item.source,
+            "uid": item.uid,
+            "from": item.from_addr,
+            "subject": str(item.msg.get("Subject", "")),
+            "message_id": str(item.msg.get("Message-ID", "")),
+            "attempts": item.attempts,
+            "error": str(error),
+            "eml": name,
+        }
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            try:
+                with open(os.path.join(self.path, name), "wb") as f:
+                    f.write(item.msg.as_bytes())
+            except Exception as e:
+                print(f"Не удалось сохранить письмо UID {item.uid} в {self.path}: {e}")
+                entry["eml"] = ""
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def entries(self) -> list:
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class MailIngestEngine:
+    """
+    Следит за N ящиками и папками из одного процесса.
+    У каждой пары (ящик, папка) свой приёмник: своё IMAP-соединение, своя задержка
+    переподключения и своя отметка прогресса. Блокирующий imaplib крутится в отдельном
+    потоке на приёмник, письма складываются в общую ограниченную asyncio-очередь,
+    из которой их разбирают обработчики единого пайплайна.
+    Новая папка стоит одного потока-наблюдателя, а не отдельного процесса.
+
+    Письмо, на котором обработчик упал, возвращается в очередь через MAIL_RETRY_DELAY секунд
+    (задержка удваивается), всего до MAIL_HANDLER_RETRIES повторов. После этого оно уходит
+    в DeadLetterLog и подтверждается: иначе отметка прогресса навсегда застряла бы перед ним,
+    и после каждого рестарта все следующие письма обрабатывались бы заново.
+    """
+    def __init__(self, receivers: list, handler, workers: int = 1, queue_size: int = 100,
+                 retries=None, retry_delay=None, dead_letter=None):
+        self.receivers = receivers
+        # handler: async def handler(item: IncomingEmail) -> None
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retries = int(retries if retries is not None else os.getenv("MAIL_HANDLER_RETRIES", "3"))
+        self.retry_delay = float(retry_delay if retry_delay is not None else os.getenv("MAIL_RETRY_DELAY", "5"))
+        self.dead_letter = dead_letter or DeadLetterLog()
+        self._executor = None
+        self._retries = set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.receivers)), thread_name_prefix="imap"
+        )
+        tasks = [asyncio.ensure_future(self._watch(receiver, queue, loop)) for receiver in self.receivers]
+        tasks += [asyncio.ensure_future(self._consume(queue)) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + list(self._retries):
+                task.cancel()
+            self.stop()
+
+    def stop(self):
+        for receiver in self.receivers:
+            receiver.stop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _watch(self, receiver, queue, loop):
+        """
+        Держит наблюдатель за одной папкой живым: если поток приёмника упал с неожиданной
+        ошибкой, перезапускает его с экспоненциальной задержкой.
+        """
+        backoff = 1
+        while not receiver.stopped:
+            try:
+                await loop.run_in_executor(self._executor, self._pump, receiver, queue, loop)
+                return
+            except Exception as e:
+                print(f"Наблюдатель {receiver.username}/{receiver.mailbox} упал: {e}. "
+                      f"Перезапуск через {backoff} с...")
+                receiver.close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, receiver.max_backoff)
+
+    @staticmethod
+    def _pump(receiver, queue, loop):
+        """
+        Работает в потоке приёмника: переносит письма из listen() в asyncio-очередь.
+        Когда очередь полна, поток ждёт – так память ограничена размером очереди.
+        """
+        for uid, msg, from_addr in receiver.listen():
+            item = IncomingEmail(receiver, uid, msg, from_addr)
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=1)
+                    break
+                except FutureTimeoutError:
+                    # Цикл событий мог уже остановиться – тогда не висим вечно
+                    if receiver.stopped:
+                        future.cancel()
+                        return
+
+    async def _consume(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self.handler(item)
+            except Exception as e:
+                item.attempts += 1
+                print(f"Ошибка при обработке письма UID {item.uid} ({item.source}), "
+                      f"попытка {item.attempts}: {e}")
+                if item.attempts <= self.retries:
+                    # Повтор – позже и в конце очереди, обработчик тем временем занят другими письмами
+                    task = asyncio.ensure_future(
+                        self._retry(queue, item, self.retry_delay * 2 ** (item.attempts - 1))
+                    )
+                    self._retries.add(task)
+                    task.add_done_callback(self._retries.discard)
+                else:
+                    print(f"Письмо UID {item.uid} ({item.source}) отложено в {self.dead_letter.path}")
+                    self.dead_letter.add(item, e)
+                    item.receiver.mark_processed(item.uid)
+            else:
+                item.receiver.mark_processed(item.uid)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def _retry(queue, item, delay):
+        await asyncio.sleep(delay)
+        await queue.put(item)
+
+
+def build_receivers(configs, receiver_cls, checkpoint=None, prefilter=None) -> list:
+    """
+    Создаёт по приёмнику на каждую пару (ящик, папка). Отметки прогресса хранятся
+    в одном файле, но под отдельными ключами.
+    """
+    checkpoint = checkpoint or MailboxCheckpoint()
+    receivers = []
+    for cfg in configs:
+        for mailbox in cfg.mailboxes:
+            receivers.append(receiver_cls(
+                imap_server=cfg.imap_server,
+                username=cfg.username,
+                password=cfg.password,
+                mailbox=mailbox,
+                port=cfg.port,
+                use_ssl=cfg.use_ssl,
+                checkpoint=checkpoint,
+                prefilter=prefilter,
+            ))
+    return receivers
@@ -1,225 +1,927 @@
 import os
-import time
+import re
+import json
+import select
+import asyncio
+import socket
+import ssl
+import threading
 import imaplib
-import email
-import datetime
-from email.utils import parsedate_to_datetime
+import io
+import tempfile
+from contextlib import nullcontext
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser, BytesHeaderParser
 from dotenv import load_dotenv
 
-# Библиотека для чтения Excel
-import openpyxl
+# Помощники для пакетной загрузки писем (BODYSTRUCTURE и выборочные MIME-части)
+from imap_fetch import (
+    compress_uid_set,
+    encode_mailbox_name,
+    is_wanted_part,
+    parse_bodystructure,
+    parse_fetch_response,
+    write_partial_message
+)
+
+from attachments import (
+    AttachmentExtractor,
+    AttachmentJob,
+    is_excel_attachment,
+    is_text_attachment,
+    parse_excel_attachment
+)
+from attachment_store import AttachmentStore
+from mail_checkpoint import MailboxCheckpoint
+from mail_filters import ACCEPT, PREFILTER_HEADER_FIELDS, HeaderPrefilter, SupplierAddressIndex, normalize_address
+from mail_ingest import MailIngestEngine, build_receivers, load_mailbox_configs
+from text_processing import detect_language, extract_body, preprocess_body
+from llm_backends import LLMUnavailableError
+from llm_dispatcher import LLMDispatcher
+from llm_cache import LLMCache
+from llm_metrics import llm_supplier
 
 # Embrace the cosmic flow as we summon the mystical modules from agent_logic
 from agent_logic import (
     SupplierLLMAgent,
-    SupplierDataManager,
     YandexEmailSender,
     save_supplier_data_to_excel
 )
+from excel_export import ExcelExporter
+from provenance import ProvenanceLog, ProvenanceSource
+from supplier_identity import SupplierDirectory, is_supplier_id
+from supplier_store import SQLiteSupplierDataManager
 
 load_dotenv()  # Unleash the hidden energies stored in the .env file – let the universe reveal its secrets!
 
 class YandexEmailReceiver:
     """
     A portal class to the astral plane of Yandex email (via IMAP).
-    It returns a list of tuples (msg, from_address) for those emails that are yet to be awakened.
+    Держит одну долгоживущую авторизованную IMAP-сессию, ждёт новые письма через IMAP IDLE
+    (если сервер его не умеет – NOOP-keepalive и опрос раз в poll_interval секунд)
+    и сам переподключается при обрывах связи.
+
+    Сервер, порт и SSL задаются параметрами или переменными окружения
+    (IMAP_SERVER, IMAP_PORT, IMAP_SSL), поэтому приёмник можно натравить
+    на локальную IMAP-заглушку без TLS.
+
+    Очередью работы служит не флаг UNSEEN, а отметка UIDVALIDITY + последний обработанный UID
+    (MailboxCheckpoint): забираются только письма UID n+1:*, а отметка сдвигается лишь после
+    mark_processed(uid). Поэтому прочитанное в веб-интерфейсе письмо не теряется,
+    а после падения обработка продолжается ровно с того места, где остановилась.
+
+    mark_processed() и stop() можно вызывать из других потоков: приёмник сам работает
+    в своём потоке (см. mail_ingest.MailIngestEngine), а флаги \\Seen выставляются
+    пачкой из этого потока перед очередным ожиданием почты.
     """
-    def __init__(self):
+    def __init__(self, imap_server=None, username=None, password=None, mailbox="INBOX",
+                 port=None, use_ssl=None, idle_timeout=None, poll_interval=None,
+                 socket_timeout=60, max_backoff=300, checkpoint=None, mark_seen=True, prefilter=None):
         # Setting up the gateway to the digital beyond
-        self.imap_server = os.getenv("IMAP_SERVER", "imap.yandex.ru")
-        self.username = os.getenv("YANDEX_EMAIL")
-        self.password = os.getenv("YANDEX_PASSWORD")
-        self.mailbox = "INBOX"
+        self.imap_server = imap_server or os.getenv("IMAP_SERVER", "imap.yandex.ru")
+        if use_ssl is None:
+            use_ssl = os.getenv("IMAP_SSL", "1").lower() not in ("0", "false", "no")
+        self.use_ssl = use_ssl
+        self.imap_port = int(port or os.getenv("IMAP_PORT") or (993 if use_ssl else 143))
+        self.username = username or os.getenv("YANDEX_EMAIL")
+        self.password = password or os.getenv("YANDEX_PASSWORD")
+        self.mailbox = mailbox
+        # RFC 2177 советует перевыдавать IDLE не реже, чем раз в 29 минут;
+        # Яндекс рвёт простаивающие соединения раньше, поэтому по умолчанию 5 минут.
+        self.idle_timeout = float(idle_timeout if idle_timeout is not None else os.getenv("IMAP_IDLE_TIMEOUT", "300"))
+        self.poll_interval = float(
+            poll_interval if poll_interval is not None else os.getenv("IMAP_POLL_INTERVAL", "60")
+        )
+        self.socket_timeout = socket_timeout
+        self.max_backoff = max_backoff
+        self.fetch_batch_size = int(os.getenv("IMAP_FETCH_BATCH", "100"))
+        # Ограничения памяти: подпачка нужных частей и порог, с которого письмо пишется во временный файл
+        self.fetch_batch_bytes = int(os.getenv("IMAP_FETCH_BATCH_BYTES", str(16 * 1024 * 1024)))
+        self.spool_threshold = int(os.getenv("IMAP_SPOOL_THRESHOLD", str(5 * 1024 * 1024)))
+        self.spool_chunk_size = 1024 * 1024
+        # HeaderPrefilter: решает по заголовкам, качать ли письмо вообще
+        self.prefilter = prefilter
+        self.mail = None
+        self.supports_idle = False
 
-    def fetch_unseen_emails(self):
-        results = []
+        self.checkpoint = checkpoint or MailboxCheckpoint()
+        self.checkpoint_key = MailboxCheckpoint.make_key(self.imap_server, self.username, self.mailbox)
+        # Ставить ли \Seen после обработки – только для удобства людей, на логику не влияет
+        self.mark_seen = mark_seen
+        self.uidvalidity = None
+        self.last_uid = 0        # всё до этого UID включительно обработано и сохранено
+        self._fetched_uid = 0    # самый большой UID, уже отданный на обработку
+        self._pending = set()    # отданные, но ещё не подтверждённые UID
+        self._seen_queue = []    # подтверждённые UID, которым ещё не поставлен \Seen
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+
+    def connect(self):
+        """
+        Открывает соединение, логинится и выбирает папку. Повторный вызов ничего не делает,
+        если сессия уже открыта.
+        """
+        if self.mail is not None:
+            return self.mail
+        # Initiating a secure connection to the cosmic IMAP server
+        if self.use_ssl:
+            mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+        else:
+            mail = imaplib.IMAP4(self.imap_server, self.imap_port)
         try:
-            # Initiating a secure connection to the cosmic IMAP server
-            mail = imaplib.IMAP4_SSL(self.imap_server)
+            mail.sock.settimeout(self.socket_timeout)
             mail.login(self.username, self.password)
-            mail.select(self.mailbox)
+            result, _ = mail.select(self._quoted_mailbox())
+            if result != 'OK':
+                raise imaplib.IMAP4.error(f"Не удалось выбрать папку {self.mailbox}")
+        except Exception:
+            self._shutdown(mail)
+            raise
+        self.supports_idle = "IDLE" in mail.capabilities
+        self.mail = mail
+        self._sync_checkpoint(mail)
+        return mail
+
+    def _quoted_mailbox(self) -> str:
+        # imaplib не кодирует и не экранирует имена папок сам, а в них бывают кириллица и пробелы
+        name = encode_mailbox_name(self.mailbox)
+        if name.startswith('"') or not any(c in name for c in ' "\\()'):
+            return name
+        return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def _sync_checkpoint(self, mail):
+        """
+        Сверяет UIDVALIDITY папки с сохранённой отметкой. Если папка новая или её UID
+        пересчитаны сервером, начинаем с первого непрочитанного письма (или с текущего конца папки).
+        """
+        _, data = mail.response('UIDVALIDITY')
+        uidvalidity = int(data[0]) if data and data[0] else 0
+        _, uidnext = mail.response('UIDNEXT')
+        if uidvalidity == self.uidvalidity:
+            return
+
+        saved = self.checkpoint.get(self.checkpoint_key)
+        if saved and saved[0] == uidvalidity:
+            last_uid = saved[1]
+        else:
+            if saved:
+                print(f"UIDVALIDITY папки {self.mailbox} изменился, отметка прогресса сброшена.")
+            result, data = mail.uid('SEARCH', None, 'UNSEEN')
+            unseen = [int(uid) for uid in data[0].split()] if result == 'OK' and data[0] else []
+            if unseen:
+                last_uid = min(unseen) - 1
+            elif uidnext and uidnext[0]:
+                last_uid = int(uidnext[0]) - 1
+            else:
+                result, data = mail.uid('SEARCH', None, 'ALL')
+                all_uids = [int(uid) for uid in data[0].split()] if result == 'OK' and data[0] else []
+                last_uid = max(all_uids, default=0)
+            self.checkpoint.set(self.checkpoint_key, uidvalidity, last_uid)
+
+        with self._lock:
+            self.uidvalidity = uidvalidity
+            self.last_uid = self._fetched_uid = last_uid
+            self._pending.clear()
+            self._seen_queue.clear()
+
+    def mark_processed(self, uid: int):
+        """
+        Подтверждает, что письмо обработано. Отметка сдвигается только по непрерывному
+        префиксу: пока более раннее письмо не подтверждено, после рестарта оно будет обработано снова.
+        """
+        with self._lock:
+            self._pending.discard(uid)
+            self._commit()
+            if self.mark_seen:
+                self._seen_queue.append(uid)
+
+    def _commit(self):
+        with self._lock:
+            done = min(self._pending) - 1 if self._pending else self._fetched_uid
+            if done > self.last_uid:
+                self.last_uid = done
+                self.checkpoint.set(self.checkpoint_key, self.uidvalidity, done)
+
+    def _flush_seen(self, mail):
+        """
+        Одной командой ставит \\Seen всем подтверждённым письмам. Вызывается только из потока приёмника.
+        """
+        with self._lock:
+            uids, self._seen_queue = self._seen_queue, []
+        if not uids:
+            return
+        try:
+            mail.uid('STORE', compress_uid_set(uids), '+FLAGS.SILENT', '(\\Seen)')
+        except (imaplib.IMAP4.error, OSError) as e:
+            print(f"Не удалось пометить письма прочитанными: {e}")
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self):
+        """
+        Просит listen() завершиться. Рвёт сокет, чтобы прервать IDLE, не дожидаясь таймаута.
+        """
+        self._stopped.set()
+        mail = self.mail
+        if mail is not None:
+            try:
+                mail.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Корректно закрывает сессию (если она есть).
+        """
+        mail, self.mail = self.mail, None
+        if mail is not None:
+            self._shutdown(mail)
+
+    @staticmethod
+    def _shutdown(mail):
+        try:
+            mail.logout()
+        except Exception:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
 
-            # Searching for emails that have not yet been touched by human consciousness
-            result, data = mail.search(None, 'UNSEEN')
+    def fetch_new_emails(self):
+        """
+        Генератор (uid, msg, from_address) для писем с UID больше отметки прогресса.
+        Письма отдаются по мере скачивания, в памяти одновременно лежит не больше одной подпачки.
+        Каждое письмо нужно подтвердить через mark_processed(uid).
+        """
+        mail = self.connect()
+
+        # Searching for transmissions beyond the last checkpoint: UID n+1:*
+        result, data = mail.uid('SEARCH', None, f'UID {self._fetched_uid + 1}:*')
+        if result != 'OK':
+            raise imaplib.IMAP4.error("Ошибка при поиске новых писем.")
+
+        # "n+1:*" всегда включает последнее письмо папки, даже если его UID <= n
+        uids = sorted(int(uid) for uid in data[0].split() if int(uid) > self._fetched_uid)
+        return self._fetch_messages(uids)
+
+    def _fetch_messages(self, uids):
+        """
+        Скачивает письма по UID пачками по fetch_batch_size.
+        На пачку уходит одна команда UID FETCH за структурой и заголовками, дальше нужные
+        секции (BODY.PEEK[section]) забираются подпачками не больше fetch_batch_bytes.
+        Картинки, PDF и прочие ненужные вложения не скачиваются.
+        """
+        mail = self.connect()
+        for start in range(0, len(uids), self.fetch_batch_size):
+            batch = uids[start:start + self.fetch_batch_size]
+            plans = self._fetch_plans(mail, batch)
+
+            # Вся пачка сразу считается «в работе», чтобы отметка не проскочила ещё не выданное письмо
+            waiting = [uid for uid in batch if uid in plans]
+            with self._lock:
+                self._pending.update(waiting)
+                self._fetched_uid = max(self._fetched_uid, batch[-1])
+            try:
+                for chunk in self._split_by_size(list(waiting), plans):
+                    for uid, msg in self._download(mail, chunk, plans):
+                        waiting.remove(uid)
+                        from_addr = msg.get("From", "unknown")
+                        yield uid, msg, from_addr
+            finally:
+                if waiting:
+                    # Генератор закрыли или связь упала посреди пачки – невыданное заберём в следующий раз
+                    with self._lock:
+                        self._pending.difference_update(waiting)
+                        self._fetched_uid = min(waiting) - 1
+            # Письма, которые успели удалить, просто пропускаем
+            self._commit()
+
+    def _fetch_plans(self, mail, batch):
+        """
+        Одной командой получает RFC822.SIZE, BODYSTRUCTURE и только нужные поля заголовка
+        (BODY.PEEK[HEADER.FIELDS (...)]) пачки писем. Если задан предфильтр, по этим полям
+        сразу отсеиваются рассылки, автоответы, отбойники и т.п. – их тела не качаются вовсе.
+        Возвращает {uid: (header, wanted_parts, multipart)} только для принятых писем.
+        """
+        uid_set = compress_uid_set(batch)
+        header_item = f"BODY.PEEK[HEADER.FIELDS ({' '.join(PREFILTER_HEADER_FIELDS)})]"
+        result, data = mail.uid('FETCH', uid_set, f'(UID RFC822.SIZE BODYSTRUCTURE {header_item})')
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f"Ошибка при получении писем UID {uid_set}")
+
+        # Traverse through the astral plane of message structures
+        plans = {}
+        skipped = 0
+        routes = {}
+        for meta in parse_fetch_response(data):
+            uid = meta.get("UID")
+            structure = meta.get("BODYSTRUCTURE")
+            if uid is None or not isinstance(structure, list):
+                continue
+            header = next((v for k, v in meta.items() if k.startswith("BODY[HEADER")), None) or b""
+
+            if self.prefilter is not None:
+                action, reason = self.prefilter.check(BytesHeaderParser().parsebytes(header))
+                if action.startswith("move:"):
+                    routes.setdefault(action[len("move:"):], []).append(uid)
+                    continue
+                if action != ACCEPT:
+                    skipped += 1
+                    continue
+
+            multipart = bool(structure) and isinstance(structure[0], list)
+            parts = [p for p in parse_bodystructure(structure) if is_wanted_part(p)]
+            plans[uid] = (header, parts, multipart)
+
+        if skipped:
+            print(f"Предфильтр ({self.username}/{self.mailbox}): пропущено писем без скачивания тел – {skipped}")
+        for folder, uids in routes.items():
+            self._route(mail, uids, folder)
+        return plans
+
+    def _route(self, mail, uids, folder):
+        """
+        Перекладывает письма в другую папку (UID MOVE, а без него – UID COPY).
+        """
+        command = 'MOVE' if 'MOVE' in mail.capabilities else 'COPY'
+        target = encode_mailbox_name(folder)
+        if ' ' in target:
+            target = f'"{target}"'
+        try:
+            result, _ = mail.uid(command, compress_uid_set(uids), target)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            result = str(e)
+        if result != 'OK':
+            print(f"Не удалось переложить письма UID {compress_uid_set(uids)} в папку {folder}: {result}")
+
+    def _split_by_size(self, uids, plans):
+        """
+        Режет письма на подпачки по суммарному размеру нужных частей.
+        Письмо крупнее spool_threshold всегда идёт отдельно – его части качаются кусками на диск.
+        """
+        chunk, chunk_bytes = [], 0
+        for uid in uids:
+            size = sum(part.size for part in plans[uid][1])
+            if size > self.spool_threshold:
+                if chunk:
+                    yield chunk
+                    chunk, chunk_bytes = [], 0
+                yield [uid]
+                continue
+            if chunk and chunk_bytes + size > self.fetch_batch_bytes:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(uid)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def _download(self, mail, chunk, plans):
+        """
+        Скачивает нужные секции писем подпачки и отдаёт (uid, msg) в порядке UID.
+        """
+        if len(chunk) == 1 and sum(part.size for part in plans[chunk[0]][1]) > self.spool_threshold:
+            uid = chunk[0]
+            yield uid, self._download_spooled(mail, uid, plans[uid])
+            return
+
+        # Письма с одинаковым набором секций забираем одной командой
+        groups = {}
+        for uid in chunk:
+            sections = tuple(part.section for part in plans[uid][1])
+            if sections:
+                groups.setdefault(sections, []).append(uid)
+
+        bodies = {uid: {} for uid in chunk}
+        for sections, group in groups.items():
+            items = " ".join(f"BODY.PEEK[{section}]" for section in sections)
+            result, data = mail.uid('FETCH', compress_uid_set(group), f'(UID {items})')
             if result != 'OK':
-                print("Ошибка при поиске непрочитанных писем.")
-                return results
-
-            email_ids = data[0].split()
-            # Traverse through the astral plane of email IDs
-            for e_id in email_ids:
-                result, msg_data = mail.fetch(e_id, '(RFC822)')
-                if result != 'OK':
-                    print(f"Ошибка при получении письма id {e_id.decode()}")
+                raise imaplib.IMAP4.error(f"Ошибка при получении частей писем UID {compress_uid_set(group)}")
+            for meta in parse_fetch_response(data):
+                uid = meta.get("UID")
+                if uid in bodies:
+                    for section in sections:
+                        bodies[uid][section] = meta.get(f"BODY[{section}]") or b""
+
+        for uid in chunk:
+            header, parts, multipart = plans[uid]
+            raw = io.BytesIO()
+            write_partial_message(raw, header, parts, bodies.pop(uid), multipart)
+            # Decode the enigmatic message from its raw byte form
+            yield uid, BytesParser().parsebytes(raw.getvalue())
+
+    def _download_spooled(self, mail, uid, plan):
+        """
+        Большое письмо: каждая секция качается кусками BODY.PEEK[section]<offset.length>
+        прямо во временный файл, и письмо разбирается BytesParser'ом уже из файла.
+        """
+        header, parts, multipart = plan
+        bodies = {part.section: self._iter_section(mail, uid, part.section) for part in parts}
+        with tempfile.TemporaryFile() as spool:
+            write_partial_message(spool, header, parts, bodies, multipart)
+            spool.seek(0)
+            return BytesParser().parse(spool)
+
+    def _iter_section(self, mail, uid, section):
+        offset = 0
+        while True:
+            item = f"BODY[{section}]<{offset}>"
+            result, data = mail.uid('FETCH', str(uid), f'(UID BODY.PEEK[{section}]<{offset}.{self.spool_chunk_size}>)')
+            if result != 'OK':
+                raise imaplib.IMAP4.error(f"Ошибка при получении части {section} письма UID {uid}")
+            chunk = b""
+            for meta in parse_fetch_response(data):
+                if meta.get("UID") == uid:
+                    chunk = meta.get(item) or b""
+            if chunk:
+                yield chunk
+            if len(chunk) < self.spool_chunk_size:
+                return
+            offset += len(chunk)
+
+    def wait_for_new_mail(self, timeout=None):
+        """
+        Блокируется до появления новых писем или истечения timeout.
+        Возвращает True, если сервер сообщил об изменениях в папке.
+        """
+        mail = self.connect()
+        if self.supports_idle:
+            return self._idle(mail, self.idle_timeout if timeout is None else timeout)
+
+        # Запасной вариант: спим и дёргаем NOOP, чтобы сессия не протухла
+        if self._stopped.wait(self.poll_interval if timeout is None else timeout):
+            return False
+        result, _ = mail.noop()
+        if result != 'OK':
+            raise imaplib.IMAP4.abort("NOOP завершился ошибкой")
+        return True
+
+    def _idle(self, mail, timeout):
+        """
+        IMAP IDLE (RFC 2177) поверх imaplib, который до Python 3.14 его не поддерживает.
+        Ждём первое непомеченное сообщение сервера (EXISTS, EXPUNGE и т.п.) через select(),
+        чтобы не ловить таймаут внутри буферизированного чтения сокета.
+        """
+        tag = mail._new_tag().decode()
+        mail.send(f"{tag} IDLE\r\n".encode())
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"Сервер отклонил IDLE: {line!r}")
+
+        changed = False
+        if self._buffered(mail) or select.select([mail.sock], [], [], timeout)[0]:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Сервер закрыл соединение во время IDLE")
+            changed = line.startswith(b"*") and b"BYE" not in line.upper()
+
+        mail.send(b"DONE\r\n")
+        # Дочитываем хвост непомеченных ответов до завершения команды IDLE
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Сервер закрыл соединение во время IDLE")
+            if line.startswith(tag.encode()):
+                if b" OK" not in line.upper():
+                    raise imaplib.IMAP4.error(f"IDLE завершился ошибкой: {line!r}")
+                break
+            changed = True
+        return changed
+
+    @staticmethod
+    def _buffered(mail) -> bool:
+        """
+        Есть ли уже принятые, но не разобранные данные: в буфере imaplib (mail.file) или SSL.
+        Сервер может прислать «+ idling» и «* N EXISTS» одним пакетом – тогда readline()
+        забирает из сокета оба, и select() на сокете их уже не увидит.
+        """
+        sock = mail.sock
+        if getattr(sock, "pending", lambda: 0)():
+            return True
+        timeout = sock.gettimeout()
+        # Неблокирующий peek: отдаёт буфер, а если он пуст – только то, что уже пришло в сокет
+        sock.settimeout(0.0)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def listen(self):
+        """
+        Бесконечный генератор (uid, msg, from_address): отдаёт новые письма сразу после того,
+        как сервер сообщит о них. При обрыве связи переподключается с экспоненциальной задержкой.
+        """
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                mail = self.connect()
+                for item in self.fetch_new_emails():
+                    yield item
+                    if self._stopped.is_set():
+                        return
+                backoff = 1
+                self._flush_seen(mail)
+                self.wait_for_new_mail()
+            except (imaplib.IMAP4.error, OSError) as e:
+                self.close()
+                if self._stopped.is_set():
+                    return
+                print(f"Ошибка при работе с IMAP ({self.username}/{self.mailbox}): {e}. "
+                      f"Переподключение через {backoff} с...")
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self.close()
+
+
+def prepare_email(msg, from_addr, extractor, store):
+    """
+    Собирает текст письма для LLM: тело плюс содержимое вложений.
+    Тело проходит предобработку (text_processing.preprocess_body): text/plain лучше HTML,
+    без цитат и подписи, в пределах бюджета токенов.
+    Вложения один раз сохраняются в AttachmentStore по хэшу содержимого; уже разобранные
+    берутся из его кэша, остальные разбираются в пуле процессов (AttachmentExtractor).
+    """
+    # Основное тело письма
+    raw_body, is_html = extract_body(msg)
+    body_text, report = preprocess_body(raw_body, is_html)
+    print(f"Тело письма от {from_addr}: {report.summary()}")
+    jobs = []
+    cached = []
+
+    # Если письмо многочастное (multipart), ищем вложения
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            disp = str(part.get("Content-Disposition") or "")
+
+            # Если это вложение
+            if "attachment" in disp:
+                filename = part.get_filename()
+                if not filename:
                     continue
+                # Сохраняем файл в хранилище (повторно присланный не пишется второй раз)
+                digest, file_path = store.put(part.get_payload(decode=True) or b"")
 
-                raw_email = msg_data[0][1]
-                # Decode the enigmatic message from its raw byte form
-                msg = email.message_from_bytes(raw_email)
-                from_addr = msg.get("From", "unknown")
-                results.append((msg, from_addr))
-            mail.logout()
-        except Exception as e:
-            print(f"Ошибка при работе с IMAP: {e}")
-        return results
+                # Текст и Excel разбираем в пуле процессов – содержимое добавим в body_text
+                if is_text_attachment(ctype, filename) or is_excel_attachment(ctype, filename):
+                    job = AttachmentJob(file_path, ctype, filename, digest)
+                    content = store.get_text(digest, job.kind)
+                    if content is None:
+                        jobs.append(job)
+                    else:
+                        cached.append((job, content))
+
+    # Большие прайсы разбираются поблочно в список товаров, а не обрезанным текстом в теле письма.
+    # Прайс или обычная таблица – решает сам разбор (по числу строк), второй раз файл не разбирается
+    price_list_blocks = []
+    if os.getenv("PRICE_LIST_CHUNKING", "1").lower() in ("1", "true", "yes"):
+        excel_jobs = [job for job in jobs if job.kind == "excel"]
+        tables = split_price_lists(excel_jobs, extractor, store)
+        for digest, (filename, blocks, _) in tables.items():
+            if blocks:
+                price_list_blocks.extend(blocks)
+                body_text += f"\n\n[Прайс {filename}: {len(blocks)} блоков строк, товары разбираются отдельно]\n"
+        cached += [(job, tables[job.digest][2]) for job in excel_jobs
+                   if job.digest in tables and not tables[job.digest][1]]
+        for job in excel_jobs:
+            if job.error:
+                # Таймаут или ошибка уже при разборе – второй раз не пробуем
+                body_text += f"\n\n[{job.label}: не удалось разобрать – {job.error}]\n"
+        jobs = [job for job in jobs if job.kind != "excel"]
+
+    for job, content in cached:
+        body_text += f"\n\n[{job.label}]:\n{content}\n"
+    for job, content in extractor.extract(jobs):
+        if job.error:
+            # Не разобрали – так и пишем, а не подставляем пустое содержимое
+            body_text += f"\n\n[{job.label}: не удалось разобрать – {job.error}]\n"
+            continue
+        if content:
+            store.set_text(job.digest, job.kind, content)
+        body_text += f"\n\n[{job.label}]:\n{content}\n"
+    return body_text, price_list_blocks
 
 
-def read_text_file(file_path: str) -> str:
+def split_price_lists(excel_jobs, extractor, store) -> dict:
     """
-    Считывает содержимое текстового файла (txt, csv и т.п.) в виде строки.
-    При необходимости можно усложнить, определяя кодировку через chardet.
+    Разбирает Excel-вложения (parse_excel_attachment): {digest: (имя файла, блоки, текст)}.
+    У прайса есть блоки строк для поблочного извлечения товаров, у обычной таблицы – только
+    текст для тела письма. Файлы, которые не удалось разобрать, в результат не попадают.
+    Блоки кэшируются в AttachmentStore рядом с самим файлом, текст – как обычный разбор Excel.
     """
-    try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
-    except Exception as e:
-        print(f"Ошибка чтения текстового файла {file_path}: {e}")
-        return ""
+    tables, pending, seen = {}, [], set()
+    for job in excel_jobs:
+        if job.digest in seen:
+            continue
+        seen.add(job.digest)
+        cached = store.get_text(job.digest, "blocks")
+        if cached is None:
+            pending.append(job)
+        else:
+            tables[job.digest] = (job.filename, json.loads(cached), "")
+    for job, parsed in extractor.extract(pending, func=parse_excel_attachment):
+        if job.error:
+            continue
+        blocks, text = parsed.get("blocks") or [], parsed.get("text") or ""
+        if blocks:
+            store.set_text(job.digest, "blocks", json.dumps(blocks, ensure_ascii=False))
+        elif text:
+            store.set_text(job.digest, "excel", text)
+        tables[job.digest] = (job.filename, blocks, text)
+    return tables
+
 
-def read_excel_file(file_path: str) -> str:
+# Заголовки разделов, которые prepare_email дописывает к телу письма
+_SECTION = re.compile(r"\n\n\[Содержимое (?:Excel|файла) (.+?)\]:\n")
+_PRICE_LIST = re.compile(r"\[Прайс (.+?): \d+ блоков")
+
+
+def field_origins(body_text: str, fields) -> dict:
     """
-    Считывает содержимое Excel-файла (XLSX) построчно и возвращает в виде строки.
+    Для журнала provenance: {поле: (часть письма, способ)} по извлечённым полям
+    (ExtractedFields). Часть – раздел текста от prepare_email, где встречается значение:
+    body – тело, attachment:<файл> – вложение; message – значение в тексте дословно
+    не нашлось (модель его переформулировала).
     """
-    try:
-        wb = openpyxl.load_workbook(file_path)
-        all_text = []
-        for sheet in wb.worksheets:
-            for row in sheet.iter_rows(values_only=True):
-                # Преобразуем каждую ячейку в строку, если не None
-                row_values = [str(v) for v in row if v is not None]
-                if row_values:
-                    all_text.append(", ".join(row_values))
-        return "\n".join(all_text)
-    except Exception as e:
-        print(f"Ошибка чтения Excel-файла {file_path}: {e}")
-        return ""
+    bounds = [(0, "body")] + [(m.start(), f"attachment:{m.group(1)}") for m in _SECTION.finditer(body_text)]
+    text = body_text.lower()
+    methods = getattr(fields, "methods", {})
+    origins = {}
+    for field, value in fields.items():
+        if not value:
+            continue
+        position = text.find(str(value).strip().lower())
+        part = "message"
+        if position >= 0:
+            part = [name for start, name in bounds if start <= position][-1]
+        origins[field] = (part, methods.get(field, ""))
+    return origins
+
+
+_FIELD_LABELS = {
+    "ru": {"product_name": "название", "price": "цена", "dimensions": "размеры",
+           "weight": "вес", "material": "материал"},
+    "en": {"product_name": "name", "price": "price", "dimensions": "dimensions",
+           "weight": "weight", "material": "material"},
+}
+
+
+def price_list_reply(count: int, gaps: dict, language="ru") -> str:
+    """
+    Ответ на прайс: сколько товаров принято и у скольких каких полей не хватает
+    (gaps – {поле: [(поставщик, товар), ...]} из products_missing), с примерами товаров.
+    """
+    labels = _FIELD_LABELS.get(language, _FIELD_LABELS["en"])
+    lines = []
+    for field, missing in gaps.items():
+        if not missing:
+            continue
+        names = ", ".join(product.get("product_name", "") for _, product in missing[:3])
+        if language == "ru":
+            lines.append(f"- {labels.get(field, field)}: не указано у {len(missing)} товаров (например: {names})")
+        else:
+            lines.append(f"- {labels.get(field, field)}: missing for {len(missing)} products (e.g. {names})")
+    if language == "ru":
+        head = f"Спасибо! Прайс получен, товаров: {count}."
+        tail = "\nПожалуйста, пришлите недостающие данные по этим товарам." if lines else " Хорошего дня!"
+    else:
+        head = f"Thank you! We received your price list: {count} products."
+        tail = "\nCould you please send the missing details for these products?" if lines else " Have a nice day!"
+    return "\n".join([head] + lines) + tail
+
+
+def answer_supplier(from_addr, body_text, llm_agent, data_manager, sender, data_lock=None,
+                    price_list_blocks=None, identity=None, directory=None, source=None, exporter=None):
+    """
+    Извлекает поля через LLM, обновляет данные и отвечает поставщику
+    (благодарность или уточняющий вопрос).
+    Может работать в нескольких потоках сразу: вызовы LLM идут параллельно,
+    а обновление общих данных и запись Excel – под data_lock.
+    Большие прайсы (price_list_blocks) разбираются поблочно в список товаров поставщика;
+    тогда ответ строится по каталогу (каких полей не хватает у товаров прайса),
+    а одиночная запись из текста письма не извлекается.
+    С identity (SupplierDirectory.identify) данные хранятся под ID поставщика, а не под
+    сырым From, и ответ уходит в ту же переписку; directory запоминает Message-ID ответа.
+    source (ProvenanceSource) – письмо, которое попадёт в журнал изменений полей.
+    С exporter (ExcelExporter) поставщик только помечается к выгрузке – книга пишется в фоне;
+    без него Excel перезаписывается целиком, когда поставщик прислал всё.
+    """
+    key = identity.supplier_id if identity is not None else from_addr
+    reply_headers = {}
+    if identity is not None and identity.message_id:
+        reply_headers = {"in_reply_to": identity.message_id, "references": identity.references}
+
+    # Вызовы LLM ниже учитываются в метриках на этого поставщика
+    with llm_supplier(identity.address if identity is not None else normalize_address(from_addr)):
+        if price_list_blocks:
+            products = llm_agent.extract_products(price_list_blocks)
+            print(f"Прайс от {from_addr}: {len(price_list_blocks)} блоков, {len(products)} товаров.")
+            if products:
+                with data_lock or nullcontext():
+                    if source is not None:
+                        files = ", ".join(_PRICE_LIST.findall(body_text))
+                        source = replace(source, part=f"price_list:{files}", method="llm")
+                    data_manager.update_products(key, products, llm_agent.required_fields, source)
+                    # Полнота – по каталогу товаров поставщика, а не по одной записи из текста письма,
+                    # где от прайса осталась только пометка
+                    gaps = {
+                        field: data_manager.products_missing(field, key) for field in llm_agent.required_fields
+                    }
+                if exporter is not None:
+                    exporter.mark_dirty(key)
+                complete = not any(gaps.values())
+                sent_id = sender.reply_to_sender(
+                    from_addr,
+                    subject="Прайс получен!" if complete else "Уточнение по прайсу",
+                    body=price_list_reply(len(products), gaps, detect_language(body_text)),
+                    **reply_headers
+                )
+                if not complete and directory is not None and identity is not None:
+                    directory.link(sent_id, key)
+                return
+
+        clar_question = None
+        with data_lock or nullcontext():
+            known_data = dict(data_manager.get_data(key))
+        clarifications = llm_agent.clarifications
+        missing = [f for f in llm_agent.required_fields if not known_data.get(f)]
+        if llm_agent.single_call and (
+            clarifications is None or not clarifications.covers(missing, detect_language(body_text))
+        ):
+            # Один вызов: поля и уточняющий вопрос сразу (вопрос строится с учётом уже известного).
+            # Если кэш вопросов уже знает все наборы полей, которые могут остаться, вопрос возьмётся
+            # из него без обращения к LLM, и хватит одного извлечения
+            parsed, clar_question = llm_agent.extract_and_clarify(body_text, known_data)
+        else:
+            # Invoke the oracle to parse the supplier's cryptic answer – only for the still missing fields
+            parsed = llm_agent.parse_supplier_answer(body_text, known_data)
+        with data_lock or nullcontext():
+            if source is not None:
+                source = source.with_origins(field_origins(body_text, parsed))
+            changed = data_manager.update_data(key, parsed, source)
+            current_data = dict(data_manager.get_data(key))
+            complete = llm_agent.is_data_complete(current_data)
+            if exporter is not None:
+                # «Ничего нового» не стоит перезаписи книги
+                if changed:
+                    exporter.mark_dirty(key)
+            elif complete:
+                print(f"Собраны все данные от поставщика {from_addr}. Сохраняем в Excel...")
+                save_supplier_data_to_excel(
+                    data_manager.data, "suppliers_data.xlsx", data_manager.products,
+                    directory.addresses(data_manager.data.keys()) if directory is not None else None
+                )
+
+        # Если все данные (поля) заполнены – отправляем благодарность
+        if complete:
+            sender.reply_to_sender(
+                from_addr,
+                subject="Данные получены!",
+                body="Спасибо! Все данные получены. Хорошего дня!",
+                **reply_headers
+            )
+        else:
+            # Не все поля заполнены – запрашиваем уточнение (отдельным вызовом, если его ещё нет)
+            if not clar_question:
+                clar_question = llm_agent.generate_clarification_question(current_data, detect_language(body_text))
+            if clar_question.strip():
+                sent_id = sender.reply_to_sender(
+                    from_addr,
+                    subject="Уточнение по вашему товару",
+                    body=clar_question,
+                    **reply_headers
+                )
+                if directory is not None and identity is not None:
+                    # Ответ поставщика на наш вопрос найдётся по In-Reply-To
+                    directory.link(sent_id, key)
 
 
 def main():
     """
     The main ritual:
-      - Channel new emails from the ether.
+      - Channel new emails from every configured mailbox and folder at once,
+        as soon as the servers announce them (IMAP IDLE).
       - Interpret their vibrations with our LLM oracle.
       - Update the supplier energy matrix.
       - If the data resonates completely – immortalize it in Excel and send a cosmic thank-you.
       - If not – conjure a clarifying query and send it into the void.
     """
     # Initialize our mystical agents with the sacred parameters
+    # Все вызовы LLM идут через общий диспетчер: параллельно, но в пределах квот RPM/TPM
+    dispatcher = LLMDispatcher()
     llm_agent = SupplierLLMAgent([
         "product_name",
         "price",
         "dimensions",
         "weight",
         "material"
-    ])
-    data_manager = SupplierDataManager()
-    receiver = YandexEmailReceiver()
+    ], dispatcher=dispatcher, cache=LLMCache())
+    if llm_agent.clarifications is not None:
+        # Вопросы для всех наборов недостающих полей готовятся заранее, в фоне
+        llm_agent.clarifications.warmup_in_background(
+            llm_agent.required_fields,
+            languages=[lang.strip() for lang in os.getenv("CLARIFICATION_LANGUAGES", "ru").split(",") if lang.strip()],
+            workers=dispatcher.max_concurrency
+        )
+    # Данные поставщиков сразу пишутся в SQLite: падение процесса не теряет уже присланное
+    # Каждое изменение поля поставщика – в журнал: какое письмо его поменяло и что было до этого
+    provenance = ProvenanceLog()
+    data_manager = SQLiteSupplierDataManager(provenance=provenance)
+    data_manager.catalog.add_fields(llm_agent.required_fields)
+    # Поставщик – это ID из справочника, а не сырой From: смена имени или регистра адреса
+    # не плодит новые записи, а ответы в переписке находятся по In-Reply-To / References
+    directory = SupplierDirectory()
+    rekeyed = data_manager.rekey(lambda key: key if is_supplier_id(key) else directory.supplier_id(key))
+    if rekeyed:
+        print(f"Записи поставщиков переведены на ID: {rekeyed}")
     sender = YandexEmailSender()
+    configs = load_mailbox_configs()
 
-    print("Запущен скрипт для приёма писем...")  # The journey into the digital unknown has begun!
+    # Письма известных поставщиков всегда проходят предфильтр; рассылки и автоответы – нет.
+    # Известный – тот, от кого уже есть данные (как и supplier_index.add ниже), а не любой,
+    # кто когда-то писал
+    supplier_index = SupplierAddressIndex(
+        directory.known_addresses(list(data_manager.data.keys()) + list(data_manager.products.keys()))
+    )
+    prefilter = HeaderPrefilter.from_env(supplier_index, own_addresses=[cfg.username for cfg in configs])
+    receivers = build_receivers(configs, YandexEmailReceiver, prefilter=prefilter)
 
-    try:
+    # Письма обрабатываются параллельно: подготовка (тело, вложения в пуле процессов)
+    # и ответ поставщику (LLM через диспетчер, SMTP). Письма одного поставщика – по очереди,
+    # чтобы уточняющие вопросы строились по уже обновлённым данным.
+    extractor = AttachmentExtractor()
+    store = AttachmentStore()
+    workers = int(os.getenv("PIPELINE_WORKERS") or dispatcher.max_concurrency)
+    prepare_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prepare")
+    pipeline_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+    data_lock = threading.Lock()
+    # Excel выгружается в фоне пачками изменений, а не пересобирается на каждого поставщика
+    exporter = ExcelExporter(
+        data_manager, names=directory.address, lock=data_lock, fields=llm_agent.required_fields
+    ).start()
+    supplier_locks = {}
+
+    async def handle(item):
+        loop = asyncio.get_running_loop()
+        body_text, price_list_blocks = await loop.run_in_executor(
+            prepare_executor, prepare_email, item.msg, item.from_addr, extractor, store
+        )
+        identity = directory.identify(item.msg, item.from_addr)
+        supplier_lock = supplier_locks.setdefault(identity.supplier_id, asyncio.Lock())
         while True:
-            # Peering into the cosmic mailbox for unseen transmissions
-            new_emails = receiver.fetch_unseen_emails()
-
-            for msg, from_addr in new_emails:
-                subject = msg.get("Subject", "No Subject")
-
-                # Пытаемся получить дату письма из заголовка
-                mail_date_header = msg.get("Date")
-                if mail_date_header:
-                    try:
-                        mail_date = parsedate_to_datetime(mail_date_header)
-                    except:
-                        # Если не получилось, используем текущую дату
-                        mail_date = datetime.datetime.now()
-                else:
-                    mail_date = datetime.datetime.now()
-
-                # Формируем имя папки на основе даты и адреса (чтобы не было конфликтов)
-                folder_name = mail_date.strftime("%Y-%m-%d_%H-%M-%S")
-                folder_name = f"{folder_name}_{from_addr.replace('@','_').replace('<','').replace('>','')}"
-
-                # Создаём папку для вложений, если её ещё нет
-                os.makedirs(folder_name, exist_ok=True)
-
-                # Основное тело письма
-                body_text = ""
-
-                # Если письмо многочастное (multipart), обрабатываем каждую часть
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        ctype = part.get_content_type()
-                        disp = str(part.get("Content-Disposition") or "")
-
-                        # Если это текстовая часть (тело письма) – считываем в body_text
-                        if ctype in ["text/plain", "text/html"] and "attachment" not in disp:
-                            try:
-                                body_text = part.get_payload(decode=True).decode(
-                                    part.get_content_charset() or 'utf-8', errors='ignore'
-                                )
-                            except Exception:
-                                body_text = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-
-                        # Если это вложение
-                        if "attachment" in disp:
-                            filename = part.get_filename()
-                            if not filename:
-                                continue
-                            # Сохраняем файл во временную папку
-                            file_path = os.path.join(folder_name, filename)
-                            with open(file_path, "wb") as f:
-                                f.write(part.get_payload(decode=True))
-
-                            # Определяем, если это текст или Excel – добавляем содержимое в body_text
-                            ctype_lower = ctype.lower()
-                            if ctype_lower in ["text/plain", "text/csv"]:
-                                # Считаем как текст
-                                content = read_text_file(file_path)
-                                body_text += f"\n\n[Содержимое файла {filename}]:\n{content}\n"
-                            elif "excel" in ctype_lower:
-                                # Считаем как Excel
-                                content = read_excel_file(file_path)
-                                body_text += f"\n\n[Содержимое Excel {filename}]:\n{content}\n"
-
-                else:
-                    # Письмо не мультичастное – просто берём payload как тело
-                    body_text = msg.get_payload(decode=True).decode(
-                        msg.get_content_charset() or 'utf-8', errors='ignore'
+            try:
+                async with supplier_lock:
+                    await loop.run_in_executor(
+                        pipeline_executor, answer_supplier, item.from_addr, body_text,
+                        llm_agent, data_manager, sender, data_lock, price_list_blocks, identity, directory,
+                        ProvenanceSource(item.uid, item.source, identity.message_id), exporter
                     )
+                break
+            except LLMUnavailableError as e:
+                # LLM лежит: письмо не подтверждаем и не отвечаем заглушкой, а ждём автомат.
+                # Обработчики заняты ожиданием, поэтому новые письма копятся в очереди
+                delay = max(dispatcher.breaker.retry_in(), 1.0)
+                print(f"LLM недоступна ({e}), письмо UID {item.uid} ждёт {delay:.0f} с")
+                await asyncio.sleep(delay)
+        # Журнал изменений дописывается на диск до того, как письмо отметится обработанным
+        await loop.run_in_executor(pipeline_executor, provenance.flush)
+        if data_manager.get_data(identity.supplier_id):
+            supplier_index.add(item.from_addr)
 
-                # Invoke the oracle to parse the supplier's cryptic answer
-                parsed = llm_agent.parse_supplier_answer(body_text)
-                data_manager.update_data(from_addr, parsed)
-                current_data = data_manager.get_data(from_addr)
-
-                # Если все данные (поля) заполнены – сохраняем в Excel и отправляем благодарность
-                if llm_agent.is_data_complete(current_data):
-                    print(f"Собраны все данные от поставщика {from_addr}. Сохраняем в Excel...")
-                    save_supplier_data_to_excel(data_manager.data, "suppliers_data.xlsx")
-                    sender.reply_to_sender(
-                        from_addr,
-                        subject="Данные получены!",
-                        body="Спасибо! Все данные получены. Хорошего дня!"
-                    )
-                else:
-                    # Не все поля заполнены – запрашиваем уточнение
-                    clar_question = llm_agent.generate_clarification_question(current_data)
-                    if clar_question.strip():
-                        sender.reply_to_sender(
-                            from_addr,
-                            subject="Уточнение по вашему товару",
-                            body=clar_question
-                        )
-
-            # Drift into a meditative sleep for a minute before the next cosmic scan
-            time.sleep(60)
+    engine = MailIngestEngine(receivers, handle, workers=workers)
+    print(f"Запущен скрипт для приёма писем ({len(receivers)} папок)...")  # The journey into the digital unknown has begun!
+
+    try:
+        # One process, one coroutine per mailbox: new transmissions arrive within seconds
+        asyncio.run(engine.run())
 
     except KeyboardInterrupt:
         # The ritual is momentarily halted – secure the mystical data in Excel before fading out.
+        engine.stop()
         print("Скрипт остановлен. Сохраняем текущие данные в Excel...")
-        save_supplier_data_to_excel(data_manager.data, "suppliers_data.xlsx")
+        prepare_executor.shutdown(wait=True)
+        pipeline_executor.shutdown(wait=True)
+        extractor.shutdown()
+        dispatcher.close()
+        print(f"Кэш LLM: {llm_agent.cache.stats()}")
+        metrics = dispatcher.metrics.summary()
+        print(f"Вызовы LLM: {metrics['total']}")
+        for stage, values in metrics["by_stage"].items():
+            print(f"  этап {stage}: {values}")
+        for supplier, values in dispatcher.metrics.top_suppliers(5):
+            print(f"  поставщик {supplier}: {values}")
+        exporter.close()
+        data_manager.close()
+        directory.close()
+        provenance.close()
         print("Работа завершена.")
 
 
@@ -0,0 +1,130 @@
+"""
+Локальная заглушка OpenAI chat completions для проверки пайплайна без ключа и квоты.
+
+    python mock_llm_server.py --port 8009 --latency 2 --rate-limit 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8009/v1 OPENAI_API_KEY=mock python mail_reciver.py
+
+На запросы со схемой (json_schema) отвечает объектом ровно с полями схемы, с JSON в промпте –
+JSON-объектом (MOCK_LLM_JSON, по умолчанию "{}"), на остальные – MOCK_LLM_TEXT.
+С вероятностью --rate-limit отвечает 429 с Retry-After, с вероятностью --error-rate – 500;
+--seed делает последовательность отказов воспроизводимой.
+Без сервера то же самое даёт LLM_BACKEND=mock (см. llm_backends.py).
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import mock_content
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    rate_limit = 0.0
+    retry_after = 1
+    error_rate = 0.0
+    random = random.Random()
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        stats = MockChatHandler.stats
+        with self._lock:
+            stats["requests"] += 1
+            roll = self.random.random()
+            if roll < self.rate_limit:
+                stats["rate_limited"] += 1
+            elif roll < self.rate_limit + self.error_rate:
+                stats["errors"] += 1
+            else:
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        if roll < self.rate_limit:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                       {"Retry-After": str(self.retry_after)})
+            return
+        if roll < self.rate_limit + self.error_rate:
+            self._send(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        try:
+            time.sleep(self.latency)
+            messages = request.get("messages", [])
+            prompt = " ".join(str(m.get("content") or "") for m in messages)
+            content = mock_content(messages, request.get("response_format"))
+            prompt_tokens = len(prompt) // 3 + 1
+            completion_tokens = len(content) // 3 + 1
+            self._send(200, {
+                "id": f"chatcmpl-mock-{stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+        finally:
+            with self._lock:
+                stats["in_flight"] -= 1
+
+
+def start_mock_server(port=0, latency=0.0, rate_limit=0.0, retry_after=1, error_rate=0.0, seed=None):
+    """
+    Запускает заглушку в фоновом потоке и возвращает (server, base_url).
+    """
+    MockChatHandler.latency = latency
+    MockChatHandler.rate_limit = rate_limit
+    MockChatHandler.retry_after = retry_after
+    MockChatHandler.error_rate = error_rate
+    MockChatHandler.random = random.Random(seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockChatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI chat completions")
+    parser.add_argument("--port", type=int, default=8009)
+    parser.add_argument("--latency", type=float, default=2.0, help="задержка ответа, с")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--seed", type=int, default=None, help="зерно для воспроизводимых отказов")
+    args = parser.parse_args()
+    server, base_url = start_mock_server(args.port, args.latency, args.rate_limit, args.retry_after,
+                                         args.error_rate, args.seed)
+    print(f"Заглушка LLM слушает {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
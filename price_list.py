@@ -0,0 +1,53 @@
+import re
+
+
+def product_key(record: dict) -> str:
+    """
+    Ключ товара для дедупликации: нормализованное название плюс размеры
+    (один и тот же стол в двух размерах – два разных товара).
+    """
+    def norm(value):
+        value = str(value or "").lower().replace("ё", "е")
+        value = re.sub(r"[\s\"'«»().,;:]+", " ", value).strip()
+        return value.replace("х", "x").replace("×", "x")
+
+    return f"{norm(record.get('product_name'))}|{norm(record.get('dimensions'))}"
+
+
+def is_new_product(current: dict, new_fields: dict) -> bool:
+    """
+    Новые поля относятся к другому товару: названия есть в обоих и различаются.
+    """
+    old_name = product_key({"product_name": current.get("product_name")}).split("|", 1)[0]
+    new_name = product_key({"product_name": new_fields.get("product_name")}).split("|", 1)[0]
+    return bool(old_name and new_name and old_name != new_name)
+
+
+def catalog_match(previous: dict, new_fields: dict):
+    """
+    По какой записи искать товар в каталоге при обновлении полей поставщика.
+    Новые поля без названия относятся к текущему товару (previous) и новой строки не заводят;
+    с названием товар ищется по самой обновлённой записи (None).
+    """
+    if str(new_fields.get("product_name") or "").strip():
+        return None
+    return dict(previous)
+
+
+def merge_product_records(records, fields) -> list:
+    """
+    Reduce-шаг поблочного извлечения: склеивает записи одного товара из разных блоков
+    (и из прежних писем), заполняя пустые поля из дублей. Записи без названия отбрасываются.
+    Порядок – порядок первого появления товара.
+    """
+    merged = {}
+    for record in records:
+        if not str(record.get("product_name") or "").strip():
+            continue
+        key = product_key(record)
+        target = merged.setdefault(key, {field: "" for field in fields})
+        for field in fields:
+            value = str(record.get(field) or "").strip()
+            if value and not target.get(field):
+                target[field] = value
+    return list(merged.values())
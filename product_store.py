@@ -0,0 +1,206 @@
+import sys
+from array import array
+
+from price_list import product_key
+
+
+def _norm(value) -> str:
+    return product_key({"product_name": value}).split("|", 1)[0]
+
+
+def _bits(bitmap: int):
+    """
+    Номера установленных битов по возрастанию.
+    """
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+class ProductTable:
+    """
+    Товары всех поставщиков в колоночном виде: по списку строк на поле, массив номеров
+    поставщиков и битовые карты заполненности. Для каждого поля – одно большое целое,
+    где бит r означает «у товара r поле заполнено», поэтому «у каких товаров нет веса» –
+    это одна операция над битовыми картами (alive & ~filled["weight"]), а не обход словарей.
+    У каждой строки есть и своя маска заполненности полей (бит i – поле fields[i]).
+
+    Товар поставщика определяется названием и размерами (price_list.product_key); запись
+    без размеров сливается с единственным товаром того же названия, у которого они есть.
+    Новые поля добавляются на лету – столбец для уже известных товаров заполняется пустыми строками.
+    """
+    def __init__(self, fields=()):
+        self.fields = []
+        self._columns = {}
+        self._filled = {}
+        self._alive = 0
+        self._masks = array("Q")
+        self._supplier_of = array("I")
+        self._suppliers = []
+        self._supplier_index = {}
+        self._rows = {}
+        self._by_name = {}
+        self._count = 0
+        for field in fields:
+            self._add_field(field)
+
+    def _add_field(self, field: str):
+        if field in self._columns:
+            return
+        if len(self.fields) >= 64:
+            raise ValueError("ProductTable поддерживает не больше 64 полей")
+        self.fields.append(field)
+        self._columns[field] = [""] * self._count
+        self._filled[field] = 0
+
+    def add_fields(self, fields):
+        """
+        Заводит столбцы заранее – чтобы порядок полей был порядком required_fields, а не первой записи.
+        """
+        for field in fields:
+            self._add_field(field)
+
+    def _supplier_no(self, supplier: str) -> int:
+        number = self._supplier_index.get(supplier)
+        if number is None:
+            number = len(self._suppliers)
+            self._suppliers.append(sys.intern(str(supplier)))
+            self._supplier_index[supplier] = number
+            self._rows[number] = array("I")
+        return number
+
+    def _find(self, number: int, record: dict):
+        candidates = [
+            r for r in self._by_name.get((number, _norm(record.get("product_name"))), ()) if self._alive >> r & 1
+        ]
+        if not candidates:
+            return None
+        column = self._columns.get("dimensions")
+        known = {r: _norm(column[r]) if column is not None else "" for r in candidates}
+        dims = _norm(record.get("dimensions"))
+        for r in candidates:
+            if known[r] == dims:
+                return r
+        if not dims:
+            # Размеры в записи не указаны – дополняем единственный товар с этим названием
+            return candidates[0] if len(candidates) == 1 else None
+        blank = [r for r in candidates if not known[r]]
+        return blank[0] if blank else None
+
+    def find(self, supplier: str, record: dict):
+        """
+        Номер строки товара поставщика, с которым совпадает record (или сольётся при upsert), иначе None.
+        """
+        number = self._supplier_index.get(supplier)
+        if number is None or not str(record.get("product_name") or "").strip():
+            return None
+        return self._find(number, record)
+
+    def upsert(self, supplier: str, record: dict, overwrite=False, match=None) -> int:
+        """
+        Добавляет товар или дополняет уже известный: пустые поля заполняются, а заполненные
+        перезаписываются только с overwrite (поставщик поправил цену). Записи без названия
+        пропускаются (возвращает -1), иначе возвращает номер строки.
+        match – запись, по которой ищется товар (по умолчанию сама record); с match новая
+        строка не заводится: не нашёлся товар – возвращает -1.
+        """
+        probe = record if match is None else match
+        if not str(probe.get("product_name") or "").strip():
+            return -1
+        for field in record:
+            self._add_field(field)
+        number = self._supplier_no(supplier)
+        row = self._find(number, probe)
+        if row is None and match is not None:
+            return -1
+        if row is None:
+            row = self._count
+            self._count += 1
+            for column in self._columns.values():
+                column.append("")
+            self._masks.append(0)
+            self._supplier_of.append(number)
+            self._rows[number].append(row)
+            self._alive |= 1 << row
+            self._by_name.setdefault((number, _norm(record.get("product_name"))), []).append(row)
+        for i, field in enumerate(self.fields):
+            value = str(record.get(field) or "").strip()
+            if value and (overwrite or not self._columns[field][row]):
+                self._columns[field][row] = value
+                self._filled[field] |= 1 << row
+                self._masks[row] |= 1 << i
+        return row
+
+    def row(self, row: int) -> dict:
+        return {field: self._columns[field][row] for field in self.fields}
+
+    def rows(self, supplier: str) -> list:
+        """
+        Номера строк товаров поставщика в порядке добавления.
+        """
+        number = self._supplier_index.get(supplier)
+        if number is None:
+            return []
+        return [r for r in self._rows[number] if self._alive >> r & 1]
+
+    def products(self, supplier: str) -> list:
+        return [self.row(r) for r in self.rows(supplier)]
+
+    def suppliers(self) -> list:
+        return [s for n, s in enumerate(self._suppliers) if any(self._alive >> r & 1 for r in self._rows[n])]
+
+    def remove_supplier(self, supplier: str):
+        number = self._supplier_index.get(supplier)
+        if number is None:
+            return
+        for r in self._rows[number]:
+            self._alive &= ~(1 << r)
+        self._rows[number] = array("I")
+        for key in [k for k in self._by_name if k[0] == number]:
+            del self._by_name[key]
+
+    def _scope(self, supplier=None) -> int:
+        if supplier is None:
+            return self._alive
+        number = self._supplier_index.get(supplier)
+        if number is None:
+            return 0
+        scope = 0
+        for r in self._rows[number]:
+            scope |= 1 << r
+        return scope & self._alive
+
+    def missing_mask(self, field: str, supplier=None) -> int:
+        """
+        Битовая карта товаров (всех или одного поставщика), у которых поле не заполнено.
+        """
+        return self._scope(supplier) & ~self._filled.get(field, 0)
+
+    def count_missing(self, field: str, supplier=None) -> int:
+        return bin(self.missing_mask(field, supplier)).count("1")
+
+    def missing(self, field: str, supplier=None) -> list:
+        """
+        [(поставщик, товар), ...] без значения поля field.
+        """
+        return [(self._suppliers[self._supplier_of[r]], self.row(r)) for r in _bits(self.missing_mask(field, supplier))]
+
+    def incomplete(self, fields=None, supplier=None) -> list:
+        """
+        Товары, у которых не заполнено хотя бы одно из полей fields (по умолчанию всех известных).
+        """
+        mask = 0
+        for field in fields or self.fields:
+            mask |= self.missing_mask(field, supplier)
+        return [(self._suppliers[self._supplier_of[r]], self.row(r)) for r in _bits(mask)]
+
+    def completeness(self, row: int, fields=None) -> dict:
+        """
+        {поле: заполнено ли} для строки – по её маске.
+        """
+        mask = self._masks[row]
+        return {f: bool(mask >> i & 1) for i, f in enumerate(self.fields) if not fields or f in fields}
+
+    def __len__(self):
+        return bin(self._alive).count("1")
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, replace
+
+from price_list import product_key
+
+
+@dataclass(frozen=True)
+class ProvenanceSource:
+    """
+    Откуда пришли значения: письмо (UID в папке mailbox, Message-ID), его часть –
+    body (текст письма), attachment:<файл> (вложение), price_list:<файл> (прайс),
+    import:<файл> (перенос из выгрузки Excel), message (раздел не определён) – и чем значение
+    извлечено (method: rules, llm).
+    fields – ((поле, часть, способ), ...) для полей, у которых они свои.
+    """
+    uid: int = 0
+    mailbox: str = ""
+    message_id: str = ""
+    part: str = "body"
+    method: str = ""
+    fields: tuple = ()
+
+    def origin(self, field: str) -> tuple:
+        """
+        (часть письма, способ) для поля.
+        """
+        for name, part, method in self.fields:
+            if name == field:
+                return part, method
+        return self.part, self.method
+
+    def with_origins(self, origins: dict):
+        """
+        Копия с частью письма и способом по каждому полю: {поле: (часть, способ)}.
+        """
+        return replace(self, fields=tuple((f, part, method) for f, (part, method) in origins.items()))
+
+
+def product_field(record: dict, field: str) -> str:
+    """
+    Ключ поля товара из каталога в журнале: «product:<название|размеры>:<поле>».
+    """
+    return f"product:{product_key(record)}:{field}"
+
+
+def record_products(log, catalog, supplier: str, records, upsert, source=None) -> list:
+    """
+    Обновляет товары каталога (upsert(запись) -> номер строки) и пишет в журнал log
+    изменённые поля каждого товара (ключи product_field). Возвращает номера строк.
+    """
+    rows = []
+    for record in records:
+        before = catalog.find(supplier, record) if log is not None else None
+        old = catalog.row(before) if before is not None else {}
+        row = upsert(record)
+        rows.append(row)
+        if log is None or row < 0:
+            continue
+        new = catalog.row(row)
+        log.record(
+            supplier,
+            {product_field(new, f): v for f, v in new.items()},
+            {product_field(new, f): old.get(f, "") for f in new},
+            source,
+        )
+    return rows
+
+
+@dataclass
+class ProvenanceEntry:
+    ts: float
+    supplier: str
+    field: str
+    old: str
+    new: str
+    uid: int = 0
+    mailbox: str = ""
+    message_id: str = ""
+    part: str = ""
+    method: str = ""
+
+    def encode(self) -> str:
+        # Массив вместо объекта: имена полей не повторяются в каждой строке
+        return json.dumps(
+            [round(self.ts, 3), self.supplier, self.field, self.old, self.new,
+             self.uid, self.mailbox, self.message_id, self.part, self.method],
+            ensure_ascii=False, separators=(",", ":"),
+        )
+
+    @classmethod
+    def decode(cls, line: str):
+        return cls(*json.loads(line))
+
+
+class ProvenanceLog:
+    """
+    Журнал изменений полей поставщиков (и полей товаров из прайсов, см. product_field):
+    кто (письмо, часть письма, правила или LLM) и когда поменял значение и каким оно было
+    до этого. Только дописывание: строки копятся в буфере и сбрасываются на диск каждые
+    PROVENANCE_FLUSH_EVERY записей и после каждого обработанного письма (flush()).
+
+    Файлы в PROVENANCE_DIR: текущие сегменты segment-N.jsonl и снимок snapshot.jsonl.
+    Когда сегменты вырастают больше PROVENANCE_COMPACT_BYTES, они сворачиваются в снимок:
+    по строке на (поставщик, поле) с последними PROVENANCE_HISTORY изменениями, а сегменты удаляются.
+    В памяти – только индекс: (поставщик, поле) -> смещение строки в снимке и смещения записей
+    в сегментах, поэтому history() читает с диска ровно нужные строки, а compact() идёт по индексу
+    и держит в памяти историю одного поля за раз.
+    """
+    def __init__(self, path=None, flush_every=None, compact_bytes=None, history=None):
+        self.path = path or os.getenv("PROVENANCE_DIR", "provenance")
+        self.flush_every = int(flush_every if flush_every is not None else os.getenv("PROVENANCE_FLUSH_EVERY", "100"))
+        self.compact_bytes = int(
+            compact_bytes if compact_bytes is not None else os.getenv("PROVENANCE_COMPACT_BYTES", str(8 * 1024 * 1024))
+        )
+        self.history_size = int(history if history is not None else os.getenv("PROVENANCE_HISTORY", "50"))
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._snapshot_index = {}
+        self._segment_index = {}
+        self._buffer = []
+        self._segment = None
+        self._segment_no = 0
+        self._segment_size = 0
+        self._segments_size = 0
+        self._load()
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.path, "snapshot.jsonl")
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.path, f"segment-{number:06d}.jsonl")
+
+    def _segments(self) -> list:
+        numbers = []
+        for name in os.listdir(self.path):
+            if name.startswith("segment-") and name.endswith(".jsonl"):
+                numbers.append(int(name[len("segment-"):-len(".jsonl")]))
+        return sorted(numbers)
+
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    key = tuple(json.loads(line)["k"])
+                    self._snapshot_index[key] = offset
+                    offset += len(line)
+        for number in self._segments():
+            with open(self._segment_path(number), "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.endswith(b"\n"):
+                        # Оборванная последняя строка (падение посреди записи) пропускается
+                        entry = ProvenanceEntry.decode(line.decode("utf-8"))
+                        self._segment_index.setdefault((entry.supplier, entry.field), []).append((number, offset))
+                    offset += len(line)
+            self._segments_size += offset
+            self._segment_no = number
+        self._segment_no += 1
+
+    def record(self, supplier: str, changes: dict, old: dict, source: ProvenanceSource = None):
+        """
+        Записывает изменения полей поставщика: changes – новые значения, old – прежние.
+        Поля, значение которых не поменялось, пропускаются.
+        """
+        source = source or ProvenanceSource()
+        now = time.time()
+        entries = [
+            ProvenanceEntry(now, supplier, field, str(old.get(field) or ""), str(value),
+                            source.uid, source.mailbox, source.message_id, *source.origin(field))
+            for field, value in changes.items()
+            if value and str(value) != str(old.get(field) or "")
+        ]
+        if not entries:
+            return
+        with self._lock:
+            self._buffer.extend(entries)
+            if len(self._buffer) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._buffer:
+                return
+            if self._segment is None:
+                self._segment = open(self._segment_path(self._segment_no), "ab")
+                self._segment_size = self._segment.tell()
+            for entry in self._buffer:
+                line = (entry.encode() + "\n").encode("utf-8")
+                self._segment_index.setdefault((entry.supplier, entry.field), []).append(
+                    (self._segment_no, self._segment_size)
+                )
+                self._segment.write(line)
+                self._segment_size += len(line)
+                self._segments_size += len(line)
+            self._segment.flush()
+            self._buffer.clear()
+            if self._segments_size >= self.compact_bytes:
+                self.compact()
+
+    def _read_at(self, path: str, offset: int) -> str:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.readline().decode("utf-8")
+
+    def history(self, supplier: str, field: str) -> list:
+        """
+        Изменения поля поставщика от старых к новым (из снимка, сегментов и буфера).
+        """
+        key = (supplier, field)
+        with self._lock:
+            entries = []
+            if key in self._snapshot_index:
+                line = self._read_at(self.snapshot_path, self._snapshot_index[key])
+                entries += [ProvenanceEntry(*e) for e in json.loads(line)["h"]]
+            for number, offset in self._segment_index.get(key, []):
+                entries.append(ProvenanceEntry.decode(self._read_at(self._segment_path(number), offset)))
+            entries += [e for e in self._buffer if e.supplier == supplier and e.field == field]
+        return entries
+
+    def compact(self):
+        """
+        Сворачивает сегменты в снимок (последние history_size изменений на поле) и удаляет их.
+        Идёт по индексу поле за полем: снимок и сегменты открыты один раз, строки читаются по смещениям.
+        Новый снимок пишется во временный файл и подменяет старый атомарно.
+        """
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            # Несброшенные записи уйдут уже в новый сегмент
+            pending, self._buffer = self._buffer, []
+            files = {}
+            snapshot = open(self.snapshot_path, "rb") if os.path.exists(self.snapshot_path) else None
+            tmp_path = f"{self.snapshot_path}.tmp"
+            new_index = {}
+            try:
+                with open(tmp_path, "wb") as out:
+                    offset = 0
+                    for key in dict.fromkeys(list(self._snapshot_index) + list(self._segment_index)):
+                        history = []
+                        if key in self._snapshot_index:
+                            snapshot.seek(self._snapshot_index[key])
+                            history = json.loads(snapshot.readline())["h"]
+                        for number, position in self._segment_index.get(key, ()):
+                            if number not in files:
+                                files[number] = open(self._segment_path(number), "rb")
+                            files[number].seek(position)
+                            history.append(json.loads(files[number].readline()))
+                        line = (json.dumps({"k": list(key), "h": history[-self.history_size:]}, ensure_ascii=False,
+                                           separators=(",", ":")) + "\n").encode("utf-8")
+                        out.write(line)
+                        new_index[key] = offset
+                        offset += len(line)
+            finally:
+                for f in files.values():
+                    f.close()
+                if snapshot is not None:
+                    snapshot.close()
+            os.replace(tmp_path, self.snapshot_path)
+            for number in self._segments():
+                os.remove(self._segment_path(number))
+            self._snapshot_index = new_index
+            self._segment_index = {}
+            self._segments_size = 0
+            self._segment_no += 1
+            self._buffer = pending
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
@@ -0,0 +1,195 @@
+import re
+
+# Число с разделителями разрядов: «1 250», «1 250,50», «12.5», «1,250.00»
+_NUMBER = r"\d{1,3}(?:,\d{3})+\.\d+|\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?"
+_SEP = r"\s*[xх×*]\s*"
+
+_CURRENCIES = [
+    (r"руб(?:\.|лей|ля|ль)?|р\.|₽|rub\b", "руб."),
+    (r"usd\b|\$|долл(?:\.|аров|ара)?", "USD"),
+    (r"eur\b|€|евро", "EUR"),
+    (r"cny\b|юан(?:ей|я|ь)|¥", "CNY"),
+]
+_CURRENCY = "|".join(f"(?:{pattern})" for pattern, _ in _CURRENCIES)
+
+_PRICE_RE = re.compile(
+    rf"(?P<before>\$|€|¥)?\s*(?P<value>{_NUMBER})\s*(?P<currency>{_CURRENCY})?", re.I
+)
+_PRICE_LABEL_RE = re.compile(r"(цена|стоимость|price|cost)\b[^\n\d]{0,20}", re.I)
+_DIMENSIONS_RE = re.compile(
+    rf"(?P<a>{_NUMBER}){_SEP}(?P<b>{_NUMBER})(?:{_SEP}(?P<c>{_NUMBER}))?\s*(?P<unit>мм|см|м|mm|cm|m)\b", re.I
+)
+_WEIGHT_RE = re.compile(rf"(?P<value>{_NUMBER})\s*(?P<unit>кг|kg|тонн[аы]?|т\b|граммов|грамм|гр\b|г\b|g\b|lbs?)\.?", re.I)
+_WEIGHT_LABEL_RE = re.compile(r"(вес|масса|weight)\b", re.I)
+# Подписанное значение размеров без «AxB» или единицы длины («Размер: 2 шт», «Размер: L») размерами не считается
+_DIMENSIONS_SHAPE_RE = re.compile(rf"(?:{_NUMBER}){_SEP}(?:{_NUMBER})|(?:{_NUMBER})\s*(?:мм|см|м|mm|cm|m)\b", re.I)
+_LABEL_RE = re.compile(r"^\s*(?P<label>[\w ]{2,30}?)\s*[:：\-–—]\s*(?P<value>\S.*?)\s*$", re.M)
+
+_LABELS = {
+    "product_name": ("наименование", "название", "товар", "продукт", "product", "product name", "item"),
+    "price": ("цена", "стоимость", "price", "cost"),
+    "dimensions": ("размер", "размеры", "габариты", "габаритные размеры", "dimensions", "size"),
+    "weight": ("вес", "масса", "weight"),
+    "material": ("материал", "материалы", "material", "материал изготовления"),
+}
+
+# Окончания прилагательных («дубовый», «стальной», «стеклянная» ...) и существительных
+_ADJ = r"(?:ый|ий|ой|ая|яя|ое|ее|ые|ие|ого|его|ую|юю|ым|им|ом|ем|ых|их|ыми|ими|ей)"
+_NOUN = r"(?:а|я|ы|и|е|у|ю|ой|ей|ом|ем|ью)"
+
+# Слово с окончанием -> как записывать материал. Окончания перечислены явно и слово
+# ограничено \b с обеих сторон: иначе «деревню» – это дерево, а «absence» – ABS-пластик
+_MATERIALS = [
+    (rf"нержаве(?:ющ{_ADJ}|йк{_NOUN}?)|stainless", "нержавеющая сталь"),
+    (rf"стал(?:ь|и|ью|ей)|стальн{_ADJ}|steel", "сталь"),
+    (rf"алюмини(?:й|я|ю|ем|и|ев{_ADJ})|alumin(?:ium|um)", "алюминий"),
+    (rf"чугун{_NOUN}?|чугунн{_ADJ}|cast iron", "чугун"),
+    (rf"латун(?:ь|и|ью)|латунн{_ADJ}|brass", "латунь"),
+    (rf"мед(?:ь|и|ью)|медн{_ADJ}|copper", "медь"),
+    (rf"дуб{_NOUN}?|дубов{_ADJ}|oak", "дуб"),
+    (rf"сосн{_NOUN}|соснов{_ADJ}|pine", "сосна"),
+    (rf"бер[её]з{_NOUN}|бер[её]зов{_ADJ}|birch", "берёза"),
+    (rf"бук{_NOUN}?|буков{_ADJ}|beech", "бук"),
+    (rf"массив{_NOUN}?|древесин{_NOUN}|дерев(?:о|а|у|ом|е)|деревянн{_ADJ}|solid wood|wood(?:en)?", "дерево"),
+    (r"мдф|mdf", "МДФ"),
+    (r"л?дсп|chipboard", "ДСП"),
+    (rf"фанер{_NOUN}|фанерн{_ADJ}|plywood", "фанера"),
+    (rf"полипропилен{_NOUN}?|полипропиленов{_ADJ}|polypropylene", "полипропилен"),
+    (rf"полиэтилен{_NOUN}?|полиэтиленов{_ADJ}|polyethylene", "полиэтилен"),
+    (r"abs|абс", "ABS-пластик"),
+    (rf"пластик{_NOUN}?|пластиков{_ADJ}|пластмасс{_NOUN}|пластмассов{_ADJ}|plastics?", "пластик"),
+    (rf"стекл(?:о|а|у|ом|е)|стеклянн{_ADJ}|glass", "стекло"),
+    (rf"керамик{_NOUN}|керамическ{_ADJ}|ceramics?", "керамика"),
+    (rf"хлоп(?:ок|ка|ку|ком|ке)|хлопков{_ADJ}|хлопчатобумажн{_ADJ}|cotton", "хлопок"),
+    (rf"полиэстер{_NOUN}?|полиэстеров{_ADJ}|polyester", "полиэстер"),
+    (rf"кож{_NOUN}|кожан{_ADJ}|leather", "кожа"),
+    (rf"резин{_NOUN}|резинов{_ADJ}|rubber", "резина"),
+    (rf"силикон{_NOUN}?|силиконов{_ADJ}|silicone", "силикон"),
+    (rf"картон{_NOUN}?|картонн{_ADJ}|cardboard", "картон"),
+]
+_SPECIFIC_MATERIALS = [
+    (("нержавеющая сталь",), "сталь"),
+    (("дуб", "сосна", "берёза", "бук"), "дерево"),
+    (("ABS-пластик", "полипропилен", "полиэтилен"), "пластик"),
+]
+_MATERIAL_RES = [(re.compile(rf"\b(?:{pattern})\b", re.I), name) for pattern, name in _MATERIALS]
+
+
+def _number(value: str) -> str:
+    value = re.sub(r"[ \u00a0\u202f]", "", value)
+    if "," in value and "." in value:
+        value = value.replace(",", "")
+    return value.replace(",", ".")
+
+
+def _currency(raw: str) -> str:
+    for pattern, name in _CURRENCIES:
+        if re.fullmatch(pattern, raw.strip(), re.I):
+            return name
+    return raw
+
+
+def _unique(values):
+    """
+    Значение, если все совпадения дают одно и то же, иначе None: в длинном прайсе с десятком
+    цен правила не угадывают, какую выбрать, – это остаётся LLM.
+    """
+    values = list(dict.fromkeys(v for v in values if v))
+    return values[0] if len(values) == 1 else None
+
+
+def extract_price(text: str):
+    prices = []
+    for match in _PRICE_RE.finditer(text):
+        raw_currency = match.group("before") or match.group("currency")
+        if not raw_currency:
+            continue
+        prices.append(f"{_number(match.group('value'))} {_currency(raw_currency)}")
+    if not prices:
+        # «Цена: 1250» без валюты – только рядом с подписью
+        for label in _PRICE_LABEL_RE.finditer(text):
+            match = re.match(rf"\s*({_NUMBER})", text[label.end():])
+            if match:
+                prices.append(_number(match.group(1)))
+    return _unique(prices)
+
+
+def extract_dimensions(text: str):
+    found = []
+    for match in _DIMENSIONS_RE.finditer(text):
+        parts = [_number(match.group(k)) for k in ("a", "b", "c") if match.group(k)]
+        found.append(f"{'x'.join(parts)} {match.group('unit').lower()}")
+    return _unique(found)
+
+
+def extract_weight(text: str):
+    found = []
+    for match in _WEIGHT_RE.finditer(text):
+        unit = match.group("unit").lower()
+        if unit in ("г", "g", "т"):
+            # «2024 г.» – это год, «5 т» – не всегда тонны: короткие единицы только рядом со словом «вес»
+            if not _WEIGHT_LABEL_RE.search(text[max(0, match.start() - 30):match.start()]):
+                continue
+        found.append(f"{_number(match.group('value'))} {unit}")
+    return _unique(found)
+
+
+def extract_material(text: str):
+    found = []
+    for regex, name in _MATERIAL_RES:
+        if regex.search(text):
+            found.append(name)
+    # Конкретное поглощает общее: «нержавеющая сталь» – «сталь», порода – «дерево»,
+    # «ABS-пластик» – «пластик»
+    for specific, general in _SPECIFIC_MATERIALS:
+        if general in found and any(m in found for m in specific):
+            found = [m for m in found if m != general]
+    return _unique(found)
+
+
+def extract_labeled(text: str) -> dict:
+    """
+    Поля, явно подписанные в строке «Поле: значение».
+    """
+    result = {}
+    for match in _LABEL_RE.finditer(text):
+        label = match.group("label").strip().lower()
+        for field, labels in _LABELS.items():
+            if label in labels and field not in result:
+                result[field] = match.group("value").strip().rstrip(".;,")
+    return result
+
+
+_EXTRACTORS = {
+    "price": extract_price,
+    "dimensions": extract_dimensions,
+    "weight": extract_weight,
+    "material": extract_material,
+}
+
+
+class RuleExtractor:
+    """
+    Быстрое детерминированное извлечение полей без LLM: подписанные строки
+    («Цена: ...»), числа с единицами («1 250 руб.», «120x60x75 см», «12,5 кг»)
+    и словарь материалов. Возвращает только уверенно найденные поля;
+    остальные дозапрашиваются у LLM.
+    """
+    def __init__(self, fields):
+        self.fields = list(fields)
+
+    def extract(self, text: str) -> dict:
+        labeled = extract_labeled(text)
+        result = {}
+        for field in self.fields:
+            value = None
+            extractor = _EXTRACTORS.get(field)
+            if field in labeled:
+                value = extractor(labeled[field]) if extractor else None
+                if field != "dimensions" or _DIMENSIONS_SHAPE_RE.search(labeled[field]):
+                    value = value or labeled[field]
+            elif extractor:
+                value = extractor(text)
+            if value:
+                result[field] = value
+        return result
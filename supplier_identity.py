@@ -0,0 +1,245 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parseaddr
+
+# Один почтовый ящик под разными доменами
+_DOMAIN_ALIASES = {
+    "ya.ru": "yandex.ru",
+    "yandex.com": "yandex.ru",
+    "yandex.by": "yandex.ru",
+    "yandex.kz": "yandex.ru",
+    "yandex.ua": "yandex.ru",
+    "narod.ru": "yandex.ru",
+    "googlemail.com": "gmail.com",
+}
+_MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+_SUPPLIER_ID_RE = re.compile(r"^s\d+$")
+
+
+def canonical_address(value: str) -> str:
+    """
+    '"ООО Ромашка" <Sales+RFQ@Ya.ru>' -> 'sales@yandex.ru'.
+    Отбрасывает имя, регистр и «+метку», сводит домены-синонимы Яндекса и Gmail,
+    а для Gmail – и точки в имени ящика. Пустая строка, если адреса нет.
+    """
+    address = parseaddr(value or "")[1].strip().lower()
+    if "@" not in address:
+        return ""
+    local, _, domain = address.rpartition("@")
+    domain = _DOMAIN_ALIASES.get(domain, domain)
+    local = local.split("+", 1)[0]
+    if domain == "gmail.com":
+        local = local.replace(".", "")
+    if domain == "yandex.ru":
+        # В Яндексе точка и дефис в логине – одно и то же
+        local = local.replace(".", "-")
+    return f"{local}@{domain}" if local else ""
+
+
+def message_ids(value) -> list:
+    """
+    Все Message-ID из заголовка (In-Reply-To, References) в порядке появления.
+    """
+    return _MESSAGE_ID_RE.findall(str(value or ""))
+
+
+def is_supplier_id(key: str) -> bool:
+    return bool(_SUPPLIER_ID_RE.match(str(key or "")))
+
+
+@dataclass
+class SupplierIdentity:
+    """
+    Кто прислал письмо: короткий ID поставщика, его основной адрес, адрес отправителя
+    и Message-ID письма (для In-Reply-To ответа).
+    """
+    supplier_id: str
+    address: str
+    sender: str
+    message_id: str = ""
+    references: list = field(default_factory=list)
+    via_thread: bool = False
+
+
+class SupplierDirectory:
+    """
+    Справочник поставщиков (SUPPLIER_DB_FILE, та же база, что у SQLiteSupplierDataManager).
+    Каждому поставщику – короткий ID вида «s12», под которым хранятся его данные;
+    адреса (в каноническом виде) и Message-ID переписки указывают на этот ID.
+    Ответ поставщика находится по In-Reply-To / References одним поиском по ключу,
+    даже если пишет коллега с другого адреса – тогда адрес добавляется к тому же поставщику.
+    Недавние адреса и Message-ID держатся в памяти (LRU на SUPPLIER_IDENTITY_CACHE записей).
+    ID – интернированные строки: тысячи записей одного поставщика делят один объект.
+    """
+    def __init__(self, path=None, cache_size=None):
+        self.path = path or os.getenv("SUPPLIER_DB_FILE", "suppliers.sqlite3")
+        self.cache_size = int(cache_size if cache_size is not None else os.getenv("SUPPLIER_IDENTITY_CACHE", "10000"))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS supplier_addresses ("
+            " address TEXT PRIMARY KEY, supplier INTEGER NOT NULL, display_name TEXT, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS supplier_addresses_supplier ON supplier_addresses (supplier)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS supplier_threads ("
+            " message_id TEXT PRIMARY KEY, supplier INTEGER NOT NULL, created REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS supplier_ids (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+        self._conn.commit()
+        self._addresses = OrderedDict()
+        self._threads = OrderedDict()
+
+    @staticmethod
+    def _format(number: int) -> str:
+        return sys.intern(f"s{number}")
+
+    def _remember(self, cache: OrderedDict, key: str, value: str):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _lookup_address(self, address: str):
+        if address in self._addresses:
+            self._addresses.move_to_end(address)
+            return self._addresses[address]
+        row = self._conn.execute(
+            "SELECT supplier FROM supplier_addresses WHERE address = ?", (address,)
+        ).fetchone()
+        if row is None:
+            return None
+        supplier_id = self._format(row[0])
+        self._remember(self._addresses, address, supplier_id)
+        return supplier_id
+
+    def _lookup_thread(self, message_id: str):
+        if message_id in self._threads:
+            self._threads.move_to_end(message_id)
+            return self._threads[message_id]
+        row = self._conn.execute(
+            "SELECT supplier FROM supplier_threads WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        supplier_id = self._format(row[0])
+        self._remember(self._threads, message_id, supplier_id)
+        return supplier_id
+
+    def _add_address(self, address: str, display_name: str, supplier_id=None) -> str:
+        if supplier_id is None:
+            cursor = self._conn.execute("INSERT INTO supplier_ids DEFAULT VALUES")
+            supplier_id = self._format(cursor.lastrowid)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO supplier_addresses (address, supplier, display_name, created) VALUES (?, ?, ?, ?)",
+            (address, int(supplier_id[1:]), display_name, time.time()),
+        )
+        self._remember(self._addresses, address, supplier_id)
+        return supplier_id
+
+    def supplier_id(self, value: str, create=True):
+        """
+        ID поставщика по адресу (с именем или без). Новый адрес получает новый ID, если create.
+        """
+        address = canonical_address(value) or str(value or "").strip().lower()
+        if not address:
+            return None
+        with self._lock, self._conn:
+            supplier_id = self._lookup_address(address)
+            if supplier_id is None and create:
+                supplier_id = self._add_address(address, parseaddr(value or "")[0])
+        return supplier_id
+
+    def address(self, supplier_id: str) -> str:
+        """
+        Основной (первый известный) адрес поставщика.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT address FROM supplier_addresses WHERE supplier = ? ORDER BY created LIMIT 1",
+                (int(supplier_id[1:]),),
+            ).fetchone()
+        return row[0] if row else supplier_id
+
+    def link(self, message_id: str, supplier_id: str):
+        """
+        Запоминает, что письмо message_id (входящее или наш ответ) относится к поставщику.
+        """
+        if not message_id or not supplier_id:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO supplier_threads (message_id, supplier, created) VALUES (?, ?, ?)",
+                (message_id, int(supplier_id[1:]), time.time()),
+            )
+            self._remember(self._threads, message_id, supplier_id)
+
+    def identify(self, msg, from_addr=None) -> SupplierIdentity:
+        """
+        Определяет поставщика письма: сначала по переписке (In-Reply-To, затем References
+        от последнего к первому), потом по адресу отправителя. Message-ID письма
+        сразу привязывается к найденному поставщику.
+        """
+        from_addr = from_addr or msg.get("From", "")
+        sender = canonical_address(from_addr) or str(from_addr).strip().lower()
+        message_id = (message_ids(msg.get("Message-ID")) or [""])[0]
+        references = message_ids(msg.get("References"))
+        candidates = message_ids(msg.get("In-Reply-To")) + references[::-1]
+
+        supplier_id = None
+        via_thread = False
+        with self._lock, self._conn:
+            for candidate in candidates:
+                supplier_id = self._lookup_thread(candidate)
+                if supplier_id is not None:
+                    via_thread = True
+                    break
+            known = self._lookup_address(sender) if sender else None
+            if supplier_id is None:
+                supplier_id = known
+            if supplier_id is None and sender:
+                supplier_id = self._add_address(sender, parseaddr(from_addr)[0])
+            elif known is None and sender:
+                # Ответ в переписке с нового адреса – тот же поставщик
+                self._add_address(sender, parseaddr(from_addr)[0], supplier_id)
+        if supplier_id is None:
+            supplier_id = self.supplier_id("unknown")
+        self.link(message_id, supplier_id)
+        return SupplierIdentity(
+            supplier_id=supplier_id,
+            address=self.address(supplier_id),
+            sender=sender,
+            message_id=message_id,
+            references=references,
+            via_thread=via_thread,
+        )
+
+    def known_addresses(self, supplier_ids=None) -> list:
+        """
+        Все известные адреса, а с supplier_ids – только адреса этих поставщиков.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT address, supplier FROM supplier_addresses").fetchall()
+        if supplier_ids is None:
+            return [address for address, _ in rows]
+        wanted = {int(key[1:]) for key in supplier_ids if is_supplier_id(key)}
+        return [address for address, supplier in rows if supplier in wanted]
+
+    def addresses(self, supplier_ids) -> dict:
+        """
+        {ID: основной адрес} – для выгрузки, где вместо ID нужен адрес.
+        """
+        return {supplier_id: self.address(supplier_id) for supplier_id in supplier_ids}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from price_list import catalog_match, is_new_product, merge_product_records
+from product_store import ProductTable
+from provenance import ProvenanceSource, record_products
+
+
+class _LazyMapping(Mapping):
+    """
+    Только для чтения: {email: значение}, каждое обращение – запрос к SQLite.
+    Нужна там, где раньше ходили по словарю целиком (выгрузка в Excel, индекс адресов),
+    чтобы не держать в памяти всех поставщиков за всё время.
+    """
+    def __init__(self, keys, get):
+        self._keys = keys
+        self._get = get
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if not value:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+
+class SQLiteSupplierDataManager:
+    """
+    Данные поставщиков в SQLite (SUPPLIER_DB_FILE) вместо словаря в памяти – с тем же интерфейсом,
+    что у SupplierDataManager. Каждое поле – отдельная строка (поставщик, поле), обновление письма –
+    одна короткая транзакция с upsert только непустых полей, так что после падения или kill
+    процесса уже присланное не теряется и повторно у поставщика не запрашивается.
+    Журнал WAL: читатели не ждут писателя, запись дешёвая. При старте ничего не загружается –
+    data и products читают базу по запросу.
+    Если база пустая и задана выгрузка прошлых запусков (SUPPLIER_IMPORT_EXCEL),
+    данные берутся из неё. По умолчанию импорта нет: в этот же файл пишет ExcelExporter.
+
+    Все товары поставщика – в колоночной таблице catalog (ProductTable), куда товары
+    поставщика подгружаются из базы при первом обращении к нему; в базе каждый товар – строка.
+    """
+    def __init__(self, path=None, import_excel=None, provenance=None):
+        self.path = path or os.getenv("SUPPLIER_DB_FILE", "suppliers.sqlite3")
+        # Журнал изменений полей (ProvenanceLog), если нужен
+        self.provenance = provenance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL режим NORMAL не теряет закоммиченное при падении процесса, только при отказе питания
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS supplier_fields ("
+            " supplier TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL,"
+            " PRIMARY KEY (supplier, field)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS supplier_products ("
+            " supplier TEXT NOT NULL, position INTEGER NOT NULL, record TEXT NOT NULL,"
+            " PRIMARY KEY (supplier, position)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self.catalog = ProductTable()
+        self._loaded = set()
+        self._catalog_lock = threading.RLock()
+        self.data = _LazyMapping(self._suppliers, self.get_data)
+        self.products = _LazyMapping(self._product_suppliers, self.get_products)
+
+        import_excel = import_excel if import_excel is not None else os.getenv("SUPPLIER_IMPORT_EXCEL", "")
+        if import_excel and os.path.exists(import_excel) and not len(self.data):
+            self.import_excel(import_excel)
+
+    def _suppliers(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT supplier FROM supplier_fields").fetchall()
+        return [row[0] for row in rows]
+
+    def _product_suppliers(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT supplier FROM supplier_products").fetchall()
+        return [row[0] for row in rows]
+
+    def update_data(self, sender_email: str, new_fields: dict, source=None) -> bool:
+        """
+        Дописывает непустые поля поставщика. Возвращает, поменялось ли что-нибудь:
+        если все значения совпадают с сохранёнными, в базу ничего не пишется.
+        """
+        now = time.time()
+        rows = [(sender_email, k, str(v), now) for k, v in new_fields.items() if v]
+        if not rows:
+            return False
+        current = self.get_data(sender_email)
+        if all(current.get(k) == v for _, k, v, _ in rows):
+            return False
+        match = catalog_match(current, new_fields)
+        if self.provenance is not None:
+            self.provenance.record(sender_email, new_fields, current, source)
+        with self._lock, self._conn:
+            if is_new_product(current, new_fields):
+                # Поставщик перешёл к другому товару: прежний остаётся в каталоге, переписка – о новом
+                self._conn.execute("DELETE FROM supplier_fields WHERE supplier = ?", (sender_email,))
+                current = {}
+            self._conn.executemany(
+                "INSERT INTO supplier_fields (supplier, field, value, updated) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (supplier, field) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                rows,
+            )
+        current.update((k, v) for _, k, v, _ in rows)
+        with self._catalog_lock:
+            self._load(sender_email)
+            # Поля без названия товара дополняют только текущий товар, новую строку они не заводят
+            row = self.catalog.upsert(sender_email, current, overwrite=True, match=match)
+            if row >= 0:
+                self._save_products(sender_email, [row])
+        return True
+
+    def is_complete(self, sender_email: str, required_fields: list) -> bool:
+        stored = self.get_data(sender_email)
+        return all(stored.get(f) for f in required_fields)
+
+    def get_data(self, sender_email: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM supplier_fields WHERE supplier = ?", (sender_email,)
+            ).fetchall()
+        return dict(rows)
+
+    def _load(self, sender_email: str):
+        """
+        Подгружает товары поставщика из базы в catalog (один раз за время работы).
+        """
+        if sender_email in self._loaded:
+            return
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM supplier_products WHERE supplier = ? ORDER BY position", (sender_email,)
+            ).fetchall()
+        for (record,) in rows:
+            self.catalog.upsert(sender_email, json.loads(record))
+        self._loaded.add(sender_email)
+        if len(self.catalog.rows(sender_email)) != len(rows):
+            # Часть записей слилась (старые данные) – переписываем поставщика целиком
+            self._save_products(sender_email)
+
+    def _save_products(self, sender_email: str, changed=None):
+        """
+        Записывает товары поставщика (или только строки changed каталога) в базу.
+        Позиция товара в базе – его порядковый номер у поставщика.
+        """
+        rows = self.catalog.rows(sender_email)
+        changed = set(changed) if changed is not None else set(rows)
+        values = [
+            (sender_email, position, json.dumps(self.catalog.row(row), ensure_ascii=False))
+            for position, row in enumerate(rows) if row in changed
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO supplier_products (supplier, position, record) VALUES (?, ?, ?)", values
+            )
+            self._conn.execute(
+                "DELETE FROM supplier_products WHERE supplier = ? AND position >= ?", (sender_email, len(rows))
+            )
+
+    def get_products(self, sender_email: str) -> list:
+        with self._catalog_lock:
+            self._load(sender_email)
+            return self.catalog.products(sender_email)
+
+    def update_products(self, sender_email: str, records: list, fields: list, source=None):
+        """
+        Добавляет товары из прайса, склеивая дубли с уже известными.
+        Изменённые поля товаров пишутся в журнал provenance.
+        """
+        with self._catalog_lock:
+            self._load(sender_email)
+            self.catalog.add_fields(fields)
+            changed = record_products(
+                self.provenance, self.catalog, sender_email, merge_product_records(records, fields),
+                lambda record: self.catalog.upsert(sender_email, record), source,
+            )
+            self._save_products(sender_email, [row for row in changed if row >= 0])
+
+    def products_missing(self, field: str, supplier=None) -> list:
+        """
+        [(поставщик, товар), ...] без значения field – по битовой карте каталога.
+        Без supplier в каталог подгружаются товары всех поставщиков.
+        """
+        with self._catalog_lock:
+            for sender_email in ([supplier] if supplier else self._product_suppliers()):
+                self._load(sender_email)
+            return self.catalog.missing(field, supplier)
+
+    def rekey(self, resolve) -> int:
+        """
+        Переносит записи под новые ключи: resolve(старый ключ) -> новый (или тот же).
+        Записи, сходящиеся к одному ключу, сливаются: из полей берётся более свежее значение,
+        товары склеиваются без дублей. Возвращает число перенесённых ключей.
+        """
+        moved = 0
+        for key in dict.fromkeys(self._suppliers() + self._product_suppliers()):
+            new_key = resolve(key)
+            if not new_key or new_key == key:
+                continue
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO supplier_fields (supplier, field, value, updated)"
+                    " SELECT ?, field, value, updated FROM supplier_fields WHERE supplier = ?"
+                    " ON CONFLICT (supplier, field) DO UPDATE SET value = excluded.value, updated = excluded.updated"
+                    " WHERE excluded.updated > supplier_fields.updated",
+                    (new_key, key),
+                )
+                self._conn.execute("DELETE FROM supplier_fields WHERE supplier = ?", (key,))
+            records = self.get_products(key)
+            if records:
+                fields = list(dict.fromkeys(f for record in records for f in record))
+                self.update_products(new_key, records, fields)
+                with self._catalog_lock:
+                    self.catalog.remove_supplier(key)
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM supplier_products WHERE supplier = ?", (key,))
+            moved += 1
+        return moved
+
+    def import_excel(self, filename: str) -> int:
+        """
+        Переносит в базу выгрузку save_supplier_data_to_excel (лист Suppliers).
+        Возвращает число поставщиков.
+        """
+        import openpyxl
+        try:
+            wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+        except Exception as e:
+            print(f"Не удалось прочитать {filename} для переноса в {self.path}: {e}")
+            return 0
+        count = 0
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            headers = [str(h or "") for h in next(rows, ())]
+            for row in rows:
+                if not row or not row[0]:
+                    continue
+                self.update_data(str(row[0]), {
+                    h: str(v) for h, v in zip(headers[1:], row[1:]) if h and v not in (None, "")
+                }, ProvenanceSource(part=f"import:{os.path.basename(filename)}"))
+                count += 1
+        finally:
+            wb.close()
+        print(f"Из {filename} перенесено поставщиков: {count}")
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
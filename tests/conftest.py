@@ -0,0 +1,39 @@
+import pytest
+
+
+class RecordingSender:
+    """
+    Вместо SMTP: запоминает отправленные ответы (тема, текст).
+    """
+    def __init__(self):
+        self.sent = []
+
+    def reply_to_sender(self, recipient, subject, body, **headers):
+        self.sent.append((subject, body))
+        return "<reply@example.com>"
+
+
+class PriceListAgent:
+    """
+    Агент, который из любого прайса извлекает четыре товара (у двух нет веса).
+    """
+    required_fields = ["product_name", "price", "dimensions", "weight", "material"]
+
+    def extract_products(self, blocks):
+        return [{"product_name": f"Товар {i}", "price": str(i), "dimensions": "1x1x1 см",
+                 "weight": "" if i % 2 else "1 кг", "material": "сталь"} for i in range(4)]
+
+    def parse_supplier_answer(self, *args):
+        raise AssertionError("одиночная запись не должна извлекаться из письма с прайсом")
+
+    extract_and_clarify = generate_clarification_question = parse_supplier_answer
+
+
+@pytest.fixture
+def sender():
+    return RecordingSender()
+
+
+@pytest.fixture
+def price_list_agent():
+    return PriceListAgent()
@@ -0,0 +1,34 @@
+import os
+
+from attachment_store import AttachmentStore
+
+
+def test_same_payload_is_stored_once(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    first = store.put(b"price list")
+    assert store.put(b"price list") == first
+    assert len(store) == 1 and store.total_bytes == len(b"price list")
+
+
+def test_text_cache_and_overwrite_keep_size_exact(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    digest, _ = store.put(b"x" * 10)
+    assert store.get_text(digest, "excel") is None
+    store.set_text(digest, "excel", "a" * 20)
+    store.set_text(digest, "excel", "b" * 5)
+    assert store.get_text(digest, "excel") == "b" * 5
+    assert store.total_bytes == 15
+    # После перезапуска размер считается с диска и совпадает
+    assert AttachmentStore(str(tmp_path)).total_bytes == 15
+
+
+def test_least_recently_used_attachment_is_evicted(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=25)
+    old, old_path = store.put(b"a" * 10)
+    recent, _ = store.put(b"b" * 10)
+    store.put(b"a" * 10)  # повторное обращение: теперь давнее всех – recent
+    newest, _ = store.put(b"c" * 10)
+
+    assert store.get_text(recent, "excel") is None and recent not in store._entries
+    assert os.path.exists(old_path) and newest in store._entries
+    assert store.total_bytes == 20
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import openpyxl
+
+from attachments import AttachmentExtractor, AttachmentJob, read_excel_file
+
+
+def parse(file_path, content_type, filename):
+    if filename == "hang":
+        time.sleep(60)
+    time.sleep(0.6)
+    return f"text:{filename}"
+
+
+def test_timeout_kills_only_the_hung_file_and_resubmits_the_rest():
+    extractor = AttachmentExtractor(workers=2, timeout=1.0)
+    results = {}
+
+    def run(name, files):
+        jobs = [AttachmentJob("unused", "text/plain", f) for f in files]
+        results[name] = {job.filename: (text, job.error) for job, text in extractor.extract(jobs, func=parse)}
+
+    try:
+        hung = threading.Thread(target=run, args=("hung", ["hang"]))
+        other = threading.Thread(target=run, args=("other", ["a", "b", "c", "d"]))
+        hung.start()
+        time.sleep(0.1)
+        other.start()
+        hung.join(30)
+        other.join(30)
+    finally:
+        extractor.shutdown()
+
+    text, error = results["hung"]["hang"]
+    assert text == "" and "не уложился" in error
+    # Файлы другого письма ждали в очереди дольше таймаута и пережили пересоздание пула
+    assert results["other"] == {f: (f"text:{f}", "") for f in "abcd"}
+
+
+def save_workbook(path, sheets, hidden=()):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        sheet = wb.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+        if title in hidden:
+            sheet.sheet_state = "hidden"
+    wb.save(path)
+    return str(path)
+
+
+def test_small_table_is_read_whole_without_notes(tmp_path):
+    path = save_workbook(tmp_path / "t.xlsx", {"Цены": [["Товар", "Цена"], ["Болт", 10], [None, None]]})
+    assert read_excel_file(path) == "Товар, Цена\nБолт, 10"
+
+
+def test_row_budget_truncates_and_names_unread_sheets(tmp_path):
+    rows = [[f"Товар {i}", i] for i in range(10)]
+    path = save_workbook(tmp_path / "t.xlsx", {"Первый": rows, "Второй": rows, "Третий": rows})
+    text = read_excel_file(path, max_rows=13, max_chars=10 ** 6, max_tokens=10 ** 6)
+    lines = text.splitlines()
+    assert lines[0] == "[Лист Первый]" and "[Лист Второй]" in lines
+    assert sum(line.startswith("Товар") for line in lines) == 13
+    assert lines[-1] == "[Таблица обрезана: с листа Второй взято 3 строк из ~10, не прочитаны листы: Третий]"
+
+
+def test_char_and_token_budgets_stop_before_the_overflowing_row(tmp_path):
+    rows = [["x" * 30] for _ in range(10)]
+    path = save_workbook(tmp_path / "t.xlsx", {"Лист": rows})
+    by_chars = read_excel_file(path, max_rows=100, max_chars=100, max_tokens=10 ** 6).splitlines()
+    # 31 символ на строку с переводом: четвёртая уже не влезает в 100
+    assert by_chars[:-1] == ["x" * 30] * 3 and by_chars[-1].startswith("[Таблица обрезана: с листа Лист взято 3 строк")
+    by_tokens = read_excel_file(path, max_rows=100, max_chars=10 ** 6, max_tokens=21).splitlines()
+    assert by_tokens[:-1] == ["x" * 30] * 2 and "взято 2 строк" in by_tokens[-1]
+
+
+def test_hidden_sheets_are_skipped_and_reported(tmp_path):
+    path = save_workbook(tmp_path / "t.xlsx", {"Цены": [["Болт", 10]], "Служебный": [["секрет"]]},
+                         hidden=("Служебный",))
+    text = read_excel_file(path)
+    assert "секрет" not in text
+    assert text == "Болт, 10\n[Скрытые листы пропущены: Служебный]"
+
+
+def test_unreadable_file_gives_empty_text(tmp_path):
+    path = tmp_path / "broken.xlsx"
+    path.write_bytes(b"not a workbook")
+    assert read_excel_file(str(path)) == ""
@@ -0,0 +1,67 @@
+from agent_logic import SupplierDataManager, SupplierLLMAgent
+from clarification import ClarificationEngine
+from llm_backends import LLMResponse
+from llm_metrics import LLMMetrics
+from mail_reciver import answer_supplier
+
+
+class QuestionDispatcher:
+    def __init__(self):
+        self.metrics = LLMMetrics(log_path="")
+        self.calls = 0
+
+    def chat(self, messages, stage="", **kwargs):
+        self.calls += 1
+        return LLMResponse("Уточните, пожалуйста, вес.", "stub")
+
+
+def test_cached_question_is_counted_as_cache_hit(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLARIFICATION_CACHE_FILE", str(tmp_path / "questions.json"))
+    dispatcher = QuestionDispatcher()
+    agent = SupplierLLMAgent(dispatcher=dispatcher, clarification_cache=True)
+    data = {"product_name": "Стол", "price": "100", "dimensions": "1x1x1 см", "material": "дуб"}
+
+    first = agent.generate_clarification_question(data)
+    second = agent.generate_clarification_question(data)
+
+    assert first == second == "Уточните, пожалуйста, вес."
+    assert dispatcher.calls == 1
+    stage = dispatcher.metrics.summary()["by_stage"]["clarification"]
+    assert stage["cache_hits"] == 1
+
+
+class RoutingAgent:
+    required_fields = ["product_name", "price", "weight"]
+    single_call = True
+
+    def __init__(self, clarifications):
+        self.clarifications = clarifications
+        self.calls = []
+
+    def extract_and_clarify(self, text, known_data=None):
+        self.calls.append("extract_and_clarify")
+        return {"product_name": "Стол", "price": "", "weight": ""}, "Какие цена и вес?"
+
+    def parse_supplier_answer(self, text, known_data=None):
+        self.calls.append("parse_supplier_answer")
+        return {"product_name": "Стол", "price": "", "weight": ""}
+
+    def is_data_complete(self, data):
+        return all(data.get(f) for f in self.required_fields)
+
+    def generate_clarification_question(self, data, language="ru"):
+        self.calls.append("generate_clarification_question")
+        return self.clarifications.question([f for f in self.required_fields if not data.get(f)], language)
+
+
+def test_single_call_runs_until_clarification_cache_covers_missing_fields(tmp_path, sender):
+    engine = ClarificationEngine(lambda fields, language: f"Уточните: {', '.join(fields)}",
+                                 path=str(tmp_path / "questions.json"))
+    agent = RoutingAgent(engine)
+    answer_supplier("s@example.com", "Предлагаем стол", agent, SupplierDataManager(), sender)
+    assert agent.calls == ["extract_and_clarify"]
+
+    engine.warmup(agent.required_fields, workers=1)
+    agent.calls.clear()
+    answer_supplier("t@example.com", "Предлагаем стол", agent, SupplierDataManager(), sender)
+    assert agent.calls == ["parse_supplier_answer", "generate_clarification_question"]
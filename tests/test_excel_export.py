@@ -0,0 +1,57 @@
+import openpyxl
+
+from agent_logic import SupplierDataManager
+from excel_export import ExcelExporter
+from supplier_store import SQLiteSupplierDataManager
+
+
+def test_update_data_reports_changes(tmp_path):
+    for manager in (SupplierDataManager(), SQLiteSupplierDataManager(str(tmp_path / "s.sqlite3"), import_excel="")):
+        assert manager.update_data("s1", {"product_name": "Стол", "price": "100"})
+        assert not manager.update_data("s1", {"product_name": "Стол", "price": "100", "weight": ""})
+        assert not manager.update_data("s1", {f: "" for f in ("product_name", "price", "weight")})
+        assert manager.update_data("s1", {"price": "120"})
+
+
+def test_flush_only_when_dirty(tmp_path):
+    manager = SupplierDataManager()
+    manager.update_data("s1", {"product_name": "Стол", "price": "100"})
+    manager.update_data("s2", {"product_name": "Стул", "price": "50"})
+    path = tmp_path / "suppliers.xlsx"
+    exporter = ExcelExporter(manager, str(path), names=lambda key: f"{key}@example.com",
+                             fields=["product_name", "price", "weight"])
+
+    assert not exporter.flush()
+    assert not path.exists()
+
+    exporter.mark_dirty("s1")
+    assert exporter.flush()
+    # Первая выгрузка берёт всех поставщиков, а не только помеченного
+    rows = list(openpyxl.load_workbook(path).worksheets[0].iter_rows(values_only=True))
+    assert rows[0] == ("supplier_email", "product_name", "price", "weight")
+    assert [row[0] for row in rows[1:]] == ["s1@example.com", "s2@example.com"]
+    assert not exporter.flush()
+
+    manager.update_data("s2", {"weight": "3 кг"})
+    exporter.mark_dirty("s2")
+    assert exporter.flush() and exporter.exports == 2
+    rows = list(openpyxl.load_workbook(path).worksheets[0].iter_rows(values_only=True))
+    assert rows[2] == ("s2@example.com", "Стул", "50", "3 кг")
+    assert [p.name for p in tmp_path.iterdir()] == ["suppliers.xlsx"]
+
+
+def test_batch_threshold_wakes_the_thread(tmp_path):
+    manager = SupplierDataManager()
+    path = tmp_path / "suppliers.xlsx"
+    exporter = ExcelExporter(manager, str(path), interval=3600, batch=3).start()
+    try:
+        for i in range(3):
+            manager.update_data(f"s{i}", {"product_name": f"Товар {i}"})
+            exporter.mark_dirty(f"s{i}")
+        for _ in range(100):
+            if exporter.exports:
+                break
+            exporter._stop.wait(0.02)
+        assert exporter.exports == 1
+    finally:
+        exporter.close()
@@ -0,0 +1,38 @@
+from imap_fetch import compress_uid_set, parse_bodystructure, parse_fetch_response, is_wanted_part
+
+XLSX = b"VND.OPENXMLFORMATS-OFFICEDOCUMENT.SPREADSHEETML.SHEET"
+
+# Ответ imaplib на UID FETCH двух писем: литерал BODY[1] приходит отдельным элементом кортежа
+FETCH = [
+    (b'1 (UID 12 RFC822.SIZE 3456 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL '
+     b'"QUOTED-PRINTABLE" 120 4 NIL NIL NIL NIL)("APPLICATION" "' + XLSX + b'" ("NAME" "price.xlsx") NIL NIL '
+     b'"BASE64" 2048 NIL ("ATTACHMENT" ("FILENAME*" "utf-8\'\'%D0%9F%D1%80%D0%B0%D0%B9%D1%81.xlsx")) NIL NIL)'
+     b'("IMAGE" "JPEG" ("NAME" "logo.jpg") NIL NIL "BASE64" 9000 NIL ("INLINE" ("FILENAME" "logo.jpg")) NIL NIL) '
+     b'"MIXED" ("BOUNDARY" "b1") NIL NIL NIL) BODY[1] {11}', b"Hello world"),
+    b")",
+    b'2 (UID 13 RFC822.SIZE 10 BODYSTRUCTURE ("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL NIL))',
+]
+
+
+def test_parse_fetch_response():
+    first, second = parse_fetch_response(FETCH)
+    assert (first["UID"], first["RFC822.SIZE"], first["BODY[1]"]) == (12, 3456, b"Hello world")
+    assert (second["UID"], second["RFC822.SIZE"]) == (13, 10)
+    assert "BODY[1]" not in second
+
+
+def test_parse_bodystructure_sections_and_filenames():
+    first, second = parse_fetch_response(FETCH)
+    text, excel, image = parse_bodystructure(first["BODYSTRUCTURE"])
+    assert (text.section, text.content_type, text.encoding, text.size) == ("1", "text/plain", "QUOTED-PRINTABLE", 120)
+    assert (excel.section, excel.disposition, excel.filename) == ("2", "attachment", "Прайс.xlsx")
+    assert excel.is_attachment
+    assert [is_wanted_part(p) for p in (text, excel, image)] == [True, True, False]
+
+    [html] = parse_bodystructure(second["BODYSTRUCTURE"])
+    assert (html.section, html.content_type) == ("1", "text/html")
+
+
+def test_compress_uid_set():
+    assert compress_uid_set([10, 1, 2, 3, 7, 9, 2]) == "1:3,7,9:10"
+    assert compress_uid_set([]) == ""
@@ -0,0 +1,124 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from mail_checkpoint import MailboxCheckpoint
+from mail_reciver import YandexEmailReceiver
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    """
+    Минимальный IMAP-сервер: LOGIN, SELECT, UID SEARCH, NOOP, IDLE и LOGOUT.
+    Поведение IDLE в каждой сессии задаёт server.idle_modes: "exists" – «+ idling» и «* 4 EXISTS»
+    одним пакетом, "drop" – оборвать соединение, "quiet" – молчать до DONE.
+    """
+    def send(self, text):
+        self.wfile.write(text.encode())
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            session = server.sessions
+            server.sessions += 1
+        idle_mode = server.idle_modes[min(session, len(server.idle_modes) - 1)]
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] fake ready\r\n")
+        idle_tag = None
+        for raw in self.rfile:
+            line = raw.decode().strip()
+            if idle_tag is not None:
+                if line.upper() == "DONE":
+                    self.send(f"{idle_tag} OK IDLE terminated\r\n")
+                    idle_tag = None
+                continue
+            tag, _, rest = line.partition(" ")
+            command = rest.split(" ")[0].upper()
+            if command == "CAPABILITY":
+                self.send(f"* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK done\r\n")
+            elif command == "LOGIN":
+                self.send(f"{tag} OK logged in\r\n")
+            elif command == "SELECT":
+                self.send(f"* 3 EXISTS\r\n* OK [UIDVALIDITY 7] ok\r\n* OK [UIDNEXT 4] ok\r\n"
+                          f"{tag} OK [READ-WRITE] selected\r\n")
+            elif command == "UID":
+                self.send(f"* SEARCH\r\n{tag} OK search done\r\n")
+            elif command == "NOOP":
+                self.send(f"{tag} OK noop\r\n")
+            elif command == "IDLE":
+                if idle_mode == "drop":
+                    return
+                idle_tag = tag
+                self.send("+ idling\r\n* 4 EXISTS\r\n" if idle_mode == "exists" else "+ idling\r\n")
+            elif command == "LOGOUT":
+                self.send(f"* BYE bye\r\n{tag} OK logout\r\n")
+                return
+            else:
+                self.send(f"{tag} BAD unknown command\r\n")
+
+
+@pytest.fixture
+def imap_server():
+    servers = []
+
+    def start(*idle_modes):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeIMAPHandler)
+        server.daemon_threads = True
+        server.sessions = 0
+        server.lock = threading.Lock()
+        server.idle_modes = idle_modes
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_receiver(server, tmp_path):
+    return YandexEmailReceiver(
+        imap_server="127.0.0.1", port=server.server_address[1], use_ssl=False, username="buyer", password="x",
+        checkpoint=MailboxCheckpoint(str(tmp_path / "checkpoint.json")), socket_timeout=5,
+    )
+
+
+def test_exists_in_the_same_packet_as_idle_ack_wakes_immediately(imap_server, tmp_path):
+    receiver = make_receiver(imap_server("exists"), tmp_path)
+    receiver.connect()
+    assert receiver.supports_idle
+
+    started = time.monotonic()
+    assert receiver.wait_for_new_mail(timeout=30)
+    # Без учёта буфера imaplib ожидание шло бы все 30 секунд
+    assert time.monotonic() - started < 10
+    receiver.close()
+
+
+def test_quiet_idle_returns_no_changes_after_timeout(imap_server, tmp_path):
+    receiver = make_receiver(imap_server("quiet"), tmp_path)
+    receiver.connect()
+    assert not receiver.wait_for_new_mail(timeout=0.2)
+    # Сессия после DONE остаётся рабочей
+    assert receiver.mail.noop()[0] == "OK"
+    receiver.close()
+
+
+def test_listen_reconnects_after_dropped_connection(imap_server, tmp_path, monkeypatch):
+    server = imap_server("drop", "quiet")
+    receiver = make_receiver(server, tmp_path)
+
+    def fetch_new_emails():
+        # Письмо «приходит» только во второй сессии
+        if server.sessions > 1:
+            yield 4, None, "supplier@example.com"
+
+    monkeypatch.setattr(receiver, "fetch_new_emails", fetch_new_emails)
+    monkeypatch.setattr(receiver._stopped, "wait", lambda timeout=None: False)
+
+    uid, _, sender = next(receiver.listen())
+    assert (uid, sender) == (4, "supplier@example.com")
+    assert server.sessions == 2
+    receiver.close()
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import pytest
+
+from llm_backends import (
+    MockBackend, RateLimitedLLMError, RecordReplayBackend, ReplayMissError, TransientLLMError, make_backend,
+)
+
+MESSAGES = [{"role": "user", "content": "Пришлите цену на болт М8"}]
+SCHEMA = {"type": "json_schema", "json_schema": {"name": "offer", "schema": {
+    "type": "object",
+    "properties": {"price": {"type": "string"}, "items": {"type": "array"}, "delivery": {
+        "type": "object", "properties": {"days": {"type": "string"}},
+    }},
+}}}
+
+
+def test_mock_backend_is_deterministic_and_follows_the_schema():
+    response = asyncio.run(MockBackend(latency=0, seed=1).complete(MESSAGES, "m", response_format=SCHEMA))
+    assert json.loads(response.content) == {"price": "", "items": [], "delivery": {"days": ""}}
+    assert response.model == "m"
+    assert response.usage.total_tokens == response.usage.prompt_tokens + response.usage.completion_tokens > 0
+
+    text = asyncio.run(MockBackend(latency=0).complete(MESSAGES, "m"))
+    assert text.content == "Пожалуйста, уточните недостающие данные."
+
+
+def test_mock_backend_error_rate_is_reproducible():
+    async def outcomes(seed):
+        backend = MockBackend(latency=0, error_rate=0.5, seed=seed)
+        result = []
+        for _ in range(20):
+            try:
+                await backend.complete(MESSAGES, "m")
+                result.append("ok")
+            except RateLimitedLLMError:
+                result.append("429")
+            except TransientLLMError:
+                result.append("5xx")
+        return result
+
+    first = asyncio.run(outcomes(7))
+    assert first == asyncio.run(outcomes(7))
+    assert {"ok", "429", "5xx"} <= set(first)
+
+
+def test_recorded_responses_replay_without_the_inner_backend(tmp_path):
+    path = str(tmp_path / "replay.jsonl")
+    inner = MockBackend(latency=0)
+    recorder = RecordReplayBackend(path, mode="record", inner=inner)
+    recorded = asyncio.run(recorder.complete(MESSAGES, "m", response_format=SCHEMA))
+    # Повторный запрос берётся из записи, во внутренний бэкенд не идёт
+    assert asyncio.run(recorder.complete(MESSAGES, "m", response_format=SCHEMA)) == recorded
+    assert inner.calls == 1
+
+    replay = RecordReplayBackend(path, mode="replay")
+    assert asyncio.run(replay.complete(MESSAGES, "m", response_format=SCHEMA)) == recorded
+    with pytest.raises(ReplayMissError):
+        # Другие параметры – другой ключ
+        asyncio.run(replay.complete(MESSAGES, "m"))
+
+
+def test_record_mode_needs_an_inner_backend(tmp_path):
+    with pytest.raises(ValueError):
+        RecordReplayBackend(str(tmp_path / "replay.jsonl"), mode="record")
+    with pytest.raises(ValueError):
+        make_backend("nonsense")
+    assert isinstance(make_backend("mock"), MockBackend)
@@ -0,0 +1,60 @@
+import llm_cache
+from llm_cache import LLMCache
+
+
+def make_cache(tmp_path, **options):
+    return LLMCache(str(tmp_path / "cache.sqlite3"), **options)
+
+
+def test_key_ignores_whitespace_but_not_fields_or_model():
+    key = LLMCache.make_key("Цена  100 руб.\n\n\nВес 5 кг ", ["price"], "1", "m")
+    assert key == LLMCache.make_key("Цена 100 руб.\nВес 5 кг", ["price"], "1", "m")
+    assert key != LLMCache.make_key("Цена 100 руб.\nВес 5 кг", ["price", "weight"], "1", "m")
+    assert key != LLMCache.make_key("Цена 100 руб.\nВес 5 кг", ["price"], "1", "other")
+
+
+def test_hit_and_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get("k") is None
+    cache.set("k", {"price": "100 руб."})
+    assert cache.get("k") == {"price": "100 руб."}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+    cache.close()
+
+    reopened = make_cache(tmp_path)
+    assert reopened.get("k") == {"price": "100 руб."}
+    reopened.close()
+
+
+def test_expired_entry_is_a_miss(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    cache = make_cache(tmp_path, ttl=60)
+    cache.set("k", {"price": "100"})
+    now[0] += 59
+    assert cache.get("k") == {"price": "100"}
+    now[0] += 2
+    assert cache.get("k") is None
+    cache.close()
+
+
+def test_explicit_zero_ttl_is_not_the_default(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_TTL", "3600")
+    cache = make_cache(tmp_path, ttl=0)
+    assert cache.ttl == 0
+    cache.close()
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    cache = make_cache(tmp_path, max_entries=2)
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.set(key, key)
+    now[0] += 1
+    cache.get("a")
+    cache._evict()
+    assert cache.get("a") == "a" and cache.get("c") == "c"
+    assert cache.get("b") is None
+    cache.close()
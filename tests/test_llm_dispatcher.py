@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from llm_backends import LLMBackend, LLMResponse, LLMUnavailableError, OpenAIBackend, TransientLLMError
+from llm_dispatcher import CircuitBreaker, LLMDispatcher
+from llm_metrics import LLMMetrics
+from mock_llm_server import MockChatHandler, start_mock_server
+
+MESSAGES = [{"role": "user", "content": "Цена?"}]
+
+
+class ScriptedBackend(LLMBackend):
+    """
+    Отвечает по очереди: исключение – бросает, "hang" – не отвечает, остальное – текст ответа.
+    """
+    def __init__(self, *script):
+        self.script = list(script)
+
+    async def complete(self, messages, model, **kwargs):
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        if step == "hang":
+            await asyncio.sleep(3600)
+        return LLMResponse(step, model)
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    async def scenario():
+        dispatcher = LLMDispatcher(ScriptedBackend(TransientLLMError("500"), "hang", "ok"), max_retries=0,
+                                   breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.01))
+        with pytest.raises(LLMUnavailableError):
+            await dispatcher._dispatch(MESSAGES, "m")
+        assert dispatcher.breaker.is_open
+        await asyncio.sleep(0.02)
+
+        probe = asyncio.ensure_future(dispatcher._dispatch(MESSAGES, "m"))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        response = await dispatcher._dispatch(MESSAGES, "m")
+        assert response.content == "ok"
+        assert not dispatcher.breaker.is_open
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**options):
+        MockChatHandler.stats.update(requests=0, rate_limited=0, errors=0, in_flight=0, max_in_flight=0)
+        server, base_url = start_mock_server(seed=1, **options)
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_dispatcher(base_url, **options):
+    return LLMDispatcher(OpenAIBackend(api_key="mock", base_url=base_url), metrics=LLMMetrics(log_path=""), **options)
+
+
+def run_many(dispatcher, count):
+    async def calls():
+        return await asyncio.gather(*(
+            dispatcher.achat([{"role": "user", "content": f"Письмо {i}"}], "mock", stage="extract")
+            for i in range(count)
+        ))
+    return asyncio.run(calls())
+
+
+def test_requests_run_concurrently_under_the_cap(mock_server):
+    dispatcher = make_dispatcher(mock_server(latency=0.3), max_concurrency=4)
+    try:
+        responses = run_many(dispatcher, 8)
+    finally:
+        dispatcher.close()
+    assert len(responses) == 8 and all(r.usage.total_tokens for r in responses)
+    # Параллельность видна по числу одновременных запросов на сервере, а не по времени
+    assert MockChatHandler.stats["max_in_flight"] == 4
+    assert dispatcher.metrics.summary()["by_stage"]["extract"]["calls"] == 8
+
+
+def test_rate_limited_requests_are_retried_after_pause(mock_server):
+    dispatcher = make_dispatcher(mock_server(rate_limit=0.5, retry_after=0), max_retries=10,
+                                 breaker=CircuitBreaker(failure_threshold=1))
+    try:
+        responses = run_many(dispatcher, 6)
+    finally:
+        dispatcher.close()
+    assert len(responses) == 6
+    assert MockChatHandler.stats["rate_limited"] > 0
+    # 429 – квота, а не отказ: автомат остаётся замкнутым
+    assert not dispatcher.breaker.is_open
+
+
+def test_breaker_opens_on_server_errors_and_stops_calling(mock_server):
+    dispatcher = make_dispatcher(mock_server(error_rate=1.0), max_retries=0,
+                                 breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    try:
+        for _ in range(2):
+            with pytest.raises(LLMUnavailableError):
+                dispatcher.chat([{"role": "user", "content": "Цена?"}], "mock")
+        assert dispatcher.breaker.is_open
+        with pytest.raises(LLMUnavailableError, match="разомкнут"):
+            dispatcher.chat([{"role": "user", "content": "Цена?"}], "mock")
+    finally:
+        dispatcher.close()
+    assert MockChatHandler.stats["requests"] == 2
@@ -0,0 +1,33 @@
+from mail_filters import ACCEPT, SKIP, HeaderPrefilter, SupplierAddressIndex
+from supplier_identity import SupplierDirectory, canonical_address
+
+
+def test_index_matches_canonical_directory_addresses():
+    index = SupplierAddressIndex([canonical_address("Ivan.Petrov@ya.ru")])
+    assert "Ivan.Petrov@ya.ru" in index
+    assert '"Иван" <ivan.petrov+rfq@YANDEX.RU>' in index
+    assert "ivan@yandex.ru" not in index
+
+
+def test_known_only_accepts_alias_of_known_supplier():
+    index = SupplierAddressIndex(["ivan-petrov@yandex.ru"])
+    prefilter = HeaderPrefilter(supplier_index=index, known_only=True)
+    assert prefilter.check({"From": "Ivan.Petrov@ya.ru"})[0] == ACCEPT
+    assert prefilter.check({"From": "stranger@example.com"})[0] == SKIP
+
+
+def test_auto_reply_from_known_supplier_is_skipped():
+    prefilter = HeaderPrefilter(supplier_index=SupplierAddressIndex(["ivan@yandex.ru"]))
+    assert prefilter.check({"From": "ivan@yandex.ru"})[0] == ACCEPT
+    for header, value in (("Auto-Submitted", "auto-replied"), ("X-Autoreply", "yes"),
+                          ("List-Id", "<news.example.com>"), ("Precedence", "bulk")):
+        assert prefilter.check({"From": "ivan@yandex.ru", header: value})[0] == SKIP
+
+
+def test_known_addresses_limited_to_given_suppliers(tmp_path):
+    directory = SupplierDirectory(str(tmp_path / "suppliers.sqlite3"))
+    supplier = directory.supplier_id("ivan@yandex.ru")
+    directory.supplier_id("stranger@example.com")
+    assert directory.known_addresses([supplier]) == ["ivan@yandex.ru"]
+    assert sorted(directory.known_addresses()) == ["ivan@yandex.ru", "stranger@example.com"]
+    directory.close()
@@ -0,0 +1,102 @@
+import asyncio
+from email.message import EmailMessage
+
+from mail_checkpoint import MailboxCheckpoint
+from mail_ingest import DeadLetterLog, IncomingEmail, MailIngestEngine
+from mail_reciver import YandexEmailReceiver
+
+
+def make_receiver(tmp_path, fetched):
+    receiver = YandexEmailReceiver(
+        imap_server="127.0.0.1", username="buyer", password="x", mailbox="INBOX",
+        checkpoint=MailboxCheckpoint(str(tmp_path / "checkpoint.json")), mark_seen=False,
+    )
+    receiver.uidvalidity = 7
+    receiver._fetched_uid = max(fetched)
+    receiver._pending = set(fetched)
+    return receiver
+
+
+def message(uid):
+    msg = EmailMessage()
+    msg["From"] = "supplier@example.com"
+    msg["Subject"] = f"письмо {uid}"
+    msg.set_content("Цена 100 руб")
+    return msg
+
+
+def test_checkpoint_advances_over_contiguous_prefix_only(tmp_path):
+    receiver = make_receiver(tmp_path, [1, 2, 3])
+    receiver.mark_processed(2)
+    assert receiver.last_uid == 0
+    receiver.mark_processed(1)
+    assert receiver.last_uid == 2
+    receiver.mark_processed(3)
+    assert receiver.checkpoint.get(receiver.checkpoint_key) == (7, 3)
+
+
+def test_failing_message_is_dead_lettered_and_acknowledged(tmp_path):
+    receiver = make_receiver(tmp_path, [1, 2, 3])
+    calls = {}
+
+    async def handler(item):
+        calls[item.uid] = calls.get(item.uid, 0) + 1
+        if item.uid == 2:
+            raise ValueError("не разобрать")
+
+    dead_letter = DeadLetterLog(str(tmp_path / "dead"))
+    engine = MailIngestEngine([receiver], handler, retries=2, retry_delay=0.01, dead_letter=dead_letter)
+
+    async def run():
+        queue = asyncio.Queue()
+        for uid in (1, 2, 3):
+            queue.put_nowait(IncomingEmail(receiver, uid, message(uid), "supplier@example.com"))
+        consumer = asyncio.ensure_future(engine._consume(queue))
+        for _ in range(200):
+            if receiver.last_uid == 3:
+                break
+            await asyncio.sleep(0.01)
+        consumer.cancel()
+
+    asyncio.run(run())
+    assert calls == {1: 1, 2: 3, 3: 1}
+    assert receiver.checkpoint.get(receiver.checkpoint_key) == (7, 3)
+    [entry] = dead_letter.entries()
+    assert entry["uid"] == 2 and entry["attempts"] == 3 and "не разобрать" in entry["error"]
+    assert (tmp_path / "dead" / entry["eml"]).read_bytes().startswith(b"From:")
+
+
+class FolderState:
+    """
+    То, что imaplib отдаёт после SELECT: UIDVALIDITY, UIDNEXT и результаты UID SEARCH.
+    """
+    def __init__(self, uidvalidity, uidnext, unseen=()):
+        self.responses = {"UIDVALIDITY": [str(uidvalidity).encode()], "UIDNEXT": [str(uidnext).encode()]}
+        self.unseen = unseen
+
+    def response(self, name):
+        return name, self.responses[name]
+
+    def uid(self, command, charset, criteria):
+        return "OK", [" ".join(str(uid) for uid in self.unseen).encode()]
+
+
+def test_uidvalidity_change_resets_checkpoint(tmp_path):
+    receiver = make_receiver(tmp_path, [1, 2, 3])
+    for uid in (1, 2, 3):
+        receiver.mark_processed(uid)
+    assert receiver.checkpoint.get(receiver.checkpoint_key) == (7, 3)
+
+    # Та же папка после переподключения: отметка сохраняется
+    receiver.uidvalidity = None
+    receiver._sync_checkpoint(FolderState(7, 50, unseen=[40]))
+    assert receiver.last_uid == 3
+
+    # Сервер пересчитал UID: продолжаем с первого непрочитанного письма
+    receiver._sync_checkpoint(FolderState(8, 50, unseen=[40, 41]))
+    assert (receiver.uidvalidity, receiver.last_uid) == (8, 39)
+    assert receiver.checkpoint.get(receiver.checkpoint_key) == (8, 39)
+
+    # Непрочитанных нет – с текущего конца папки
+    receiver._sync_checkpoint(FolderState(9, 50))
+    assert receiver.checkpoint.get(receiver.checkpoint_key) == (9, 49)
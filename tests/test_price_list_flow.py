@@ -0,0 +1,91 @@
+import io
+from email.message import EmailMessage
+
+import openpyxl
+
+from attachment_store import AttachmentStore
+from mail_reciver import answer_supplier, prepare_email
+from agent_logic import SupplierDataManager
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def workbook(rows) -> bytes:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Товар", "Цена", "Вес"])
+    for row in rows:
+        ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+class InlineExtractor:
+    """
+    Разбирает вложения в том же процессе и запоминает, что чем разбиралось.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def extract(self, jobs, func=None):
+        from attachments import extract_attachment_text
+        func = func or extract_attachment_text
+        for job in jobs:
+            self.calls.append((func.__name__, job.filename))
+            yield job, func(job.file_path, job.content_type, job.filename)
+
+
+def test_each_excel_attachment_is_parsed_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("PRICE_LIST_ROWS_PER_CHUNK", "10")
+    msg = EmailMessage()
+    msg["From"] = "supplier@example.com"
+    msg.set_content("Прайс и образец во вложении")
+    msg.add_attachment(workbook([["Стол", 100, 5]]), maintype="application",
+                       subtype=XLSX.split("/")[1], filename="sample.xlsx")
+    msg.add_attachment(workbook([[f"Товар {i}", i, 1] for i in range(25)]), maintype="application",
+                       subtype=XLSX.split("/")[1], filename="price.xlsx")
+    extractor = InlineExtractor()
+
+    body, blocks = prepare_email(msg, "supplier@example.com", extractor, AttachmentStore(str(tmp_path)))
+
+    assert sorted(extractor.calls) == [("parse_excel_attachment", "price.xlsx"),
+                                       ("parse_excel_attachment", "sample.xlsx")]
+    assert len(blocks) == 3
+    # Обычная таблица читается read_excel_file, а не блоком прайса
+    assert "[Содержимое Excel sample.xlsx]:\nТовар, Цена, Вес\nСтол, 100, 5" in body
+    assert "[Прайс price.xlsx: 3 блоков строк" in body
+
+
+def test_small_multi_sheet_workbook_is_not_a_price_list(tmp_path, monkeypatch):
+    monkeypatch.setenv("PRICE_LIST_ROWS_PER_CHUNK", "10")
+    wb = openpyxl.Workbook()
+    for title in ("Столы", "Стулья"):
+        ws = wb.create_sheet(title)
+        ws.append(["Товар", "Цена"])
+        ws.append([title, 100])
+        ws.append([title + " 2", 200])
+    del wb["Sheet"]
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    msg = EmailMessage()
+    msg["From"] = "supplier@example.com"
+    msg.set_content("Во вложении")
+    msg.add_attachment(buffer.getvalue(), maintype="application", subtype=XLSX.split("/")[1], filename="two.xlsx")
+
+    body, blocks = prepare_email(msg, "supplier@example.com", InlineExtractor(), AttachmentStore(str(tmp_path)))
+
+    assert blocks == []
+    assert "[Лист Стулья]" in body and "Стулья 2, 200" in body
+
+
+def test_price_list_reply_is_based_on_catalog(sender, price_list_agent):
+    manager = SupplierDataManager()
+    answer_supplier("supplier@example.com", "[Прайс price.xlsx: 2 блоков строк]", price_list_agent,
+                    manager, sender, price_list_blocks=["a", "b"])
+
+    [(subject, body)] = sender.sent
+    assert subject == "Уточнение по прайсу"
+    assert "товаров: 4" in body and "вес: не указано у 2 товаров" in body
+    assert manager.get_data("supplier@example.com") == {}
+    assert len(manager.get_products("supplier@example.com")) == 4
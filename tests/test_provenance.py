@@ -0,0 +1,86 @@
+import json
+
+from agent_logic import ExtractedFields, SupplierDataManager
+from mail_reciver import answer_supplier, field_origins
+from provenance import ProvenanceLog, ProvenanceSource, product_field
+
+BODY = ("Цена 1500 руб., материал уточним.\n\n"
+        "[Содержимое Excel spec.xlsx]:\nСтол | 120x80x75 см | дуб\n")
+
+
+class FieldsAgent:
+    required_fields = ["product_name", "price", "dimensions", "weight", "material"]
+
+    def __init__(self):
+        self.fields = ExtractedFields(product_name="Стол", price="1500 руб.", dimensions="120x80x75 см",
+                                      weight="", material="Дуб")
+        self.fields.methods = {"product_name": "llm", "price": "rules", "dimensions": "rules", "material": "llm"}
+
+    single_call = False
+    clarifications = None
+
+    def parse_supplier_answer(self, text, known_data=None):
+        return self.fields
+
+    def is_data_complete(self, data):
+        return all(data.get(f) for f in self.required_fields)
+
+    def generate_clarification_question(self, data, language="ru"):
+        return "Какой вес?"
+
+
+def test_field_origins_locate_the_part_of_the_letter():
+    origins = field_origins(BODY, FieldsAgent().fields)
+    assert origins["price"] == ("body", "rules")
+    assert origins["dimensions"] == ("attachment:spec.xlsx", "rules")
+    assert origins["material"] == ("attachment:spec.xlsx", "llm")
+    assert "weight" not in origins
+
+
+def test_answer_records_part_and_method_per_field(tmp_path, sender):
+    log = ProvenanceLog(str(tmp_path))
+    manager = SupplierDataManager(provenance=log)
+    answer_supplier("s@example.com", BODY, FieldsAgent(), manager, sender,
+                    source=ProvenanceSource(7, "INBOX", "<m@x>"))
+
+    [price] = log.history("s@example.com", "price")
+    assert (price.uid, price.part, price.method) == (7, "body", "rules")
+    [dimensions] = log.history("s@example.com", "dimensions")
+    assert (dimensions.part, dimensions.method) == ("attachment:spec.xlsx", "rules")
+
+
+def test_price_list_products_are_logged(tmp_path, sender, price_list_agent):
+    log = ProvenanceLog(str(tmp_path))
+    manager = SupplierDataManager(provenance=log)
+    answer_supplier("s@example.com", "\n\n[Прайс price.xlsx: 2 блоков строк]", price_list_agent, manager,
+                    sender, price_list_blocks=["a", "b"], source=ProvenanceSource(9, "INBOX"))
+
+    product = manager.get_products("s@example.com")[0]
+    [entry] = log.history("s@example.com", product_field(product, "price"))
+    assert (entry.uid, entry.new, entry.part, entry.method) == (9, product["price"], "price_list:price.xlsx", "llm")
+
+
+def test_flush_writes_a_segment_before_the_threshold(tmp_path):
+    log = ProvenanceLog(str(tmp_path), flush_every=100)
+    log.record("s", {"price": "100"}, {})
+    log.flush()
+
+    reopened = ProvenanceLog(str(tmp_path))
+    assert [e.new for e in reopened.history("s", "price")] == ["100"]
+
+
+def test_compact_keeps_last_history_per_field(tmp_path):
+    log = ProvenanceLog(str(tmp_path), flush_every=1, history=3)
+    for i in range(5):
+        log.record("s", {"price": str(i), "weight": f"{i} кг"}, {})
+    log.record("t", {"price": "7"}, {})
+    log.compact()
+    log.record("s", {"price": "9"}, {"price": "4"})
+    log.flush()
+
+    assert [e.new for e in log.history("s", "price")] == ["2", "3", "4", "9"]
+    assert [e.new for e in log.history("t", "price")] == ["7"]
+    with open(log.snapshot_path, encoding="utf-8") as f:
+        assert sorted(tuple(json.loads(line)["k"]) for line in f) == [("s", "price"), ("s", "weight"), ("t", "price")]
+    log.close()
+    assert [e.new for e in ProvenanceLog(str(tmp_path)).history("s", "weight")] == ["2 кг", "3 кг", "4 кг"]
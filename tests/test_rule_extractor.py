@@ -0,0 +1,72 @@
+import pytest
+
+from rule_extractor import RuleExtractor, extract_dimensions, extract_material, extract_price, extract_weight
+
+FIELDS = ["product_name", "price", "dimensions", "weight", "material"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Стоимость 1 250,50 руб. за штуку", "1250.50 руб."),
+    ("Итого $12.5", "12.5 USD"),
+    ("Цена: 1250", "1250"),
+    ("Артикул 12345", None),
+    # Несколько разных цен – выбор остаётся LLM
+    ("100 руб. или 120 руб.", None),
+])
+def test_price(text, expected):
+    assert extract_price(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Габариты 120 x 60 x 75 см", "120x60x75 см"),
+    ("1200×600 мм", "1200x600 мм"),
+    ("Модель 2x4", None),
+])
+def test_dimensions(text, expected):
+    assert extract_dimensions(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Вес 12,5 кг", "12.5 кг"),
+    ("Вес: 500 г", "500 г"),
+    ("350 грамм", "350 грамм"),
+    ("Каталог 2024 г.", None),
+])
+def test_weight(text, expected):
+    assert extract_weight(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("стол из дуба", "дуб"),
+    ("дубовый стол", "дуб"),
+    ("корпус из нержавейки", "нержавеющая сталь"),
+    ("стеклянная полка", "стекло"),
+    ("Материал: ABS-пластик", "ABS-пластик"),
+    ("из дерева", "дерево"),
+    ("доставим в деревню", None),
+    ("in the absence of data", None),
+    ("массивный стол", None),
+    ("буквы на коробке", None),
+])
+def test_material(text, expected):
+    assert extract_material(text) == expected
+
+
+def test_labeled_fields():
+    extractor = RuleExtractor(FIELDS)
+    found = extractor.extract("Наименование: Стол обеденный\nЦена: 12 000 руб.\nМатериал: ясень")
+    assert found == {"product_name": "Стол обеденный", "price": "12000 руб.", "material": "ясень"}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Размер: 120x60", "120x60"),
+    ("Размер: 120 см", "120 см"),
+    ("Размер: 2 шт", None),
+    ("Размер: L", None),
+])
+def test_labeled_dimensions_need_shape_or_unit(text, expected):
+    assert RuleExtractor(FIELDS).extract(text).get("dimensions") == expected
+
+
+def test_nothing_found():
+    assert RuleExtractor(FIELDS).extract("Добрый день, пришлём позже") == {}
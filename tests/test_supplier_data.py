@@ -0,0 +1,155 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import openpyxl
+import pytest
+
+from agent_logic import SupplierDataManager, SupplierLLMAgent
+from llm_backends import LLMResponse
+from price_list import is_new_product
+from supplier_store import SQLiteSupplierDataManager
+
+TABLE = {"product_name": "Стол обеденный", "price": "12000 руб.", "dimensions": "120x80x75 см",
+         "weight": "30 кг", "material": "дуб"}
+
+
+class ScriptedDispatcher:
+    """
+    Вместо LLM: название товара по ключевому слову письма, остальные поля пустые.
+    """
+    def __init__(self, names):
+        self.names = names
+        self.requests = []
+
+    def chat(self, messages, response_format=None, **kwargs):
+        text = messages[-1]["content"]
+        self.requests.append(text)
+        fields = response_format["json_schema"]["schema"]["properties"]
+        letter = text.rsplit("Вот ответ поставщика:", 1)[-1]
+        name = next((v for k, v in self.names.items() if k in letter), "")
+        return LLMResponse(json.dumps({f: name if f == "product_name" else "" for f in fields}), "stub")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def manager(request, tmp_path):
+    if request.param == "memory":
+        yield SupplierDataManager()
+        return
+    manager = SQLiteSupplierDataManager(str(tmp_path / "suppliers.sqlite3"), import_excel="")
+    yield manager
+    manager.close()
+
+
+def test_is_new_product():
+    assert is_new_product(TABLE, {"product_name": "Стул"})
+    assert not is_new_product(TABLE, {"product_name": " стол  обеденный "})
+    assert not is_new_product(TABLE, {"product_name": ""})
+    assert not is_new_product({}, {"product_name": "Стул"})
+
+
+def test_second_product_in_delta_mode_gets_own_row(manager, monkeypatch):
+    monkeypatch.setenv("LLM_DELTA_EXTRACTION", "1")
+    dispatcher = ScriptedDispatcher({"стул": "Стул"})
+    agent = SupplierLLMAgent(dispatcher=dispatcher, clarification_cache=False)
+    manager.update_data("s1", TABLE)
+
+    parsed = agent.parse_supplier_answer(
+        "А ещё предлагаем стул: 500 руб., 40x40x90 см, 5 кг, сталь", manager.get_data("s1")
+    )
+    assert parsed["product_name"] == "Стул"
+    manager.update_data("s1", parsed)
+
+    products = {p["product_name"]: p for p in manager.get_products("s1")}
+    assert set(products) == {"Стол обеденный", "Стул"}
+    assert products["Стол обеденный"]["price"] == "12000 руб."
+    assert manager.get_data("s1")["product_name"] == "Стул"
+
+
+def test_nameless_fields_never_create_a_row(manager):
+    manager.update_data("s1", {"price": "500 руб."})
+    assert manager.get_products("s1") == []
+    manager.update_data("s1", TABLE)
+    manager.update_data("s1", {"dimensions": "40x40x90 см", "price": "500 руб."})
+    products = manager.get_products("s1")
+    assert len(products) == 1
+    assert products[0]["dimensions"] == "40x40x90 см"
+
+
+def test_complete_record_without_conflicts_skips_llm(manager):
+    dispatcher = ScriptedDispatcher({})
+    agent = SupplierLLMAgent(dispatcher=dispatcher, clarification_cache=False)
+    manager.update_data("s1", TABLE)
+    agent.parse_supplier_answer("Вес 30 кг, как и писали", manager.get_data("s1"))
+    assert dispatcher.requests == []
+
+
+@pytest.mark.parametrize("delta, requested", [("1", ["product_name", "weight", "material"]),
+                                               ("0", ["product_name", "price", "dimensions", "weight", "material"])])
+def test_single_call_requests_known_fields_only_outside_delta_mode(monkeypatch, delta, requested):
+    monkeypatch.setenv("LLM_DELTA_EXTRACTION", delta)
+    monkeypatch.setenv("RULE_EXTRACTOR", "0")
+    prompts = []
+
+    class Dispatcher:
+        def chat(self, messages, **kwargs):
+            prompts.append(messages[-1]["content"])
+            return LLMResponse(json.dumps({"fields": {"weight": "5 кг"}, "clarification": "Из чего сделан стол?"}))
+
+    agent = SupplierLLMAgent(dispatcher=Dispatcher(), clarification_cache=False)
+    known = {k: TABLE[k] for k in ("product_name", "price", "dimensions")}
+    fields, question = agent.extract_and_clarify("Вес 5 кг", known)
+
+    assert prompts[0].splitlines()[0] == f"Поля, которые нужны: {', '.join(requested)}."
+    assert fields["weight"] == "5 кг"
+    # Известные поля учитываются в вопросе в обоих режимах: не хватает только материала
+    assert question == "Из чего сделан стол?"
+
+
+def test_excel_export_is_imported_only_when_configured(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("SUPPLIER_IMPORT_EXCEL", raising=False)
+    wb = openpyxl.Workbook()
+    wb.active.append(["Supplier", "price"])
+    wb.active.append(["s1", "100 руб."])
+    wb.save("suppliers_data.xlsx")
+
+    manager = SQLiteSupplierDataManager("default.sqlite3")
+    assert len(manager.data) == 0
+    manager.close()
+    manager = SQLiteSupplierDataManager("imported.sqlite3", import_excel="suppliers_data.xlsx")
+    assert manager.get_data("s1") == {"price": "100 руб."}
+    manager.close()
+
+
+def test_sqlite_store_reopens_after_process_killed_mid_write(tmp_path):
+    path = str(tmp_path / "suppliers.sqlite3")
+    # Процесс сохраняет одно письмо и погибает посреди записи следующего, не закрыв базу
+    script = textwrap.dedent(f"""
+        import os
+        from supplier_store import SQLiteSupplierDataManager
+        manager = SQLiteSupplierDataManager({path!r}, import_excel="")
+        manager.update_data("s1", {TABLE!r})
+        manager._conn.execute("BEGIN")
+        manager._conn.execute(
+            "INSERT INTO supplier_fields (supplier, field, value, updated) VALUES ('s2', 'price', '1 руб.', 0)"
+        )
+        os._exit(9)
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, env={**os.environ, "PYTHONPATH": root})
+    assert result.returncode == 9
+    assert os.path.exists(path + "-wal")
+
+    manager = SQLiteSupplierDataManager(path, import_excel="")
+    try:
+        assert manager.get_data("s1") == TABLE
+        assert [p["product_name"] for p in manager.get_products("s1")] == ["Стол обеденный"]
+        # Незавершённая транзакция откатилась целиком
+        assert "s2" not in manager.data and manager.get_data("s2") == {}
+        manager.update_data("s2", {"price": "2 руб."})
+        assert manager.get_data("s2") == {"price": "2 руб."}
+    finally:
+        manager.close()
@@ -0,0 +1,75 @@
+from email.message import EmailMessage
+
+import pytest
+
+from supplier_identity import SupplierDirectory, canonical_address, message_ids
+
+
+@pytest.fixture
+def directory(tmp_path):
+    directory = SupplierDirectory(str(tmp_path / "suppliers.sqlite3"), cache_size=2)
+    yield directory
+    directory.close()
+
+
+def make_message(sender, message_id, in_reply_to=None, references=None):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["Message-ID"] = message_id
+    if in_reply_to:
+        msg["In-Reply-To"] = in_reply_to
+    if references:
+        msg["References"] = references
+    return msg
+
+
+def test_canonical_address_folds_aliases():
+    assert canonical_address('"ООО Ромашка" <Sales+RFQ@Ya.ru>') == "sales@yandex.ru"
+    assert canonical_address("ivan.petrov@yandex.com") == "ivan-petrov@yandex.ru"
+    assert canonical_address("J.Smith+quotes@googlemail.com") == "jsmith@gmail.com"
+    assert canonical_address("не адрес") == ""
+    assert message_ids("<a@x> <b@y>") == ["<a@x>", "<b@y>"]
+
+
+def test_same_mailbox_under_aliases_is_one_supplier(directory):
+    first = directory.identify(make_message("Sales <sales@ya.ru>", "<1@ya.ru>"))
+    second = directory.identify(make_message("SALES+rfq@yandex.ru", "<2@ya.ru>"))
+    assert first.supplier_id == second.supplier_id
+    assert not second.via_thread
+    assert directory.address(first.supplier_id) == "sales@yandex.ru"
+
+
+def test_reply_from_colleague_is_found_by_thread(directory):
+    first = directory.identify(make_message("sales@romashka.ru", "<1@romashka.ru>"))
+    directory.link("<our-reply@buyer.ru>", first.supplier_id)
+
+    reply = directory.identify(make_message(
+        "boss@romashka.ru", "<2@romashka.ru>", references="<1@romashka.ru> <our-reply@buyer.ru>",
+    ))
+    assert reply.via_thread and reply.supplier_id == first.supplier_id
+    assert reply.references == ["<1@romashka.ru>", "<our-reply@buyer.ru>"]
+    # Новый адрес закреплён за тем же поставщиком и дальше узнаётся без переписки
+    assert directory.supplier_id("boss@romashka.ru", create=False) == first.supplier_id
+    assert sorted(directory.known_addresses([first.supplier_id])) == ["boss@romashka.ru", "sales@romashka.ru"]
+
+
+def test_unknown_thread_falls_back_to_sender(directory):
+    other = directory.identify(make_message("other@supplier.ru", "<1@supplier.ru>"))
+    reply = directory.identify(make_message("new@supplier.ru", "<2@supplier.ru>", in_reply_to="<lost@buyer.ru>"))
+    assert not reply.via_thread
+    assert reply.supplier_id != other.supplier_id
+    assert directory.supplier_id("nobody@supplier.ru", create=False) is None
+
+
+def test_directory_survives_reopen_and_cache_eviction(tmp_path):
+    path = str(tmp_path / "suppliers.sqlite3")
+    directory = SupplierDirectory(path, cache_size=1)
+    ids = [directory.identify(make_message(f"s{i}@x.ru", f"<{i}@x.ru>")).supplier_id for i in range(3)]
+    directory.close()
+
+    reopened = SupplierDirectory(path, cache_size=1)
+    assert [reopened.supplier_id(f"s{i}@x.ru", create=False) for i in range(3)] == ids
+    reply = reopened.identify(make_message("s9@x.ru", "<9@x.ru>", in_reply_to="<0@x.ru>"))
+    assert reply.via_thread and reply.supplier_id == ids[0]
+    assert reopened.addresses(ids[:1]) == {ids[0]: "s0@x.ru"}
+    reopened.close()
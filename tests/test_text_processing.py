@@ -0,0 +1,37 @@
+from text_processing import html_to_text, preprocess_body, strip_quoted_reply, strip_signature
+
+
+def test_thanks_line_keeps_following_data():
+    text, _ = preprocess_body("Добрый день!\nСпасибо!\nЦена: 1 250 руб.\nВес: 12 кг\nМатериал: дуб")
+    assert text == "Добрый день!\nСпасибо!\nЦена: 1 250 руб.\nВес: 12 кг\nМатериал: дуб"
+
+
+def test_signature_with_contacts_is_cut():
+    text = "Цена 100 руб\n\nС уважением,\nИван Петров\nТел.: +7 (999) 123-45-67\nivan@example.ru\nwww.example.ru"
+    assert strip_signature(text) == "Цена 100 руб"
+
+
+def test_sign_off_followed_by_data_is_kept():
+    text = "Цена 100 руб\nС уважением,\nИван\nВес: 5 кг"
+    assert strip_signature(text) == text
+
+
+def test_rfc3676_signature():
+    assert strip_signature("Размеры 40x40x90 см\n-- \nООО Ромашка") == "Размеры 40x40x90 см"
+
+
+def test_quoted_reply_removed():
+    text = "Вес 12 кг\n\nOn Mon, 1 Jan 2024 at 10:00, Buyer <buyer@example.com> wrote:\n> Пришлите вес"
+    assert strip_quoted_reply(text) == "Вес 12 кг"
+
+
+def test_html_quotes_matched_by_class_token():
+    html = (
+        '<div>Цена 5</div>'
+        '<table class="quote-table"><tr><td>Вес</td><td>3 кг</td></tr></table>'
+        '<div class="gmail_quote">старое письмо</div>'
+        '<blockquote type="cite">цитата</blockquote>'
+    )
+    text = html_to_text(html)
+    assert "Цена 5" in text and "3 кг" in text
+    assert "старое письмо" not in text and "цитата" not in text
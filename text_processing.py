@@ -0,0 +1,290 @@
+import os
+import re
+from dataclasses import dataclass, field
+from html import unescape
+from html.parser import HTMLParser
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора: около 3 символов на токен
+    (для кириллицы и цифр это ближе к правде, чем классические 4 для английского).
+    """
+    return (len(text) + 2) // 3
+
+
+def detect_language(text: str) -> str:
+    """
+    Язык письма для ответа: "ru", если среди букв заметная доля кириллицы, иначе "en".
+    """
+    letters = [c for c in text[:4000] if c.isalpha()]
+    if not letters:
+        return "ru"
+    cyrillic = sum(1 for c in letters if "\u0400" <= c <= "\u04ff")
+    return "ru" if cyrillic / len(letters) > 0.3 else "en"
+
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "section", "article",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "hr",
+}
+_SKIP_TAGS = {"script", "style", "head", "title"}
+# Классы, которыми почтовые клиенты помечают цитату (сравниваются целыми словами class)
+_QUOTE_CLASSES = {"gmail_quote", "gmail_quote_container", "yahoo_quoted", "moz-cite-prefix", "protonmail_quote"}
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Собирает видимый текст HTML-письма. Цитаты (<blockquote type="cite">, div.gmail_quote и т.п.)
+    выбрасываются сразу – это та же история переписки, что и строки с '>' в text/plain.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_tag = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").lower().split())
+        quote = bool(classes & _QUOTE_CLASSES) or (tag == "blockquote" and (attrs.get("type") or "").lower() == "cite")
+        if tag in _SKIP_TAGS or quote:
+            if tag not in ("br", "hr", "img"):
+                self._skip_tag, self._skip_depth = tag, 1
+            return
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_tag:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """
+    Превращает HTML в компактный текст: без тегов, стилей, скриптов и цитат,
+    с переносами строк на месте блоков и схлопнутыми пробелами.
+    """
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = "".join(parser.parts)
+    except Exception as e:
+        print(f"Ошибка разбора HTML, убираем теги регулярным выражением: {e}")
+        text = unescape(re.sub(r"<[^>]+>", " ", html))
+    return _compact("\n".join(line.strip(" |") for line in text.splitlines()))
+
+
+def _compact(text: str) -> str:
+    text = text.replace("\r\n", "\n").replace("\xa0", " ")
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+# «On Mon, 1 Jan 2024 ... wrote:», «пн, 1 янв. 2024 г. в 10:00, Иван <a@b.ru>:»,
+# «01.01.2024, 10:00, "Иван" <a@b.ru>:», «... написал(а):»
+_REPLY_MARKERS = [
+    re.compile(r"^\s*On\b.+\bwrote:\s*$", re.I),
+    re.compile(r"^.*(написал|написала|написал\(а\)|пишет)\s*:\s*$", re.I),
+    re.compile(r"^.{0,120}<[^<>@\s]+@[^<>\s]+>\s*:\s*$"),
+]
+# Outlook и пересылки: после такой строки идёт только старая переписка
+_HISTORY_MARKER = re.compile(r"^\s*-{2,}\s*(Original Message|Исходное сообщение)\s*-{2,}\s*$", re.I)
+# Блок заголовков Outlook: «From:/От:», а следом «Sent:/Отправлено:/Date:/Дата:»
+_HISTORY_FROM = re.compile(r"^\s*(From|От)\s*:.+$", re.I)
+_HISTORY_SENT = re.compile(r"^\s*(Sent|Date|To|Отправлено|Дата|Кому)\s*:", re.I)
+
+
+def _is_history_start(lines, index) -> bool:
+    if _HISTORY_MARKER.match(lines[index]):
+        return True
+    return bool(_HISTORY_FROM.match(lines[index])) and any(
+        _HISTORY_SENT.match(line) for line in lines[index + 1:index + 4]
+    )
+
+
+def strip_quoted_reply(text: str) -> str:
+    """
+    Убирает цитируемую переписку: строки с '>' и всё, что идёт после маркера ответа
+    («On ... wrote:», «... написал(а):», «-----Original Message-----»).
+    Если после маркера поставщик отвечал вперемешку с цитатами, его строки сохраняются.
+    """
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        if index > 0 and _is_history_start(lines, index):
+            lines = lines[:index]
+            break
+        if any(marker.match(line) for marker in _REPLY_MARKERS):
+            tail = lines[index + 1:]
+            if any(t.lstrip().startswith(">") for t in tail):
+                # Ответ вперемешку с цитатой: выкидываем только маркер, цитаты уйдут ниже
+                lines = lines[:index] + tail
+            else:
+                lines = lines[:index]
+            break
+    return _compact("\n".join(line for line in lines if not line.lstrip().startswith(">")))
+
+
+_SIGNATURE_MARKERS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^_{5,}\s*$"),
+    # Только отдельная строка-завершение. Голое «Спасибо!» / «Thanks» сюда не входит:
+    # им часто начинают ответ, и данные идут следом
+    re.compile(r"^\s*(с уважением|с наилучшими пожеланиями|всего доброго|"
+               r"best regards|kind regards|regards)[\s,.!]*$", re.I),
+    re.compile(r"^\s*(отправлено с|отправлено из|sent from my)\b.*$", re.I),
+]
+_SIGNATURE_MAX_LINES = 12
+# Контакты в подписи (телефон, почта, сайт) – цифры в них данными о товаре не считаются
+_CONTACT = re.compile(r"\+?\d[\d\s()\-]{6,}\d|\S+@\S+|(https?://|www\.)\S+", re.I)
+_CONTACT_KEY = re.compile(
+    r"^\s*(тел|телефон|моб|мобильный|факс|phone|tel|mobile|mob|fax|e-?mail|почта|сайт|web|skype|"
+    r"telegram|whatsapp|viber)\b", re.I
+)
+_KEY_VALUE = re.compile(r"^\s*[^:]{1,40}:\s*\S")
+
+
+def _looks_like_data(line: str) -> bool:
+    """
+    Похожа ли строка на данные, а не на подпись: «ключ: значение» или цифры
+    (цена, вес, размеры) помимо телефонов, адресов почты и ссылок.
+    """
+    if _CONTACT_KEY.match(line):
+        return False
+    if _KEY_VALUE.match(line):
+        return True
+    return any(c.isdigit() for c in _CONTACT.sub(" ", line))
+
+
+def strip_signature(text: str) -> str:
+    """
+    Отрезает подпись: всё после «-- » (RFC 3676) или вежливого завершения
+    («С уважением», «Best regards», «Отправлено с iPhone»), если до конца письма
+    осталось не больше нескольких строк и среди них нет ничего похожего на данные
+    (цены, размеры, «Вес: 12 кг»).
+    """
+    lines = text.splitlines()
+    start = max(1, len(lines) - _SIGNATURE_MAX_LINES)
+    for index in range(start, len(lines)):
+        if any(marker.match(lines[index]) for marker in _SIGNATURE_MARKERS):
+            if any(_looks_like_data(line) for line in lines[index + 1:]):
+                continue
+            return _compact("\n".join(lines[:index]))
+    return text
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Обрезает текст по границе строки так, чтобы он уложился в max_tokens.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for line in text.splitlines():
+        tokens = estimate_tokens(line + "\n")
+        if used + tokens > max_tokens:
+            break
+        kept.append(line)
+        used += tokens
+    if not kept:
+        kept = [text[:max_tokens * 3]]
+    return "\n".join(kept) + "\n[...текст письма обрезан]"
+
+
+@dataclass
+class PreprocessReport:
+    """
+    Сколько токенов (по оценке) было до и после каждого шага подготовки тела письма.
+    """
+    steps: list = field(default_factory=list)
+
+    def add(self, name: str, before: str, after: str):
+        self.steps.append((name, estimate_tokens(before), estimate_tokens(after)))
+
+    @property
+    def saved(self) -> int:
+        return sum(before - after for _, before, after in self.steps)
+
+    def summary(self) -> str:
+        if not self.steps:
+            return "нечего обрабатывать"
+        parts = [f"{name} −{before - after}" for name, before, after in self.steps if before != after]
+        total = f"{self.steps[0][1]} → {self.steps[-1][2]} токенов"
+        return f"{total} ({', '.join(parts)})" if parts else total
+
+
+def extract_body(msg):
+    """
+    Возвращает (текст, это_html) тела письма: text/plain предпочтительнее text/html,
+    вложения не считаются телом.
+    """
+    plain, html = None, None
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        disp = str(part.get("Content-Disposition") or "")
+        if "attachment" in disp:
+            continue
+        ctype = part.get_content_type()
+        if ctype not in ("text/plain", "text/html"):
+            continue
+        payload = part.get_payload(decode=True) or b""
+        try:
+            text = payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+        except LookupError:
+            text = payload.decode("utf-8", errors="ignore")
+        if ctype == "text/plain" and plain is None:
+            plain = text
+        elif ctype == "text/html" and html is None:
+            html = text
+    if plain is not None and plain.strip():
+        return plain, False
+    if html is not None:
+        return html, True
+    return plain or "", False
+
+
+def preprocess_body(text: str, is_html=False, max_tokens=None):
+    """
+    Готовит тело письма для LLM: HTML -> текст, без цитат и подписи, в пределах
+    бюджета BODY_MAX_TOKENS. Возвращает (текст, PreprocessReport).
+    """
+    max_tokens = int(max_tokens if max_tokens is not None else os.getenv("BODY_MAX_TOKENS", "3000"))
+    report = PreprocessReport()
+
+    if is_html:
+        result = html_to_text(text)
+        report.add("html→текст", text, result)
+        text = result
+    else:
+        result = _compact(text)
+        report.add("пробелы", text, result)
+        text = result
+
+    for name, step in (("цитаты", strip_quoted_reply), ("подпись", strip_signature)):
+        result = step(text)
+        report.add(name, text, result)
+        text = result
+
+    result = truncate_to_budget(text, max_tokens)
+    report.add("бюджет", text, result)
+    return result, report